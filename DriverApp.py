@@ -1,9 +1,14 @@
 # DriverApp.py — Hazmat Dashboard-Parity Edition (Crash-proof, complete)
 
 import json
+import time
+import uuid
 import requests
 import numpy as np
 
+# Shared keep-alive session: job polls and scans reuse one TLS connection.
+http = requests.Session()
+
 # Optional heavy deps: guard to avoid hard crash if missing at runtime
 try:
     import cv2
@@ -35,6 +40,10 @@ from plyer import gps
 from geopy.geocoders import Nominatim
 
 BACKEND_URL = "https://hazmat-collection.onrender.com"
+# GPS fixes arrive every second or so; the backend only needs one this often.
+LOCATION_PING_SECONDS = 15
+# A scan POST that fails in transit or with a 5xx/409 is resent (same key) this often.
+SCAN_ATTEMPTS = 3
 
 DRIVER_CREDENTIALS = {
     "Nkosa": {"password": "NK", "code": "NK"},
@@ -198,12 +207,16 @@ class BaseJobScreen(Screen):
                 self.grid.add_widget(Label(text="No driver code — please login", color=RED, size_hint_y=None, height=28))
                 return
 
-            res = requests.get(f"{BACKEND_URL}/{self.endpoint}/{code}", timeout=10)
+            res = http.get(f"{BACKEND_URL}/{self.endpoint}/{code}", timeout=10)
             try:
                 data = res.json()
             except ValueError:
                 data = res.text
             jobs = [_normalize_job_fields(j) for j in _sanitize_jobs(data)]
+            # /driver/{code} lists the day's stops in route order; the map draws
+            # from it. Deliveries come unordered, so they must not replace it.
+            if self.endpoint == "driver":
+                self.manager.route_jobs = jobs
 
             if not jobs:
                 self.grid.add_widget(Label(text="No jobs assigned", color=TEXT_PRIMARY, size_hint_y=None, height=28))
@@ -218,7 +231,7 @@ class BaseJobScreen(Screen):
         self.manager.active_job = job
         self.manager.current = "map"
         try:
-            requests.post(f"{BACKEND_URL}/update_status", json={
+            http.post(f"{BACKEND_URL}/update_status", json={
                 "ref": job.get("hazjnb_ref", ""),
                 "status": "in_progress",
                 "driver_id": self.manager.driver_code
@@ -253,6 +266,7 @@ class MapScreen(Screen):
         self.route_line = None
         self.driver_lat = None
         self.driver_lon = None
+        self.last_ping = 0
 
     def on_enter(self):
         self.geocode_collection()
@@ -263,6 +277,11 @@ class MapScreen(Screen):
             job = getattr(self.manager, 'active_job', None)
             if not job or "address" not in job:
                 return
+            if job.get("lat") is not None and job.get("lng") is not None:
+                self.collection_marker = MapMarker(lat=job["lat"], lon=job["lng"])
+                self.mapview.add_marker(self.collection_marker)
+                self.mapview.center_on(job["lat"], job["lng"])
+                return
             address = f"{job['address']}, Gauteng, South Africa"
             geolocator = Nominatim(user_agent="hazmat_driver")
             location = geolocator.geocode(address, timeout=10)
@@ -295,12 +314,27 @@ class MapScreen(Screen):
         self.driver_marker = MapMarker(lat=self.driver_lat, lon=self.driver_lon)
         self.mapview.add_marker(self.driver_marker)
         self.draw_route()
+        self.report_location()
+
+    def report_location(self):
+        code = getattr(self.manager, 'driver_code', None)
+        if not code or time.time() - self.last_ping < LOCATION_PING_SECONDS:
+            return
+        self.last_ping = time.time()
+        try:
+            http.post(f"{BACKEND_URL}/ops/update_location",
+                      json={"driver": code, "lat": self.driver_lat, "lng": self.driver_lon}, timeout=5)
+        except Exception as e:
+            print(f"❌ Location update failed: {e}")
 
     def draw_route(self):
         if not self.driver_lat or not self.driver_lon or not self.collection_marker:
             return
-        x1, y1 = self.mapview.get_window_xy_from(lat=self.driver_lat, lon=self.driver_lon, zoom=self.mapview.zoom)
-        x2, y2 = self.mapview.get_window_xy_from(lat=self.collection_marker.lat, lon=self.collection_marker.lon, zoom=self.mapview.zoom)
+        stops = [(self.driver_lat, self.driver_lon), (self.collection_marker.lat, self.collection_marker.lon)]
+        stops += self.remaining_stops()
+        points = []
+        for lat, lon in stops:
+            points += self.mapview.get_window_xy_from(lat=lat, lon=lon, zoom=self.mapview.zoom)
         if self.route_line:
             try:
                 self.mapview.canvas.remove(self.route_line)
@@ -308,7 +342,16 @@ class MapScreen(Screen):
                 pass
         with self.mapview.canvas:
             Color(*RED)
-            self.route_line = Line(points=[x1, y1, x2, y2], width=2)
+            self.route_line = Line(points=points, width=2)
+
+    def remaining_stops(self):
+        # Stops after the active one on the same day's route, in route order.
+        job = getattr(self.manager, 'active_job', None) or {}
+        if not job.get("stop"):
+            return []
+        return [(j["lat"], j["lng"]) for j in getattr(self.manager, 'route_jobs', None) or []
+                if isinstance(j, dict) and j.get("stop") and j.get("pickup_date") == job.get("pickup_date")
+                and j["stop"] > job["stop"] and j.get("lat") is not None and j.get("lng") is not None]
 
 class CameraScreen(Screen):
     def __init__(self, **kwargs):
@@ -390,22 +433,37 @@ class CameraScreen(Screen):
                 return
 
     def confirm_scan(self, ref):
-        try:
-            res = requests.post(f"{BACKEND_URL}/scan_qr", json={
-                "ref": ref,
-                "driver_id": self.manager.driver_code
-            }, timeout=10)
+        # One key per scan, reused by every retry below: if the first POST got
+        # through but its reply was lost, the retry is replayed instead of
+        # logging the scan twice. Scanning the waybill again gets a new key.
+        key = f"scan-{ref}-{self.manager.driver_code}-{uuid.uuid4().hex}"
+        res, error = None, None
+        for attempt in range(SCAN_ATTEMPTS):
+            if attempt:
+                time.sleep(attempt)
             try:
-                payload = res.json()
-                timestamp = payload.get("timestamp", "")
+                res = http.post(f"{BACKEND_URL}/scan_qr", json={
+                    "ref": ref,
+                    "driver_id": self.manager.driver_code
+                }, headers={"Idempotency-Key": key}, timeout=10)
+                error = None
+            except requests.RequestException as e:
+                res, error = None, e
+                continue
+            if res.status_code < 500 and res.status_code != 409:
+                break
+        if res is not None and res.ok:
+            try:
+                timestamp = res.json().get("timestamp", "")
             except Exception:
                 timestamp = ""
             Popup(title="Scan Confirmed",
                   content=Label(text=f"✅ QR scan confirmed\n{timestamp}", color=TEXT_PRIMARY),
                   size_hint=(None, None), size=(320, 220)).open()
-        except Exception as e:
+        else:
+            reason = error or (f"HTTP {res.status_code}" if res is not None else "no response")
             Popup(title="Scan Error",
-                  content=Label(text=f"❌ Scan error: {e}", color=RED),
+                  content=Label(text=f"❌ Scan error: {reason}", color=RED),
                   size_hint=(None, None), size=(320, 220)).open()
         self.manager.current = "collections"
 
@@ -415,6 +473,7 @@ class DriverApp(App):
         sm.driver_code = None
         sm.collection_ref = None
         sm.active_job = None
+        sm.route_jobs = []
 
         sm.add_widget(LoginScreen(name="login"))
         sm.add_widget(BaseJobScreen(name="collections", title="📦 Assigned Collections", endpoint="driver"))
@@ -0,0 +1,127 @@
+# addressbook.py
+# Prefix index over each client's saved addresses for the booking-form
+# autocomplete. Every word of label, company and address is kept in a sorted
+# list, so a query word is a bisect range instead of a scan of all sites. Indexes
+# are built on first search and held in an LRU keyed by client id; saving an
+# address invalidates that client's index.
+import re, sqlite3, threading
+from bisect import bisect_left
+from collections import OrderedDict
+
+DB_PATH = "hazmat.db"
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+MAX_CLIENTS = 256
+
+FIELDS = ("id", "label", "type", "company", "address", "contact_person", "contact_number", "email", "lat", "lng", "confidence")
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    return _WORD.findall((text or "").lower())
+
+
+class AddressIndex:
+    def __init__(self, rows):
+        self.records = {}
+        self.words = {}
+        postings = []
+        for row in rows:
+            record = dict(zip(FIELDS, row))
+            self.records[record["id"]] = record
+            words = set(tokenize(record["label"]) + tokenize(record["company"]) + tokenize(record["address"]))
+            self.words[record["id"]] = words
+            postings.extend((word, record["id"]) for word in words)
+        postings.sort()
+        self.postings = postings
+        self.order = sorted(self.records, key=lambda i: ((self.records[i]["label"] or "").lower(), i))
+        self.rank = {record_id: n for n, record_id in enumerate(self.order)}
+
+    def _prefix_ids(self, prefix):
+        ids = set()
+        i = bisect_left(self.postings, (prefix,))
+        while i < len(self.postings) and self.postings[i][0].startswith(prefix):
+            ids.add(self.postings[i][1])
+            i += 1
+        return ids
+
+    def search(self, q, limit=DEFAULT_LIMIT):
+        terms = tokenize(q)
+        if not terms:
+            return [self.records[i] for i in self.order[:limit]]
+        # Bisect on the longest term (narrowest range), then check the rest per candidate.
+        terms.sort(key=len, reverse=True)
+        candidates = self._prefix_ids(terms[0])
+        rest = terms[1:]
+        matches = []
+        for i in sorted(candidates, key=self.rank.__getitem__):
+            if all(any(w.startswith(t) for w in self.words[i]) for t in rest):
+                matches.append(self.records[i])
+                if len(matches) == limit:
+                    break
+        return matches
+
+
+_indexes = OrderedDict()
+_lock = threading.Lock()
+
+
+def _load(client_id):
+    conn = sqlite3.connect(DB_PATH)
+    rows = conn.execute(
+        f"SELECT {', '.join(FIELDS)} FROM saved_addresses WHERE client_id = ?", (client_id,)
+    ).fetchall()
+    conn.close()
+    return AddressIndex(rows)
+
+
+def index_for(client_id):
+    client_id = int(client_id)
+    with _lock:
+        index = _indexes.get(client_id)
+        if index is not None:
+            _indexes.move_to_end(client_id)
+            return index
+    index = _load(client_id)
+    with _lock:
+        _indexes[client_id] = index
+        while len(_indexes) > MAX_CLIENTS:
+            _indexes.popitem(last=False)
+    return index
+
+
+def search(client_id, q, limit=DEFAULT_LIMIT):
+    limit = max(1, min(int(limit or DEFAULT_LIMIT), MAX_LIMIT))
+    return index_for(client_id).search(q or "", limit)
+
+
+def get(client_id, address_id):
+    # A client's own saved address by id, or None (also for another client's id).
+    return index_for(client_id).records.get(int(address_id))
+
+
+def store_geocode(client_id, address_id, lat, lng, confidence):
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute(
+        "UPDATE saved_addresses SET lat = ?, lng = ?, confidence = ? WHERE id = ? AND client_id = ?",
+        (lat, lng, confidence, address_id, client_id),
+    )
+    conn.commit()
+    conn.close()
+    with _lock:
+        index = _indexes.get(int(client_id))
+    record = index.records.get(int(address_id)) if index else None
+    if record is not None:
+        record.update(lat=lat, lng=lng, confidence=confidence)
+
+
+def invalidate(client_id=None):
+    with _lock:
+        if client_id is None:
+            _indexes.clear()
+        else:
+            _indexes.pop(int(client_id), None)
+
+
+def stats():
+    return {"clients": len(_indexes), "addresses": sum(len(i.records) for i in _indexes.values())}
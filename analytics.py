@@ -0,0 +1,206 @@
+# analytics.py
+# SLA / turnaround reporting: p50/p90/p99 booking->collection and
+# collection->delivery times per branch, driver and shipment type.
+#
+# Rows are streamed from SQLite in fixed-size chunks and folded into log-scale
+# histograms (~1% relative error), so memory is bounded by the number of groups,
+# not by the number of shipments in the period.
+import sqlite3, math, threading, time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+
+import events
+from ops_stats import parse_timestamp
+
+DB_PATH = "hazmat.db"
+CHUNK_SIZE = 5000
+PERCENTILES = (50, 90, 99)
+# Reports for periods still running are recomputed after CACHE_TTL_SECONDS;
+# closed periods only change through late scans or deliveries, which also
+# clear the cache, so they are kept longer.
+CACHE_TTL_SECONDS = 300
+CLOSED_CACHE_TTL_SECONDS = 3600
+CACHE_MAX_ENTRIES = 64
+
+_RELATIVE_ACCURACY = 0.01
+_GAMMA = (1 + _RELATIVE_ACCURACY) / (1 - _RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+
+_report_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+class LatencyHistogram:
+    """Log-bucketed histogram; quantiles come back within ~1% of the true value."""
+
+    __slots__ = ("buckets", "count", "total", "zeros")
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.zeros = 0
+
+    def add(self, minutes):
+        self.count += 1
+        self.total += minutes
+        if minutes < 1e-3:
+            self.zeros += 1
+            return
+        key = math.ceil(math.log(minutes) / _LOG_GAMMA)
+        self.buckets[key] = self.buckets.get(key, 0) + 1
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q / 100.0 * (self.count - 1)
+        if rank < self.zeros:
+            return 0.0
+        seen = self.zeros
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen > rank:
+                return 2 * _GAMMA ** key / (_GAMMA + 1)
+        return 2 * _GAMMA ** max(self.buckets) / (_GAMMA + 1)
+
+    def summary(self):
+        out = {"count": self.count, "mean": round(self.total / self.count, 1) if self.count else None}
+        for p in PERCENTILES:
+            value = self.quantile(p)
+            out[f"p{p}"] = round(value, 1) if value is not None else None
+        return out
+
+
+def _iter_shipments(conn, date_from, date_to):
+    # One pass over requests in the period with the first scan and the first
+    # completion attached. Completed rows written before completed.haz_ref existed
+    # are matched through updates.ops -> updates.haz.
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT r.timestamp, r.collection_region, r.assigned_driver, r.service_type,
+               (SELECT MIN(s.timestamp) FROM scan_log s
+                 WHERE s.reference_number = r.reference_number) AS collected_at,
+               COALESCE(
+                   (SELECT MIN(c.delivery_date || ' ' || COALESCE(c.time, '')) FROM completed c
+                     WHERE c.haz_ref = r.reference_number),
+                   (SELECT MIN(c.delivery_date || ' ' || COALESCE(c.time, ''))
+                      FROM updates u JOIN completed c ON c.ops = u.ops AND c.haz_ref IS NULL
+                     WHERE u.haz = r.reference_number)
+               ) AS delivered_at
+        FROM requests r
+        WHERE r.timestamp >= ? AND r.timestamp < ?
+    """, (date_from, date_to))
+    while True:
+        rows = cursor.fetchmany(CHUNK_SIZE)
+        if not rows:
+            break
+        yield from rows
+
+
+def _minutes_between(start, end):
+    if not start or not end:
+        return None
+    minutes = (end - start).total_seconds() / 60.0
+    return minutes if minutes >= 0 else None
+
+
+def compute_sla_report(date_from, date_to):
+    """Turnaround percentiles for bookings made in [date_from, date_to]."""
+    end_exclusive = (date.fromisoformat(date_to) + timedelta(days=1)).isoformat()
+    started = time.perf_counter()
+
+    groups = {}
+
+    def hist(dimension, key, metric):
+        g = groups.setdefault(dimension, {}).setdefault(key or "Unknown", {})
+        if metric not in g:
+            g[metric] = LatencyHistogram()
+        return g[metric]
+
+    conn = sqlite3.connect(DB_PATH)
+    rows = 0
+    try:
+        for booked_at, region, driver, service_type, collected_at, delivered_at in \
+                _iter_shipments(conn, date_from, end_exclusive):
+            rows += 1
+            booked = parse_timestamp(booked_at)
+            collected = parse_timestamp(collected_at)
+            delivered = parse_timestamp(delivered_at)
+            durations = (
+                ("booking_to_collection", _minutes_between(booked, collected)),
+                ("collection_to_delivery", _minutes_between(collected, delivered)),
+            )
+            for metric, minutes in durations:
+                if minutes is None:
+                    continue
+                hist("all", "all", metric).add(minutes)
+                hist("branch", region, metric).add(minutes)
+                hist("driver", driver, metric).add(minutes)
+                hist("shipment_type", service_type, metric).add(minutes)
+    finally:
+        conn.close()
+
+    report = {
+        "date_from": date_from,
+        "date_to": date_to,
+        "shipments": rows,
+        "unit": "minutes",
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "elapsed_ms": None,
+    }
+    for dimension, keyed in groups.items():
+        if dimension == "all":
+            report["overall"] = {m: h.summary() for m, h in keyed["all"].items()}
+        else:
+            report[dimension] = {k: {m: h.summary() for m, h in metrics.items()} for k, metrics in keyed.items()}
+    report.setdefault("overall", {})
+    report["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return report
+
+
+def period_bounds(period=None, date_from=None, date_to=None):
+    """(date_from, date_to) as ISO dates. period: "YYYY", "YYYY-MM" or
+    "YYYY-MM-DD"; otherwise explicit bounds, defaulting to the current month.
+    Raises ValueError for anything else."""
+    if period:
+        parts = period.split("-")
+        if len(parts) == 1 and parts[0].isdigit() and len(parts[0]) == 4:
+            return f"{parts[0]}-01-01", f"{parts[0]}-12-31"
+        if len(parts) == 2 and all(p.isdigit() for p in parts):
+            first = date(int(parts[0]), int(parts[1]), 1)
+            next_month = (first.replace(day=28) + timedelta(days=4)).replace(day=1)
+            return first.isoformat(), (next_month - timedelta(days=1)).isoformat()
+        day = date.fromisoformat(period).isoformat()
+        return day, day
+    today = date.today()
+    start = date.fromisoformat(date_from) if date_from else today.replace(day=1)
+    end = date.fromisoformat(date_to) if date_to else today
+    if start > end:
+        raise ValueError("date_from is after date_to")
+    return start.isoformat(), end.isoformat()
+
+
+def get_sla_report(period=None, date_from=None, date_to=None):
+    date_from, date_to = period_bounds(period, date_from, date_to)
+    key = (date_from, date_to)
+    ttl = CLOSED_CACHE_TTL_SECONDS if date_to < date.today().isoformat() else CACHE_TTL_SECONDS
+    with _cache_lock:
+        cached = _report_cache.get(key)
+        if cached and time.monotonic() - cached[0] < ttl:
+            _report_cache.move_to_end(key)
+            return {**cached[1], "cached": True}
+    report = compute_sla_report(date_from, date_to)
+    with _cache_lock:
+        _report_cache[key] = (time.monotonic(), report)
+        _report_cache.move_to_end(key)
+        while len(_report_cache) > CACHE_MAX_ENTRIES:
+            _report_cache.popitem(last=False)
+    return {**report, "cached": False}
+
+
+@events.subscribe("status")
+@events.subscribe("assignments")
+def clear_cache(event=None):
+    # A scan, delivery or (re)assignment can move any period's numbers.
+    with _cache_lock:
+        _report_cache.clear()
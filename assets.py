@@ -0,0 +1,115 @@
+# assets.py
+# Fingerprinted static assets. Shared CSS/JS under static/css and static/js is
+# copied to static/dist/<name>.<hash>.<ext> with .gz (and .br when brotli is
+# installed) siblings. Pages link the hashed URL, so the files can be cached
+# as immutable and a content change simply produces a new URL.
+import os, gzip, hashlib, json, mimetypes, anyio
+from starlette.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+import compression
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = "static"
+DIST_DIR = os.path.join(STATIC_DIR, "dist")
+SOURCES = ["css/site.css", "js/site.js"]
+# Unhashed static files that still get prebuilt .gz/.br siblings. Images are
+# left out: PNG is already compressed and would not shrink.
+PRECOMPRESSED = ["style.css"]
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Customer files under static/ that the public mount must not serve: shipment
+# documents uploaded with bookings, and backups written by older deployments.
+PRIVATE_DIRS = ("uploads", "backups")
+
+_manifest = {}
+
+
+def precompress(path, fast=False):
+    # Write .gz/.br siblings next to path; StaticFiles serves them when accepted.
+    # fast=True trades ratio for speed on files rewritten at runtime.
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(path + ".gz", "wb") as f:
+        f.write(gzip.compress(data, compresslevel=6 if fast else 9, mtime=0))
+    if brotli is not None:
+        with open(path + ".br", "wb") as f:
+            f.write(brotli.compress(data, quality=5 if fast else 11))
+
+
+def build():
+    os.makedirs(DIST_DIR, exist_ok=True)
+    manifest = {}
+    for source in SOURCES:
+        with open(os.path.join(STATIC_DIR, source), "rb") as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        stem, ext = os.path.splitext(os.path.basename(source))
+        hashed = f"{stem}.{digest}{ext}"
+        target = os.path.join(DIST_DIR, hashed)
+        if not os.path.exists(target):
+            with open(target, "wb") as f:
+                f.write(data)
+            precompress(target)
+        manifest[source] = f"/static/dist/{hashed}"
+    for name in PRECOMPRESSED:
+        path = os.path.join(STATIC_DIR, name)
+        if os.path.exists(path) and (not os.path.exists(path + ".gz")
+                                     or os.path.getmtime(path + ".gz") < os.path.getmtime(path)):
+            precompress(path)
+    with open(os.path.join(DIST_DIR, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    _manifest.clear()
+    _manifest.update(manifest)
+    return manifest
+
+
+def asset_url(source):
+    if not _manifest:
+        build()
+    return _manifest[source]
+
+
+def head_tags():
+    # <link>/<script> tags for the shared embed-page shell.
+    return (
+        f'<link rel="stylesheet" href="{asset_url("css/site.css")}">\n'
+        f'    <script src="{asset_url("js/site.js")}" defer></script>\n'
+    )
+
+
+class AssetStaticFiles(StaticFiles):
+    """StaticFiles that serves precompressed .br/.gz siblings when the client
+    accepts them and the sibling is at least as new as the original, and marks
+    fingerprinted files under dist/ as immutable."""
+
+    encodings = (("br", ".br"), ("gzip", ".gz"))
+
+    async def get_response(self, path, scope):
+        if os.path.normpath(path).replace(os.sep, "/").split("/")[0] in PRIVATE_DIRS:
+            raise HTTPException(status_code=404)
+        accept = Headers(scope=scope).get("accept-encoding", "")
+        response = None
+        if scope["method"] in ("GET", "HEAD") and not path.endswith((".gz", ".br")):
+            for encoding, suffix in self.encodings:
+                if not compression.accepts(accept, encoding):
+                    continue
+                full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, path + suffix)
+                if stat_result is None:
+                    continue
+                _, original = await anyio.to_thread.run_sync(self.lookup_path, path)
+                if original is None or stat_result.st_mtime < original.st_mtime:
+                    continue
+                response = self.file_response(full_path, stat_result, scope)
+                response.headers["content-type"] = mimetypes.guess_type(path)[0] or "application/octet-stream"
+                response.headers["content-encoding"] = encoding
+                response.headers["vary"] = "Accept-Encoding"
+                break
+        if response is None:
+            response = await super().get_response(path, scope)
+        if path.startswith("dist/") and response.status_code in (200, 304):
+            response.headers["cache-control"] = IMMUTABLE
+        return response
@@ -0,0 +1,108 @@
+"""Bytes on the wire and CPU cost per request for response compression.
+
+Runs representative payloads (an /ops/collections list at several history
+sizes, an HTML page, the backup JSON) through CompressionMiddleware with a bare
+ASGI app at gzip levels 1/6/9 (and brotli 4/11 when installed), and reports compressed size, ratio and CPU
+microseconds per request.
+
+    python benchmarks/bench_compression.py [--requests 200] [--json out.json]
+"""
+import argparse, asyncio, json, os, random, sys, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import compression  # noqa: E402
+
+
+def collections_payload(rows):
+    rnd = random.Random(rows)
+    return json.dumps([
+        {
+            "id": i,
+            "hazjnb_ref": f"HAZJNB{i:04d}",
+            "company": rnd.choice(["Sasol Chemicals", "AECI Mining", "Omnia Holdings", "BASF SA"]),
+            "address": f"{rnd.randint(1, 400)} Main Reef Road, Boksburg, Johannesburg, 14{rnd.randint(10, 99)}",
+            "pickup_date": f"2025-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}",
+            "service_type": rnd.choice(["local", "export", "import"]),
+            "driver": rnd.choice(["HK", "MV", "Unassigned"]),
+            "status": rnd.choice(["Unassigned", "Assigned", "Collected", "Delivered"]),
+            "timestamp": f"2025-10-{rnd.randint(1, 28):02d}T{rnd.randint(0, 23):02d}:{rnd.randint(0, 59):02d}:00",
+        }
+        for i in range(rows)
+    ]).encode()
+
+
+def file_payload(path):
+    with open(os.path.join(ROOT, path), "rb") as f:
+        return f.read()
+
+
+def make_app(body, content_type):
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", content_type), (b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
+    return app
+
+
+async def run_once(middleware, accept):
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": "/", "headers": [(b"accept-encoding", accept)]}
+    await middleware(scope, receive, send)
+    return sum(len(m.get("body", b"")) for m in sent if m["type"] == "http.response.body")
+
+
+async def measure(body, content_type, accept, options, requests):
+    middleware = compression.CompressionMiddleware(make_app(body, content_type), **options)
+    wire = await run_once(middleware, accept)
+    started = time.process_time()
+    for _ in range(requests):
+        await run_once(middleware, accept)
+    cpu_us = (time.process_time() - started) / requests * 1e6
+    return wire, cpu_us
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--json")
+    args = parser.parse_args()
+
+    payloads = [
+        ("/ops/collections (100 rows)", collections_payload(100), b"application/json"),
+        ("/ops/collections (1000 rows)", collections_payload(1000), b"application/json"),
+        ("/ops/collections (10000 rows)", collections_payload(10000), b"application/json"),
+        ("HTML page (templates/form.html)", file_payload("templates/form.html"), b"text/html; charset=utf-8"),
+        ("backups/requests.json", file_payload("backups/requests.json"), b"application/json"),
+    ]
+    encodings = [("identity", b"identity", {})]
+    encodings += [(f"gzip-{level}", b"gzip", {"gzip_level": level}) for level in (1, 6, 9)]
+    if compression.brotli is not None:
+        encodings += [(f"br-{quality}", b"br", {"brotli_quality": quality}) for quality in (4, 11)]
+
+    results = []
+    print(f"{'payload':36} {'encoding':9} {'bytes':>10} {'ratio':>7} {'cpu us/req':>11}")
+    for name, body, content_type in payloads:
+        for label, accept, options in encodings:
+            requests = max(5, args.requests // max(1, len(body) // 100000))
+            wire, cpu_us = asyncio.run(measure(body, content_type, accept, options, requests))
+            ratio = len(body) / wire if wire else 0
+            results.append({"payload": name, "encoding": label, "raw_bytes": len(body),
+                            "wire_bytes": wire, "ratio": round(ratio, 2), "cpu_us_per_request": round(cpu_us, 1)})
+            print(f"{name:36} {label:9} {wire:>10} {ratio:>7.2f} {cpu_us:>11.1f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
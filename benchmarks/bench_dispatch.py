@@ -0,0 +1,115 @@
+"""Dispatch planning: grid-indexed driver lookup versus scanning every driver.
+
+Builds synthetic open jobs and driver positions around the four branches and
+times dispatch.plan() at several sizes, next to a brute-force planner that
+scores every driver for every job (same scoring, same result). Then runs
+dispatch.propose() end to end against a seeded hazmat.db with live positions
+posted for every driver, which adds the SQLite reads. Exits 1 if any indexed
+plan takes longer than --budget-ms.
+
+    python benchmarks/bench_dispatch.py [--sizes 100x20,500x100,2000x300] [--budget-ms 1000] [--json out.json]
+"""
+import argparse, json, os, random, sys, time
+
+import harness
+import dispatch, geo, locations
+
+
+def synthetic(jobs, drivers, rng):
+    open_jobs = []
+    for n in range(jobs):
+        city, region, lat, lng = rng.choice(harness.CITIES)
+        open_jobs.append({"ref": f"HAZJNB{n:05d}", "lat": lat + rng.uniform(-0.4, 0.4),
+                          "lng": lng + rng.uniform(-0.4, 0.4), "region": region,
+                          "pickup_date": f"2025-01-{rng.randint(1, 28):02d}"})
+    positions = {}
+    for code in harness.driver_codes(drivers):
+        city, region, lat, lng = rng.choice(harness.CITIES)
+        lat, lng = lat + rng.uniform(-0.5, 0.5), lng + rng.uniform(-0.5, 0.5)
+        positions[code] = {"code": code, "name": code, "lat": lat, "lng": lng, "live": True,
+                           "last_seen": None, "region": geo.nearest_branch(lat, lng)}
+    loads = {code: rng.randint(0, 3) for code in positions}
+    return open_jobs, positions, loads
+
+
+def brute_force(jobs, drivers, loads, radius_km=dispatch.RADIUS_KM, max_load=dispatch.MAX_LOAD):
+    loads = {code: loads.get(code, 0) for code in drivers}
+    proposals = []
+    for job in sorted(jobs, key=lambda j: (j["pickup_date"] or "9999-12-31", j["ref"])):
+        city = geo.branch_city(job["region"])
+        best = None
+        for code, driver in drivers.items():
+            distance = geo.haversine_km(job["lat"], job["lng"], driver["lat"], driver["lng"])
+            if distance > radius_km or loads[code] >= max_load:
+                continue
+            score = distance + loads[code] * dispatch.LOAD_PENALTY_KM
+            if city and driver["region"] != city:
+                score += dispatch.REGION_PENALTY_KM
+            if best is None or (score, distance) < (best[0], best[2]):
+                best = (score, code, distance)
+        if best:
+            loads[best[1]] += 1
+            proposals.append({"ref": job["ref"], "driver": best[1]})
+    return proposals
+
+
+def timed(func, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return result, round(best, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="100x20,500x100,2000x300", help="comma-separated JOBSxDRIVERS")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=1000)
+    parser.add_argument("--bookings", type=int, default=5000, help="rows seeded for the end-to-end run")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json")
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    results, over_budget = [], False
+    print(f"{'jobs':>6} {'drivers':>8} {'indexed ms':>11} {'brute ms':>9} {'placed':>7} {'same plan':>10}")
+    for size in args.sizes.split(","):
+        jobs, drivers = (int(n) for n in size.lower().split("x"))
+        open_jobs, positions, loads = synthetic(jobs, drivers, rng)
+        (proposals, unplaced), indexed_ms = timed(lambda: dispatch.plan(open_jobs, positions, loads), args.repeat)
+        brute, brute_ms = timed(lambda: brute_force(open_jobs, positions, loads), max(1, args.repeat // 2))
+        same = [(p["ref"], p["driver"]) for p in proposals] == [(p["ref"], p["driver"]) for p in brute]
+        over_budget |= indexed_ms > args.budget_ms
+        results.append({"jobs": jobs, "drivers": drivers, "indexed_ms": indexed_ms, "brute_force_ms": brute_ms,
+                        "placed": len(proposals), "unplaced": len(unplaced), "same_plan": same})
+        print(f"{jobs:>6} {drivers:>8} {indexed_ms:>11} {brute_ms:>9} {len(proposals):>7} {str(same):>10}")
+
+    # End to end: seeded database, every driver reporting a live position.
+    _, nominatim_url, _, sendgrid_url = harness.start_stand_ins(0, 0)
+    harness.configure(nominatim_url, sendgrid_url)
+    directory = harness.workdir(prefix="hazmat-dispatch-")
+    seeded = harness.seed_database(directory, bookings=args.bookings, drivers=100, seed=args.seed)
+    os.chdir(directory)
+    for code in seeded["drivers"]:
+        city, region, lat, lng = rng.choice(harness.CITIES)
+        locations.update(code, lat + rng.uniform(-0.3, 0.3), lng + rng.uniform(-0.3, 0.3))
+    plan, propose_ms = timed(dispatch.propose, args.repeat)
+    over_budget |= propose_ms > args.budget_ms
+    end_to_end = {"bookings": args.bookings, "open_jobs": plan["jobs"], "drivers": plan["drivers"],
+                  "placed": len(plan["proposals"]), "propose_ms": propose_ms}
+    print(f"\npropose() on a seeded db: {plan['jobs']} open jobs, {plan['drivers']} drivers, "
+          f"{len(plan['proposals'])} placed in {propose_ms} ms")
+
+    if args.json:
+        with open(os.path.join(harness.ROOT, args.json) if not os.path.isabs(args.json) else args.json, "w") as f:
+            json.dump({"plan": results, "propose": end_to_end}, f, indent=2)
+    if over_budget:
+        print(f"FAIL: over the {args.budget_ms:g} ms budget")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Driver location store: ping throughput, radius queries and track flushes.
+
+Simulates --drivers drivers moving around the four branches and measures:
+locations.update() called directly (one thread and --threads threads), POST
+/ops/update_location through the whole ASGI app (middlewares included) at
+--concurrency, locations.within() on the populated grid, and one flush() of
+every ring to driver_tracks in a seeded hazmat.db. Exits 1 if the HTTP ping
+rate falls below --min-rps.
+
+    python benchmarks/bench_locations.py [--drivers 500] [--pings 20000] [--min-rps 300] [--json out.json]
+"""
+import argparse, asyncio, json, os, random, sys, threading, time
+
+import harness
+
+
+def moves(drivers, pings, rng):
+    """[(driver, lat, lng, at)]: each driver drifts from a random branch,
+    one ping per driver per 5 s of simulated time."""
+    positions = {code: list(rng.choice(harness.CITIES)[2:]) for code in drivers}
+    started = time.time() - pings // len(drivers) * 5
+    out = []
+    for n in range(pings):
+        code = drivers[n % len(drivers)]
+        position = positions[code]
+        position[0] += rng.uniform(-0.002, 0.002)
+        position[1] += rng.uniform(-0.002, 0.002)
+        out.append((code, position[0], position[1], started + n // len(drivers) * 5))
+    return out
+
+
+def direct(locations, pings, threads, shift):
+    # A driver's pings stay on one thread, in order; shift keeps every run
+    # older than the next so none of them counts as out of order.
+    owner = {}
+    chunks = [[] for _ in range(threads)]
+    for ping in pings:
+        chunks[owner.setdefault(ping[0], len(owner) % threads)].append(ping)
+
+    def run(chunk):
+        for code, lat, lng, at in chunk:
+            locations.update(code, lat, lng, at + shift)
+
+    workers = [threading.Thread(target=run, args=(chunk,)) for chunk in chunks]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return round(len(pings) / (time.perf_counter() - started))
+
+
+async def over_http(main, pings, concurrency):
+    import httpx
+    latencies, statuses = [], {}
+    queue = list(reversed(pings))
+
+    async def worker(client):
+        while queue:
+            code, lat, lng, _ = queue.pop()
+            started = time.perf_counter()
+            response = await client.post("/ops/update_location", json={"driver": code, "lat": lat, "lng": lng})
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            started = time.perf_counter()
+            await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+            wall = time.perf_counter() - started
+    return {"requests": len(pings), "rps": round(len(pings) / wall), "statuses": statuses,
+            **harness.percentiles(latencies)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--drivers", type=int, default=500)
+    parser.add_argument("--pings", type=int, default=20000)
+    parser.add_argument("--http-pings", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--radius-km", type=float, default=25)
+    parser.add_argument("--min-rps", type=float, default=300)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json")
+    args = parser.parse_args()
+    json_path = os.path.abspath(args.json) if args.json else None
+    rng = random.Random(args.seed)
+
+    harness.configure("http://127.0.0.1:9", "http://127.0.0.1:9")
+    directory = harness.workdir(prefix="hazmat-locations-")
+    harness.seed_database(directory, bookings=200, drivers=20, seed=args.seed)
+    os.chdir(directory)
+    import main as app_main
+    import locations
+    locations.init_tracks_table()
+
+    drivers = harness.driver_codes(args.drivers)
+    pings = moves(drivers, args.pings, rng)
+    result = {"drivers": args.drivers, "pings": args.pings}
+    result["direct_1_thread_per_s"] = direct(locations, pings, 1, -2 * 86400)
+    result[f"direct_{args.threads}_threads_per_s"] = direct(locations, pings, args.threads, -86400)
+    print(f"locations.update(): {result['direct_1_thread_per_s']}/s on 1 thread, "
+          f"{result[f'direct_{args.threads}_threads_per_s']}/s on {args.threads} threads")
+
+    timings = []
+    for _ in range(args.queries):
+        city, region, lat, lng = rng.choice(harness.CITIES)
+        started = time.perf_counter()
+        found = locations.within(lat + rng.uniform(-0.2, 0.2), lng + rng.uniform(-0.2, 0.2), args.radius_km)
+        timings.append(time.perf_counter() - started)
+    result["within"] = {"radius_km": args.radius_km, "last_found": len(found), **harness.percentiles(timings)}
+    print(f"within({args.radius_km:g} km) over {args.drivers} drivers: "
+          f"p50 {result['within']['p50_ms']} ms, p99 {result['within']['p99_ms']} ms")
+
+    started = time.perf_counter()
+    written = locations.flush()
+    result["flush"] = {"rows_written": written, "ms": round((time.perf_counter() - started) * 1000, 1)}
+    print(f"flush(): {written} downsampled rows in {result['flush']['ms']} ms")
+    result["out_of_order"] = locations.stats()["out_of_order"]
+
+    result["http"] = asyncio.run(over_http(app_main, moves(drivers, args.http_pings, rng), args.concurrency))
+    print(f"POST /ops/update_location x{args.http_pings} at concurrency {args.concurrency}: "
+          f"{result['http']['rps']}/s, p50 {result['http']['p50_ms']} ms, p99 {result['http']['p99_ms']} ms, "
+          f"{result['http']['statuses']}")
+
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(result, f, indent=2)
+    if result["http"]["rps"] < args.min_rps:
+        print(f"FAIL: {result['http']['rps']}/s is below --min-rps {args.min_rps:g}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
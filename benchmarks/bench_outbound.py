@@ -0,0 +1,145 @@
+"""Outbound HTTP: a new connection per call versus the pooled client.
+
+Starts a local stand-in for Nominatim/SendGrid (HTTP/1.1 with keep-alive) that
+sleeps --handshake-ms on every new connection to model the TCP+TLS setup a
+remote provider costs, then issues the same requests through:
+
+  requests.get          one connection per call (the old geocode/email path)
+  requests.Session      keep-alive session (dashboard, DriverApp)
+  outbound sequential   the server's shared httpx.AsyncClient, one at a time
+  outbound concurrent   the same client with --concurrency requests in flight
+
+and reports latency percentiles and how many connections the server accepted.
+
+    python benchmarks/bench_outbound.py [--requests 200] [--handshake-ms 30] [--json out.json]
+"""
+import argparse, asyncio, json, os, statistics, sys, threading, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import requests  # noqa: E402
+import outbound  # noqa: E402
+
+BODY = json.dumps([{"lat": "-26.2041", "lon": "28.0473", "importance": 0.82}]).encode()
+
+
+class StandInServer:
+    def __init__(self, handshake_ms):
+        self.handshake = handshake_ms / 1000
+        self.connections = 0
+        self.loop = asyncio.new_event_loop()
+        self.ready = threading.Event()
+        self.port = None
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        await asyncio.sleep(self.handshake)
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                headers = head.decode("latin-1").lower()
+                length = 0
+                for line in headers.split("\r\n"):
+                    if line.startswith("content-length:"):
+                        length = int(line.split(":", 1)[1])
+                if length:
+                    await reader.readexactly(length)
+                close = "connection: close" in headers
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                             + f"Content-Length: {len(BODY)}\r\n".encode()
+                             + (b"Connection: close\r\n" if close else b"") + b"\r\n" + BODY)
+                await writer.drain()
+                if close:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        writer.close()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        server = self.loop.run_until_complete(asyncio.start_server(self.handle, "127.0.0.1", 0))
+        self.port = server.sockets[0].getsockname()[1]
+        self.ready.set()
+        self.loop.run_forever()
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+        self.ready.wait()
+        return f"http://127.0.0.1:{self.port}/search?q=1+Main+Reef+Road&format=json"
+
+
+def summarise(name, latencies, wall, connections):
+    latencies = sorted(latencies)
+    return {
+        "scenario": name,
+        "requests": len(latencies),
+        "wall_s": round(wall, 3),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 2),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 2),
+        "connections": connections,
+    }
+
+
+def run_sync(get, url, n):
+    latencies = []
+    for _ in range(n):
+        started = time.perf_counter()
+        get(url, timeout=10).json()
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+async def run_outbound(url, n, concurrency):
+    latencies = []
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with gate:
+            started = time.perf_counter()
+            (await outbound.get(url)).json()
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one() for _ in range(n)))
+    await outbound.aclose()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--handshake-ms", type=float, default=30)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--json")
+    args = parser.parse_args()
+
+    server = StandInServer(args.handshake_ms)
+    url = server.start()
+    session = requests.Session()
+    scenarios = [
+        ("requests.get", lambda: run_sync(requests.get, url, args.requests)),
+        ("requests.Session", lambda: run_sync(session.get, url, args.requests)),
+        ("outbound sequential", lambda: asyncio.run(run_outbound(url, args.requests, 1))),
+        (f"outbound concurrent x{args.concurrency}",
+         lambda: asyncio.run(run_outbound(url, args.requests, args.concurrency))),
+    ]
+
+    results = []
+    print(f"{'scenario':26} {'wall s':>8} {'mean ms':>8} {'p50 ms':>8} {'p99 ms':>8} {'conns':>6}")
+    for name, run in scenarios:
+        before = server.connections
+        started = time.perf_counter()
+        latencies = run()
+        result = summarise(name, latencies, time.perf_counter() - started, server.connections - before)
+        results.append(result)
+        print(f"{name:26} {result['wall_s']:>8} {result['mean_ms']:>8} {result['p50_ms']:>8} "
+              f"{result['p99_ms']:>8} {result['connections']:>6}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
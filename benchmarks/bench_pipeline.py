@@ -0,0 +1,203 @@
+"""End-to-end /submit benchmark plus micro-benchmarks of the booking pipeline.
+
+Runs the real ASGI app in-process (lifespan included) in a scratch directory
+with a seeded hazmat.db (benchmarks/harness.py), with Nominatim and SendGrid
+replaced by local stand-ins that answer after --nominatim-ms / --sendgrid-ms.
+Every booking is a multipart POST with synthetic document uploads. For each
+concurrency level it reports throughput, latency percentiles, status codes,
+outbound calls and the mean time per pipeline stage (from the submit stage
+histograms), then times the pieces on their own:
+
+  apply_aliases     address alias substitution, per call
+  qr.matrix         QR module matrix for a new reference (cache miss)
+  generate_pdf      one waybill with the QR drawn in
+  backup_database   JSON dump of the seeded tables
+
+Client and server share one process and event loop, so absolute numbers
+include the client's cost; compare runs made on the same machine.
+
+    python benchmarks/bench_pipeline.py [--levels 1,4,16] [--requests 48] [--json out.json]
+    python benchmarks/bench_pipeline.py --json new.json --compare old.json
+"""
+import argparse, asyncio, json, os, platform, random, subprocess, time
+
+import harness
+
+ROOT = harness.ROOT
+
+
+def stage_snapshot(metrics):
+    with metrics._lock:
+        return {stage: (h.total, h.count) for (operation, stage), h in metrics.stage_duration.children.items()
+                if operation == "submit"}
+
+
+def stage_means(before, after):
+    means = {}
+    for stage, (total, count) in after.items():
+        prev_total, prev_count = before.get(stage, (0.0, 0))
+        if count > prev_count:
+            means[stage] = round((total - prev_total) / (count - prev_count) * 1000, 2)
+    return means
+
+
+async def run_level(client, metrics, stand_ins, concurrency, total, rng, args):
+    forms = [harness.booking_form(rng, args.uploads, args.upload_kb) for _ in range(total)]
+    latencies, statuses = [], {}
+    gate = asyncio.Semaphore(concurrency)
+    calls_before = [dict(s.calls) for s in stand_ins]
+    stages_before = stage_snapshot(metrics)
+
+    async def one(data, files):
+        async with gate:
+            started = time.perf_counter()
+            response = await client.post("/submit", data=data, files=files)
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(data, files) for data, files in forms))
+    wall = time.perf_counter() - started
+    outbound_calls = {}
+    for stand_in, before in zip(stand_ins, calls_before):
+        for path, count in stand_in.calls.items():
+            outbound_calls[path] = count - before.get(path, 0)
+    return {
+        "concurrency": concurrency,
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(total / wall, 2),
+        **harness.percentiles(latencies),
+        "statuses": {str(k): v for k, v in sorted(statuses.items())},
+        "outbound_calls": outbound_calls,
+        "stage_mean_ms": stage_means(stages_before, stage_snapshot(metrics)),
+    }
+
+
+async def run_pipeline(main, stand_ins, args):
+    import httpx
+    import metrics
+    rng = random.Random(args.seed)
+    results = []
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            if args.warmup:
+                await run_level(client, metrics, stand_ins, 1, args.warmup, rng, args)
+            for level in args.levels:
+                result = await run_level(client, metrics, stand_ins, level, args.requests, rng, args)
+                results.append(result)
+                print(f"{level:>5} {result['wall_s']:>8} {result['throughput_rps']:>7} {result['p50_ms']:>9} "
+                      f"{result['p99_ms']:>9}  {result['statuses']}  {result['stage_mean_ms']}")
+    return results
+
+
+def time_calls(name, func, iterations):
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    result = {"name": name, "iterations": iterations, **harness.percentiles(timings)}
+    print(f"{name:18} {result['mean_ms']:>9} {result['p50_ms']:>9} {result['p99_ms']:>9}")
+    return result
+
+
+def run_micro(main, args):
+    rng = random.Random(args.seed)
+    streets = [f"{rng.randint(1, 400)} Main Reef Rd, JHB, {rng.choice(['Boksberg', 'Sasol', 'PE'])}"
+               for _ in range(256)]
+    data = {"reference_number": "HAZJNB9999", "service_type": "local", "client_reference": "PO12345",
+            "pickup_date": "2025-01-01", "inco_terms": "DAP", "collection_company": "Bench Chemicals (Pty) Ltd",
+            "collection_address": "12 Main Reef Road, Isando, Johannesburg, 1600", "collection_region": "JNB",
+            "collection_person": "Sipho Ndlovu", "collection_number": "0821234567",
+            "collection_email": "shipping@example.com", "delivery_company": "Bench Receivers",
+            "delivery_address": "4 Marine Drive, Struandale, Port Elizabeth, 6001", "delivery_person": "Anne Botha",
+            "delivery_number": "0837654321", "delivery_email": "receiving@example.com",
+            "client_notes": "UN1993, class 3, 4 drums"}
+    import qr
+    counter = iter(range(10 ** 9))
+
+    print(f"\n{'micro':18} {'mean ms':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    n = args.micro_iterations
+    return [
+        time_calls("apply_aliases", lambda: main.apply_aliases(streets[next(counter) % len(streets)]), n * 50),
+        time_calls("qr.matrix", lambda: qr.matrix(f"BENCH{next(counter):06d}"), n),
+        time_calls("generate_pdf", lambda: main.generate_pdf(data, 9999, "static/waybills/bench.pdf"), n),
+        time_calls("backup_database", main.backup_database, max(3, n // 5)),
+    ]
+
+
+def compare(current, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nvs {baseline_path} ({baseline.get('commit', '?')[:10]})")
+    old_levels = {r["concurrency"]: r for r in baseline.get("pipeline", [])}
+    for result in current["pipeline"]:
+        old = old_levels.get(result["concurrency"])
+        if old:
+            print(f"  submit x{result['concurrency']:<3} p50 {old['p50_ms']} -> {result['p50_ms']} ms, "
+                  f"p99 {old['p99_ms']} -> {result['p99_ms']} ms, "
+                  f"{old['throughput_rps']} -> {result['throughput_rps']} req/s")
+    old_micro = {r["name"]: r for r in baseline.get("micro", [])}
+    for result in current["micro"]:
+        old = old_micro.get(result["name"])
+        if old and old["mean_ms"]:
+            print(f"  {result['name']:18} {old['mean_ms']} -> {result['mean_ms']} ms "
+                  f"({result['mean_ms'] / old['mean_ms']:.2f}x)")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--levels", default="1,4,16", type=lambda v: [int(x) for x in v.split(",")])
+    parser.add_argument("--requests", type=int, default=48, help="bookings per concurrency level")
+    parser.add_argument("--warmup", type=int, default=4)
+    parser.add_argument("--nominatim-ms", type=float, default=150)
+    parser.add_argument("--sendgrid-ms", type=float, default=250)
+    parser.add_argument("--uploads", type=int, default=2)
+    parser.add_argument("--upload-kb", type=int, default=200)
+    parser.add_argument("--bookings", type=int, default=2000, help="rows seeded into hazmat.db")
+    parser.add_argument("--micro-iterations", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json")
+    parser.add_argument("--compare", help="earlier --json output to diff against")
+    args = parser.parse_args()
+    json_path = os.path.abspath(args.json) if args.json else None
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+
+    nominatim, nominatim_url, sendgrid, sendgrid_url = harness.start_stand_ins(args.nominatim_ms, args.sendgrid_ms)
+    harness.configure(nominatim_url, sendgrid_url)
+    directory = harness.workdir()
+    harness.seed_database(directory, bookings=args.bookings, seed=args.seed)
+    os.chdir(directory)
+    import main as app_module
+
+    print(f"{'conc':>5} {'wall s':>8} {'req/s':>7} {'p50 ms':>9} {'p99 ms':>9}  statuses  stage means (ms)")
+    pipeline = asyncio.run(run_pipeline(app_module, [nominatim, sendgrid], args))
+    micro = run_micro(app_module, args)
+
+    report = {
+        "commit": git_commit(),
+        "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("json", "compare")},
+        "pipeline": pipeline,
+        "micro": micro,
+    }
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(report, f, indent=2)
+    if compare_path:
+        compare(report, compare_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Cold-start cost of the server: `import main` and the lifespan startup hook.
+
+Each run is a fresh interpreter in a fresh harness.workdir(), so the hook
+builds a new hazmat.db and assets there instead of touching the checkout's
+(and is a true cold start every time). Import time comes from `python -X importtime`
+(cumulative microseconds for main and the heaviest top-level imports); the
+lifespan hook (DB setup, asset build, page pre-render) is timed separately.
+Medians over --runs are checked against a budget and the script exits 1 when
+either is exceeded, so it can gate CI. --record appends the result with the
+git revision to a JSON-lines file to track the numbers over time.
+
+    python benchmarks/bench_startup.py [--runs 5] [--record benchmarks/startup_history.jsonl]
+"""
+import argparse, json, os, shutil, statistics, subprocess, sys, time
+
+import harness
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Milliseconds; raise deliberately, with the reason in the commit that does it.
+IMPORT_BUDGET_MS = 400
+LIFESPAN_BUDGET_MS = 500
+
+LIFESPAN_SNIPPET = """
+import asyncio, json, time
+import main
+
+async def run():
+    started = time.perf_counter()
+    async with main.app.router.lifespan_context(main.app):
+        ready = time.perf_counter()
+    return (ready - started) * 1000
+
+print(json.dumps({"lifespan_ms": asyncio.run(run())}))
+"""
+
+
+def run_in_workdir(args):
+    directory = harness.workdir(prefix="hazmat-startup-")
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")]))}
+    try:
+        return subprocess.run([sys.executable, *args], cwd=directory, env=env,
+                              capture_output=True, text=True, check=True)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def import_profile():
+    proc = run_in_workdir(["-X", "importtime", "-c", "import main"])
+    top_level = {}
+    total_us = None
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        indent = len(name) - len(name.lstrip())
+        name = name.strip()
+        if name == "main":
+            total_us = int(cumulative)
+        elif indent == 3:
+            # Direct imports of main (one level below it in the importtime tree).
+            top_level[name] = int(cumulative)
+    return total_us / 1000, top_level
+
+
+def lifespan_ms():
+    proc = run_in_workdir(["-c", LIFESPAN_SNIPPET])
+    return json.loads(proc.stdout.strip().splitlines()[-1])["lifespan_ms"]
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--import-budget-ms", type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument("--lifespan-budget-ms", type=float, default=LIFESPAN_BUDGET_MS)
+    parser.add_argument("--record")
+    args = parser.parse_args()
+
+    imports, modules, lifespans = [], {}, []
+    for _ in range(args.runs):
+        total, top_level = import_profile()
+        imports.append(total)
+        for name, us in top_level.items():
+            modules.setdefault(name, []).append(us)
+        lifespans.append(lifespan_ms())
+
+    result = {
+        "at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": git_revision(),
+        "python": sys.version.split()[0],
+        "runs": args.runs,
+        "import_ms": round(statistics.median(imports), 1),
+        "lifespan_ms": round(statistics.median(lifespans), 1),
+        "heaviest_imports_ms": {
+            name: round(statistics.median(values) / 1000, 1)
+            for name, values in sorted(modules.items(), key=lambda kv: -statistics.median(kv[1]))[:args.top]
+        },
+    }
+    print(json.dumps(result, indent=2))
+
+    if args.record:
+        with open(args.record, "a") as f:
+            f.write(json.dumps(result) + "\n")
+
+    over = []
+    if result["import_ms"] > args.import_budget_ms:
+        over.append(f"import {result['import_ms']} ms > {args.import_budget_ms} ms")
+    if result["lifespan_ms"] > args.lifespan_budget_ms:
+        over.append(f"lifespan {result['lifespan_ms']} ms > {args.lifespan_budget_ms} ms")
+    if over:
+        print("Startup budget exceeded: " + "; ".join(over), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Local scrape check for /metrics.
+
+Boots the app in-process (lifespan included) inside a scratch copy of static/,
+sends a known mix of requests, scrapes /metrics and verifies the exposition:
+every sample parses, HELP/TYPE precede each family, histogram buckets are
+cumulative with +Inf equal to _count, routes are reported by template (not raw
+path), unmatched paths collapse to one label, and a logs.Trace wired to
+metrics.stage_recorder shows up as stage histograms. Exits 1 on any failure.
+
+    python benchmarks/check_metrics.py
+"""
+import os, re, shutil, sys, tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{(.*)\})? (-?[0-9.eE+-]+|\+Inf|NaN)$')
+LABEL = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+
+def parse(text):
+    families, samples, errors = {}, [], []
+    for line in text.splitlines():
+        if not line:
+            continue
+        if line.startswith("# TYPE "):
+            _, _, name, kind = line.split(" ", 3)
+            families[name] = kind
+            continue
+        if line.startswith("#"):
+            continue
+        match = SAMPLE.match(line)
+        if not match:
+            errors.append(f"unparseable line: {line}")
+            continue
+        name, _, labels, value = match.groups()
+        base = re.sub(r"_(bucket|sum|count)$", "", name)
+        if name not in families and base not in families:
+            errors.append(f"sample before its TYPE: {line}")
+        samples.append((name, dict(LABEL.findall(labels or "")), float(value)))
+    return families, samples, errors
+
+
+def check_histograms(families, samples, errors):
+    for family, kind in families.items():
+        if kind != "histogram":
+            continue
+        series = {}
+        for name, labels, value in samples:
+            if name == f"{family}_bucket":
+                key = tuple(sorted((k, v) for k, v in labels.items() if k != "le"))
+                series.setdefault(key, []).append(value)
+        counts = {tuple(sorted(l.items())): v for n, l, v in samples if n == f"{family}_count"}
+        for key, buckets in series.items():
+            if buckets != sorted(buckets):
+                errors.append(f"{family}{dict(key)} buckets not cumulative")
+            if buckets[-1] != counts.get(key):
+                errors.append(f"{family}{dict(key)} +Inf bucket != _count")
+
+
+def value_of(samples, name, **labels):
+    for sample_name, sample_labels, value in samples:
+        if sample_name == name and all(sample_labels.get(k) == v for k, v in labels.items()):
+            return value
+    return None
+
+
+def main():
+    scratch = tempfile.mkdtemp(prefix="metrics-check-")
+    shutil.copytree(os.path.join(ROOT, "static"), os.path.join(scratch, "static"),
+                    ignore=shutil.ignore_patterns("waybills", "qrcodes", "uploads", "dist", "*.gz", "*.br"))
+    os.chdir(scratch)
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    from fastapi.testclient import TestClient
+    import main as app_module
+    import logs, metrics
+
+    errors = []
+    with TestClient(app_module.app, raise_server_exceptions=False) as client:
+        for _ in range(3):
+            client.get("/ping")
+        client.get("/driver/ABC")
+        client.get("/driver/XYZ")
+        client.get("/no-such-page")
+        client.get("/static/style.css")
+
+        trace = logs.Trace(logs.get("check"), on_mark=metrics.stage_recorder("submit"))
+        for stage in ("geocode", "db_insert", "pdf"):
+            trace.mark(stage)
+
+        response = client.get("/metrics")
+        if response.status_code != 200 or not response.headers["content-type"].startswith("text/plain"):
+            errors.append(f"/metrics returned {response.status_code} {response.headers.get('content-type')}")
+        families, samples, parse_errors = parse(response.text)
+        errors += parse_errors
+        check_histograms(families, samples, errors)
+
+        expectations = [
+            ("hazmat_http_requests_total", dict(method="GET", route="/ping", status="200"), 3),
+            ("hazmat_http_request_duration_seconds_count", dict(method="GET", route="/driver/{code}"), 2),
+            ("hazmat_http_requests_total", dict(route="unmatched", status="404"), 1),
+            ("hazmat_http_requests_total", dict(route="/static"), 1),
+            ("hazmat_http_requests_in_flight", dict(route="/ping"), 0),
+            ("hazmat_http_requests_in_flight", dict(route="/metrics"), 1),
+            ("hazmat_stage_duration_seconds_count", dict(operation="submit", stage="geocode"), 1),
+        ]
+        for name, labels, expected in expectations:
+            actual = value_of(samples, name, **labels)
+            if actual != expected:
+                errors.append(f"{name}{labels}: expected {expected}, got {actual}")
+        if any("ABC" in labels.get("route", "") for _, labels, _ in samples):
+            errors.append("raw path leaked into route label")
+
+    shutil.rmtree(scratch, ignore_errors=True)
+    print(f"{len(samples)} samples in {len(families)} families")
+    for error in errors:
+        print("FAIL", error)
+    if errors:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
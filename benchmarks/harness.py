@@ -0,0 +1,273 @@
+"""Shared setup for the end-to-end benchmarks (bench_pipeline.py, loadtest.py).
+
+  workdir()         scratch copy of static/ to run the app in, so benchmarks
+                    never touch the real hazmat.db, waybills or backups
+  seed_database()   a hazmat.db with months of bookings, scans, updates and
+                    completions spread over a pool of drivers
+  StandIn           local HTTP/1.1 keep-alive stand-in for Nominatim (/search)
+                    and SendGrid (/v3/mail/send) with a configurable delay
+  configure()       points the app at the stand-ins; call before importing main
+  booking_form()    a valid /submit form plus synthetic document uploads
+
+init_db() still creates the legacy requests layout (hazjnb_ref, no
+reference_number/timestamp), which the request handlers no longer match, so the
+seed builds every table itself with the columns the handlers read and write.
+"""
+import asyncio, json, os, random, shutil, sqlite3, statistics, sys, tempfile, threading
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+SCHEMA = """
+CREATE TABLE requests (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    reference_number TEXT, hazjnb_ref TEXT, hmj_ref TEXT, service_type TEXT, inco_terms TEXT,
+    collection_company TEXT, collection_address TEXT, collection_person TEXT, collection_number TEXT,
+    collection_email TEXT, collection_region TEXT, collection_lat REAL, collection_lng REAL,
+    delivery_company TEXT, delivery_address TEXT, delivery_person TEXT, delivery_number TEXT,
+    delivery_email TEXT, delivery_region TEXT, delivery_lat REAL, delivery_lng REAL,
+    client_reference TEXT, pickup_date TEXT, client_notes TEXT, pdf_path TEXT, timestamp TEXT,
+    assigned_driver TEXT, assigned_at TEXT, status TEXT, geocode_confidence REAL, address_flag TEXT,
+    company TEXT, delivery_date TEXT, notes TEXT
+);
+CREATE TABLE updates (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, ops TEXT, hmj TEXT, haz TEXT, company TEXT,
+    date TEXT, time TEXT, "update" TEXT, latest_update TEXT, document TEXT
+);
+CREATE TABLE clients (id INTEGER PRIMARY KEY AUTOINCREMENT, email TEXT UNIQUE, password TEXT, name TEXT);
+CREATE TABLE completed (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, ops TEXT, company TEXT, delivery_date TEXT, time TEXT,
+    signed_by TEXT, document TEXT, pod TEXT, haz_ref TEXT
+);
+CREATE TABLE scan_log (id INTEGER PRIMARY KEY AUTOINCREMENT, reference_number TEXT, driver_id TEXT, timestamp TEXT);
+CREATE TABLE saved_addresses (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, client_id INTEGER, label TEXT, type TEXT, company TEXT,
+    address TEXT, contact_person TEXT, contact_number TEXT, email TEXT, lat REAL, lng REAL, confidence REAL
+);
+"""
+
+# (city, region code, lat, lng) for the four branches.
+CITIES = [
+    ("Johannesburg", "JNB", -26.2041, 28.0473),
+    ("Durban", "KZN", -29.8587, 31.0218),
+    ("Cape Town", "CPT", -33.9249, 18.4241),
+    ("Port Elizabeth", "PLZ", -33.9608, 25.6022),
+]
+STREETS = ["Main Reef Road", "Jet Park Road", "Electron Avenue", "Voortrekker Road", "Old Pretoria Road",
+           "Spine Road", "Plane Street", "North Reef Road", "Brickfield Road", "Marine Drive"]
+SUBURBS = ["Isando", "Kempton Park", "Germiston", "Westmead", "Montague Gardens", "Struandale"]
+
+
+def driver_codes(count):
+    return [f"D{n:03d}" for n in range(1, count + 1)]
+
+
+def workdir(prefix="hazmat-bench-"):
+    """Scratch directory holding a copy of static/ (generated files and backups
+    left out); the caller chdirs into it before importing main."""
+    path = tempfile.mkdtemp(prefix=prefix)
+    shutil.copytree(os.path.join(ROOT, "static"), os.path.join(path, "static"),
+                    ignore=shutil.ignore_patterns("waybills", "qrcodes", "uploads", "backups", "dist", "*.gz", "*.br"))
+    for folder in ("waybills", "qrcodes", "uploads"):
+        os.makedirs(os.path.join(path, "static", folder), exist_ok=True)
+    os.makedirs(os.path.join(path, "backups"), exist_ok=True)
+    return path
+
+
+def random_address(rng):
+    city, region, lat, lng = rng.choice(CITIES)
+    street = f"{rng.randint(1, 400)} {rng.choice(STREETS)}"
+    postal = str(rng.randint(1000, 9999))
+    return {"street": street, "suburb": rng.choice(SUBURBS), "city": city, "postal": postal,
+            "region": region, "lat": lat + rng.uniform(-0.15, 0.15), "lng": lng + rng.uniform(-0.15, 0.15)}
+
+
+def seed_database(directory, bookings=2000, drivers=20, days=90, seed=7):
+    """Writes <directory>/hazmat.db and the reference counter; returns the driver
+    codes and the references still open (not delivered) for actors to scan."""
+    rng = random.Random(seed)
+    codes = driver_codes(drivers)
+    db_path = os.path.join(directory, "hazmat.db")
+    conn = sqlite3.connect(db_path)
+    conn.executescript(SCHEMA)
+    now = datetime.now()
+    requests, scans, updates, completed, open_refs = [], [], [], [], []
+    for n in range(1, bookings + 1):
+        ref = f"HAZJNB{n:04d}"
+        booked = now - timedelta(minutes=rng.randint(0, days * 24 * 60))
+        collection, delivery = random_address(rng), random_address(rng)
+        state = rng.choices(["Unassigned", "Assigned", "Collected", "Delivered"], [15, 20, 15, 50])[0]
+        driver = rng.choice(codes) if state != "Unassigned" else None
+        assigned = (booked + timedelta(hours=rng.uniform(0.25, 2))).isoformat() if driver else None
+        company = f"Client {rng.randint(1, 150)} (Pty) Ltd"
+        requests.append((
+            ref, ref, f"HMJ{n:05d}", rng.choice(["local", "local", "export", "import"]), "DTD",
+            company, f"{collection['street']}, {collection['suburb']}, {collection['city']}, {collection['postal']}",
+            "Sipho Ndlovu", "0821234567", "shipping@example.com", collection["region"], collection["lat"], collection["lng"],
+            f"Consignee {rng.randint(1, 300)}", f"{delivery['street']}, {delivery['suburb']}, {delivery['city']}, {delivery['postal']}",
+            "Anne Botha", "0837654321", "receiving@example.com", delivery["region"], delivery["lat"], delivery["lng"],
+            f"PO{rng.randint(10000, 99999)}", (booked + timedelta(days=1)).date().isoformat(), "", "",
+            booked.isoformat(), driver, assigned, state, rng.choice([0.82, 0.82, 0.75, 0.5]), None,
+            company, (booked + timedelta(days=2)).date().isoformat(), "",
+        ))
+        if state in ("Collected", "Delivered"):
+            scans.append((ref, driver, (booked + timedelta(hours=rng.uniform(2, 30))).isoformat()))
+        if state == "Delivered":
+            delivered = booked + timedelta(hours=rng.uniform(30, 72))
+            completed.append((f"OPS{n:05d}", company, delivered.date().isoformat(), delivered.strftime("%H:%M"),
+                              "J. Smith", "", "", ref))
+        else:
+            open_refs.append(ref)
+        for _ in range(rng.randint(0, 2)):
+            at = booked + timedelta(hours=rng.uniform(1, 48))
+            updates.append((f"OPS{n:05d}", f"HMJ{n:05d}", ref, company, at.date().isoformat(),
+                            at.strftime("%H:%M"), rng.choice(["Awaiting docs", "Loaded", "In transit", "At depot"])))
+    conn.executemany(f"""INSERT INTO requests (
+        reference_number, hazjnb_ref, hmj_ref, service_type, inco_terms,
+        collection_company, collection_address, collection_person, collection_number,
+        collection_email, collection_region, collection_lat, collection_lng,
+        delivery_company, delivery_address, delivery_person, delivery_number,
+        delivery_email, delivery_region, delivery_lat, delivery_lng,
+        client_reference, pickup_date, client_notes, pdf_path, timestamp,
+        assigned_driver, assigned_at, status, geocode_confidence, address_flag, company, delivery_date, notes
+    ) VALUES ({",".join("?" * 34)})""", requests)
+    conn.executemany("INSERT INTO scan_log (reference_number, driver_id, timestamp) VALUES (?, ?, ?)", scans)
+    conn.executemany("""INSERT INTO completed (ops, company, delivery_date, time, signed_by, document, pod, haz_ref)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)""", completed)
+    conn.executemany('INSERT INTO updates (ops, hmj, haz, company, date, time, "update") VALUES (?, ?, ?, ?, ?, ?, ?)',
+                     updates)
+    conn.executemany("INSERT INTO clients (email, password, name) VALUES (?, ?, ?)",
+                     [(f"client{n}@example.com", "x", f"Client {n}") for n in range(1, 151)])
+    conn.commit()
+    conn.close()
+    with open(os.path.join(directory, "backups", "ref_counter.txt"), "w") as f:
+        f.write(str(bookings))
+
+    # Daily aggregates behind /ops/stats, built the way a deployment backfills them.
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        import ops_stats
+        ops_stats.rebuild_stats()
+    finally:
+        os.chdir(cwd)
+    return {"drivers": codes, "open_refs": open_refs}
+
+
+class StandIn:
+    """Answers GET /search like Nominatim and POST /v3/mail/send like SendGrid,
+    after `delays[path]` seconds, on a loop in its own thread."""
+
+    def __init__(self, delays, host="127.0.0.1"):
+        self.delays = delays
+        self.host = host
+        self.calls = {path: 0 for path in delays}
+        self.connections = 0
+        self.loop = asyncio.new_event_loop()
+        self.ready = threading.Event()
+        self.port = None
+
+    def respond(self, path, query):
+        if path.startswith("/v3/mail/send"):
+            return b"202 Accepted", b""
+        # Deterministic per query so repeated addresses geocode identically.
+        rng = random.Random(query)
+        city = rng.choice(CITIES)
+        body = [{"lat": str(city[2] + rng.uniform(-0.1, 0.1)), "lon": str(city[3] + rng.uniform(-0.1, 0.1)),
+                 "importance": 0.82}]
+        return b"200 OK", json.dumps(body).encode()
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                request_line, *header_lines = head.decode("latin-1").split("\r\n")
+                target = request_line.split(" ")[1]
+                path, _, query = target.partition("?")
+                length = 0
+                for line in header_lines:
+                    if line.lower().startswith("content-length:"):
+                        length = int(line.split(":", 1)[1])
+                if length:
+                    await reader.readexactly(length)
+                route = next((p for p in self.delays if path.startswith(p)), None)
+                if route:
+                    self.calls[route] += 1
+                    await asyncio.sleep(self.delays[route])
+                status, body = self.respond(path, query)
+                writer.write(b"HTTP/1.1 " + status + b"\r\nContent-Type: application/json\r\n"
+                             + f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        writer.close()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        server = self.loop.run_until_complete(asyncio.start_server(self.handle, "127.0.0.1", 0))
+        self.port = server.sockets[0].getsockname()[1]
+        self.ready.set()
+        self.loop.run_forever()
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+        self.ready.wait()
+        return f"http://{self.host}:{self.port}"
+
+
+def start_stand_ins(nominatim_ms, sendgrid_ms):
+    """Two stand-ins under different host names, so outbound.py applies its
+    per-host limits (Nominatim 1 in flight, SendGrid 4) as it does in production."""
+    nominatim = StandIn({"/search": nominatim_ms / 1000}, host="127.0.0.1")
+    sendgrid = StandIn({"/v3/mail/send": sendgrid_ms / 1000}, host="localhost")
+    return nominatim, nominatim.start(), sendgrid, sendgrid.start()
+
+
+def configure(nominatim_url, sendgrid_url, environ=os.environ):
+    environ.update({
+        "NOMINATIM_URL": nominatim_url,
+        "SENDGRID_URL": sendgrid_url,
+        "SENDGRID_API_KEY": "bench",
+        "LOG_LEVEL": environ.get("LOG_LEVEL", "WARNING"),
+        # Measure the pipeline, not the per-IP buckets (every request comes from one address).
+        "RATE_LIMIT_PER_IP": "1000000/1",
+        "RATE_LIMIT_PER_CLIENT": "1000000/1",
+        "RATE_LIMIT_GLOBAL": "1000000/1",
+    })
+    return environ
+
+
+def booking_form(rng, uploads=2, upload_kb=200):
+    collection, delivery = random_address(rng), random_address(rng)
+    data = {
+        "shipment_type": rng.choice(["local", "local", "export", "import"]), "inco_terms": "DAP",
+        "collection_date": (datetime.now() + timedelta(days=1)).date().isoformat(),
+        "collection_company": "Bench Chemicals (Pty) Ltd", "collection_contact_name": "Sipho Ndlovu",
+        "collection_contact_number": "0821234567", "collection_email": "shipping@example.com",
+        "collection_region": collection["region"],
+        "delivery_company": "Bench Receivers", "delivery_contact_name": "Anne Botha",
+        "delivery_contact_number": "0837654321", "delivery_email": "receiving@example.com",
+        "delivery_region": delivery["region"], "client_reference": f"PO{rng.randint(10000, 99999)}",
+        "shipper_notes": "UN1993, class 3, 4 drums",
+    }
+    for side, address in (("collection", collection), ("delivery", delivery)):
+        for field in ("street", "suburb", "city", "postal"):
+            data[f"{side}_{field}"] = address[field]
+    payload = b"%PDF-1.4\n" + rng.randbytes(upload_kb * 1024)
+    files = [("shipment_docs", (f"msds_{n}.pdf", payload, "application/pdf")) for n in range(uploads)]
+    return data, files
+
+
+def percentiles(latencies):
+    if not latencies:
+        return {"count": 0}
+    ordered = sorted(latencies)
+
+    def at(q):
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * q))] * 1000, 2)
+
+    return {"count": len(ordered), "mean_ms": round(statistics.mean(ordered) * 1000, 2),
+            "p50_ms": at(0.50), "p90_ms": at(0.90), "p99_ms": at(0.99), "max_ms": round(ordered[-1] * 1000, 2)}
@@ -0,0 +1,255 @@
+"""Load test: ops dashboards and driver apps against a real server process.
+
+Starts uvicorn (one worker, as deployed) in a scratch directory with a seeded
+hazmat.db (benchmarks/harness.py) and runs two actor populations against it:
+
+  dashboard   every 5 s: /ops/unassigned, /ops/assigned, /ops/completed (the
+              TablePoller set; the desktop app asks for ".json" variants the
+              server does not route, modelled here by the real routes), plus a
+              tab refresh of /ops/collections or /ops/updates on ~20% of ticks
+              and /ops/stats on ~5%
+  driver      every 15 s: /driver/{code}; ~10% of refreshes also POST /scan_qr
+              for one of the open references
+
+Think times are jittered and actors start staggered so they do not tick in
+lockstep. Each --scale step (dashboards x drivers) runs on a freshly seeded
+database and reports, per endpoint, request counts, error counts and latency
+percentiles, plus:
+
+  server CPU        utime+stime of the uvicorn process over the step (/proc)
+  SQLite lock wait  a probe connection takes the write lock (BEGIN IMMEDIATE)
+                    every 100 ms and times how long it waited, i.e. what any
+                    writer (scan, booking, assignment) waits at that moment
+
+The endpoint with the worst p99 per step, and the first step where any p99
+passes --slo-ms, show what tips over first.
+
+    python benchmarks/loadtest.py [--scale 5x10,20x50,50x150] [--duration 60] [--json out.json]
+"""
+import argparse, asyncio, json, os, random, shutil, socket, sqlite3, subprocess, sys, threading, time
+
+import harness
+
+ROOT = harness.ROOT
+DASHBOARD_INTERVAL = 5.0
+DRIVER_INTERVAL = 15.0
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.statuses = {}
+
+    def add(self, endpoint, seconds, status):
+        self.latencies.setdefault(endpoint, []).append(seconds)
+        key = (endpoint, status)
+        self.statuses[key] = self.statuses.get(key, 0) + 1
+        if status >= 500 or status == 0:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def report(self):
+        rows = {}
+        for endpoint, latencies in self.latencies.items():
+            rows[endpoint] = {**harness.percentiles(latencies), "errors": self.errors.get(endpoint, 0),
+                              "statuses": {str(s): n for (e, s), n in sorted(self.statuses.items()) if e == endpoint}}
+        return rows
+
+
+async def timed(client, recorder, endpoint, method, url, **kwargs):
+    started = time.perf_counter()
+    try:
+        response = await client.request(method, url, **kwargs)
+        await response.aread()
+        status = response.status_code
+    except Exception:
+        status = 0
+    recorder.add(endpoint, time.perf_counter() - started, status)
+
+
+async def dashboard(client, recorder, rng, stop, speed):
+    await asyncio.sleep(rng.uniform(0, DASHBOARD_INTERVAL / speed))
+    while not stop.is_set():
+        polls = [("GET /ops/unassigned", "/ops/unassigned"), ("GET /ops/assigned", "/ops/assigned"),
+                 ("GET /ops/completed", "/ops/completed")]
+        if rng.random() < 0.2:
+            polls.append(rng.choice([("GET /ops/collections", "/ops/collections"), ("GET /ops/updates", "/ops/updates")]))
+        if rng.random() < 0.05:
+            polls.append(("GET /ops/stats", "/ops/stats"))
+        await asyncio.gather(*(timed(client, recorder, name, "GET", url) for name, url in polls))
+        await asyncio.sleep(DASHBOARD_INTERVAL * rng.uniform(0.9, 1.1) / speed)
+
+
+async def driver(client, recorder, rng, stop, speed, code, open_refs):
+    await asyncio.sleep(rng.uniform(0, DRIVER_INTERVAL / speed))
+    while not stop.is_set():
+        await timed(client, recorder, "GET /driver/{code}", "GET", f"/driver/{code}")
+        if open_refs and rng.random() < 0.1:
+            ref = open_refs.pop(rng.randrange(len(open_refs)))
+            await timed(client, recorder, "POST /scan_qr", "POST", "/scan_qr", json={"ref": ref, "driver_id": code})
+        await asyncio.sleep(DRIVER_INTERVAL * rng.uniform(0.7, 1.3) / speed)
+
+
+def cpu_seconds(pid):
+    # utime + stime from /proc/<pid>/stat (fields 14 and 15, in clock ticks).
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class LockProbe(threading.Thread):
+    def __init__(self, db_path, interval=0.1):
+        super().__init__(daemon=True)
+        self.db_path = db_path
+        self.interval = interval
+        self.waits = []
+        self.timeouts = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        while not self.stopped.wait(self.interval):
+            started = time.perf_counter()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                self.waits.append(time.perf_counter() - started)
+                conn.execute("ROLLBACK")
+            except sqlite3.OperationalError:
+                self.timeouts += 1
+        conn.close()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(directory, env, port):
+    log = open(os.path.join(directory, "server.log"), "w")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning", "--no-access-log"],
+        cwd=directory, env={**env, "PYTHONPATH": ROOT}, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"server exited; see {log.name}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise SystemExit("server did not start within 60 s")
+
+
+async def run_actors(base_url, dashboards, drivers, duration, speed, seeded, seed):
+    import httpx
+    recorder = Recorder()
+    stop = asyncio.Event()
+    rng = random.Random(seed)
+    open_refs = list(seeded["open_refs"])
+    limits = httpx.Limits(max_connections=dashboards * 4 + drivers + 10, max_keepalive_connections=dashboards + drivers)
+    async with httpx.AsyncClient(base_url=base_url, timeout=60, limits=limits) as client:
+        actors = [dashboard(client, recorder, random.Random(rng.random()), stop, speed) for _ in range(dashboards)]
+        actors += [driver(client, recorder, random.Random(rng.random()), stop, speed,
+                          seeded["drivers"][n % len(seeded["drivers"])], open_refs) for n in range(drivers)]
+        tasks = [asyncio.create_task(actor) for actor in actors]
+        await asyncio.sleep(duration)
+        stop.set()
+        await asyncio.gather(*tasks)
+    return recorder
+
+
+def run_step(dashboards, drivers, args, base_env):
+    directory = harness.workdir(prefix="hazmat-load-")
+    seeded = harness.seed_database(directory, bookings=args.bookings, drivers=args.drivers_seeded, seed=args.seed)
+    port = free_port()
+    server = start_server(directory, base_env, port)
+    probe = LockProbe(os.path.join(directory, "hazmat.db"))
+    try:
+        cpu_before, started = cpu_seconds(server.pid), time.perf_counter()
+        probe.start()
+        recorder = asyncio.run(run_actors(f"http://127.0.0.1:{port}", dashboards, drivers,
+                                          args.duration, args.speed, seeded, args.seed))
+        wall = time.perf_counter() - started
+        cpu_after = cpu_seconds(server.pid)
+    finally:
+        probe.stopped.set()
+        probe.join()
+        server.terminate()
+        server.wait(timeout=30)
+        if not args.keep:
+            shutil.rmtree(directory, ignore_errors=True)
+    endpoints = recorder.report()
+    total = sum(row["count"] for row in endpoints.values())
+    return {
+        "dashboards": dashboards,
+        "drivers": drivers,
+        "wall_s": round(wall, 2),
+        "requests": total,
+        "throughput_rps": round(total / wall, 2),
+        "server_cpu_pct": round((cpu_after - cpu_before) / wall * 100, 1) if cpu_before is not None and cpu_after is not None else None,
+        "sqlite_lock_wait": {**harness.percentiles(probe.waits), "timeouts": probe.timeouts},
+        "endpoints": endpoints,
+        "worst_endpoint": max(endpoints, key=lambda e: endpoints[e]["p99_ms"]) if endpoints else None,
+    }
+
+
+def print_step(result, slo_ms):
+    lock = result["sqlite_lock_wait"]
+    print(f"\n== {result['dashboards']} dashboards x {result['drivers']} drivers: {result['requests']} requests, "
+          f"{result['throughput_rps']} req/s, server CPU {result['server_cpu_pct']}%, "
+          f"lock wait p50 {lock.get('p50_ms')} / p99 {lock.get('p99_ms')} / max {lock.get('max_ms')} ms")
+    print(f"   {'endpoint':24} {'count':>7} {'errors':>6} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, row in sorted(result["endpoints"].items(), key=lambda item: -item[1]["p99_ms"]):
+        flag = "  > SLO" if row["p99_ms"] > slo_ms else ""
+        print(f"   {name:24} {row['count']:>7} {row['errors']:>6} {row['p50_ms']:>9} {row['p90_ms']:>9} "
+              f"{row['p99_ms']:>9} {row['max_ms']:>9}{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scale", default="5x10,20x50,50x150",
+                        help="comma-separated DASHBOARDSxDRIVERS steps")
+    parser.add_argument("--duration", type=float, default=60, help="seconds per step")
+    parser.add_argument("--speed", type=float, default=1.0, help="divide think times by this (2 = twice as chatty)")
+    parser.add_argument("--bookings", type=int, default=5000, help="rows seeded into hazmat.db")
+    parser.add_argument("--drivers-seeded", type=int, default=40, help="driver codes jobs are assigned to")
+    parser.add_argument("--slo-ms", type=float, default=1000)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--keep", action="store_true", help="keep each step's scratch directory and server.log")
+    parser.add_argument("--json")
+    args = parser.parse_args()
+
+    _, nominatim_url, _, sendgrid_url = harness.start_stand_ins(150, 250)
+    base_env = harness.configure(nominatim_url, sendgrid_url, environ=dict(os.environ))
+    steps = [tuple(int(n) for n in step.lower().split("x")) for step in args.scale.split(",")]
+
+    results = []
+    tipped = None
+    for dashboards, drivers in steps:
+        result = run_step(dashboards, drivers, args, base_env)
+        results.append(result)
+        print_step(result, args.slo_ms)
+        over = [e for e, row in result["endpoints"].items() if row["p99_ms"] > args.slo_ms or row["errors"]]
+        if over and tipped is None:
+            tipped = {"dashboards": dashboards, "drivers": drivers, "endpoints": over}
+    if tipped:
+        print(f"\nFirst over the {args.slo_ms:g} ms p99 SLO (or erroring): {', '.join(tipped['endpoints'])} "
+              f"at {tipped['dashboards']} dashboards x {tipped['drivers']} drivers")
+    else:
+        print(f"\nAll endpoints within the {args.slo_ms:g} ms p99 SLO at every step")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"config": {k: v for k, v in vars(args).items() if k not in ("json", "keep")},
+                       "steps": results, "first_over_slo": tipped}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
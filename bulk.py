@@ -0,0 +1,194 @@
+# bulk.py
+# Bulk booking import (/submit/bulk): a CSV or XLSX sheet with one collection
+# per row is parsed and validated as a whole before anything is booked, then
+# booked as one background job whose progress is polled by id. The pipeline
+# itself (reference block, geocoding, insert, waybills, confirmation) lives in
+# main.py next to the single-booking flow it mirrors.
+import os, io, csv, time, uuid, threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+
+MAX_ROWS = int(os.getenv("BULK_MAX_ROWS") or "500")
+# Jobs allowed to run at once; further uploads get 429 until one finishes.
+MAX_ACTIVE_JOBS = int(os.getenv("BULK_MAX_ACTIVE_JOBS") or "2")
+# Threads rendering bulk waybills, shared by all jobs.
+PDF_WORKERS = int(os.getenv("BULK_PDF_WORKERS") or "2")
+# Finished jobs kept for polling.
+MAX_JOBS = 100
+
+# Column headers are the booking form's field names (case and spaces ignored).
+REQUIRED_COLUMNS = [
+    "shipment_type", "inco_terms", "collection_date",
+    "collection_company", "collection_street", "collection_suburb", "collection_city", "collection_postal",
+    "collection_contact_name", "collection_contact_number", "collection_email",
+    "delivery_company", "delivery_street", "delivery_suburb", "delivery_city", "delivery_postal",
+    "delivery_contact_name", "delivery_contact_number", "delivery_email",
+]
+OPTIONAL_COLUMNS = ["collection_region", "delivery_region", "client_reference", "shipper_notes"]
+SERVICE_TYPES = {"local", "import", "export"}
+
+
+class BulkError(Exception):
+    pass
+
+
+def _header(value):
+    return str(value or "").strip().lower().replace(" ", "_")
+
+
+def _cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        value = value.date()
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _read_csv(content):
+    try:
+        text = content.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        text = content.decode("latin-1")
+    reader = csv.reader(io.StringIO(text))
+    return list(reader)
+
+
+def _read_xlsx(content):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise BulkError("XLSX import needs openpyxl on the server; upload the sheet as CSV")
+    try:
+        workbook = load_workbook(io.BytesIO(content), read_only=True, data_only=True)
+    except Exception:
+        raise BulkError("Could not read the XLSX file")
+    try:
+        return [list(row) for row in workbook.worksheets[0].iter_rows(values_only=True)]
+    finally:
+        workbook.close()
+
+
+def parse(filename, content):
+    """Returns [(sheet row number, {column: value})], skipping blank rows."""
+    name = (filename or "").lower()
+    if name.endswith(".xlsx"):
+        table = _read_xlsx(content)
+    elif name.endswith(".csv") or name.endswith(".txt"):
+        table = _read_csv(content)
+    else:
+        raise BulkError("Upload a .csv or .xlsx file")
+    if not table:
+        raise BulkError("The sheet is empty")
+    headers = [_header(h) for h in table[0]]
+    missing = [c for c in REQUIRED_COLUMNS if c not in headers]
+    if missing:
+        raise BulkError(f"Missing columns: {', '.join(missing)}")
+    rows = []
+    for number, values in enumerate(table[1:], start=2):
+        row = {h: _cell(v) for h, v in zip(headers, values) if h}
+        if any(row.values()):
+            rows.append((number, row))
+    if not rows:
+        raise BulkError("The sheet has no bookings")
+    if len(rows) > MAX_ROWS:
+        raise BulkError(f"At most {MAX_ROWS} bookings per upload; this sheet has {len(rows)}")
+    return rows
+
+
+def validate(rows):
+    """Per-row problems as [{"row": n, "errors": [...]}]; empty when all rows are bookable."""
+    problems = []
+    for number, row in rows:
+        errors = [f"missing {c}" for c in REQUIRED_COLUMNS if not row.get(c)]
+        service_type = row.get("shipment_type", "").lower()
+        if service_type and service_type not in SERVICE_TYPES:
+            errors.append(f"shipment_type must be one of {', '.join(sorted(SERVICE_TYPES))}")
+        for column in ("collection_email", "delivery_email"):
+            if row.get(column) and not all("@" in e for e in row[column].split(",") if e.strip()):
+                errors.append(f"invalid {column}")
+        if errors:
+            problems.append({"row": number, "errors": errors})
+    return problems
+
+
+class Job:
+    # status: queued -> geocoding -> inserting -> rendering -> emailing -> done (or failed)
+    def __init__(self, total, client_id=None):
+        self.id = uuid.uuid4().hex[:16]
+        self.total = total
+        self.client_id = client_id
+        self.status = "queued"
+        self.progress = {"addresses": 0, "geocoded": 0, "inserted": 0, "rendered": 0, "emailed": 0}
+        self.bookings = []
+        self.emails = []
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.task = None
+
+    @property
+    def active(self):
+        return self.status not in ("done", "failed")
+
+    def advance(self, key, amount=1):
+        with _lock:
+            self.progress[key] += amount
+
+    def to_dict(self):
+        with _lock:
+            progress = dict(self.progress)
+        result = {
+            "job_id": self.id,
+            "status": self.status,
+            "total": self.total,
+            "progress": progress,
+            "created_at": datetime.fromtimestamp(self.created).isoformat(timespec="seconds"),
+        }
+        if self.finished:
+            result["seconds"] = round(self.finished - self.created, 1)
+        if self.status == "done":
+            result["confirmation"] = {"bookings": self.bookings, "emails": self.emails}
+        if self.error:
+            result["error"] = self.error
+        return result
+
+
+_jobs = OrderedDict()
+_lock = threading.Lock()
+_pdf_pool = None
+
+
+def pdf_pool():
+    # Waybills render on their own threads so a 200-row job cannot starve the
+    # default executor that serves the sync endpoints.
+    global _pdf_pool
+    if _pdf_pool is None:
+        _pdf_pool = ThreadPoolExecutor(PDF_WORKERS, thread_name_prefix="waybill")
+    return _pdf_pool
+
+
+def create(total, client_id=None):
+    """Registers a new job, or returns None while MAX_ACTIVE_JOBS are running."""
+    with _lock:
+        if sum(1 for job in _jobs.values() if job.active) >= MAX_ACTIVE_JOBS:
+            return None
+        job = Job(total, client_id)
+        _jobs[job.id] = job
+        finished = [job_id for job_id, j in _jobs.items() if not j.active]
+        for job_id in finished[:max(0, len(_jobs) - MAX_JOBS)]:
+            del _jobs[job_id]
+        return job
+
+
+def get(job_id):
+    return _jobs.get(job_id)
+
+
+def stats():
+    with _lock:
+        return {"jobs": len(_jobs), "active": sum(1 for job in _jobs.values() if job.active)}
@@ -0,0 +1,184 @@
+# compression.py
+# ASGI middleware that gzip/brotli-compresses dynamic responses (JSON lists,
+# HTML, CSV exports) above a size threshold. Bodies are compressed as they
+# stream, so StreamingResponse exports are never buffered whole.
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = (
+    "text/", "application/json", "application/javascript", "application/xml", "image/svg+xml",
+)
+
+
+def accepted_encodings(accept_encoding):
+    """{coding: q} from an Accept-Encoding header; a missing q is 1."""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def _quality(accepted, coding):
+    # Codings not named fall back to "*"; q=0 (or no match) means not acceptable.
+    return accepted.get(coding, accepted.get("*", 0.0))
+
+
+def accepts(accept_encoding, coding):
+    return _quality(accepted_encodings(accept_encoding), coding) > 0
+
+
+def negotiate(accept_encoding, allow_brotli=True):
+    """The coding to use for this Accept-Encoding: the acceptable one with the
+    highest q, brotli first on a tie; None to send the body as is."""
+    accepted = accepted_encodings(accept_encoding)
+    best, best_q = None, 0.0
+    for coding in (("br",) if allow_brotli and brotli is not None else ()) + ("gzip",):
+        q = _quality(accepted, coding)
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def merge_vary(headers, field=b"Accept-Encoding"):
+    """headers (ASGI list) with field added to the one Vary header, unless it
+    is already listed there or Vary is "*"."""
+    out, listed = [], None
+    for name, value in headers:
+        if name == b"vary":
+            listed = value if listed is None else listed + b", " + value
+        else:
+            out.append((name, value))
+    if listed is None:
+        listed = field
+    else:
+        tokens = {token.strip().lower() for token in listed.split(b",")}
+        if b"*" not in tokens and field.lower() not in tokens:
+            listed += b", " + field
+    out.append((b"vary", listed))
+    return out
+
+
+class StreamCompressor:
+    """Incremental gzip/brotli encoder; flush() emits everything fed so far."""
+
+    def __init__(self, encoding, gzip_level=6, brotli_quality=4):
+        self.encoding = encoding
+        if encoding == "br":
+            self._br = brotli.Compressor(quality=brotli_quality)
+        else:
+            self._gz = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+
+    def compress(self, data, flush=False):
+        if self.encoding == "br":
+            out = self._br.process(data)
+            return out + self._br.flush() if flush else out
+        out = self._gz.compress(data)
+        return out + self._gz.flush(zlib.Z_SYNC_FLUSH) if flush else out
+
+    def finish(self, data=b""):
+        if self.encoding == "br":
+            return self._br.process(data) + self._br.finish()
+        return self._gz.compress(data) + self._gz.flush(zlib.Z_FINISH)
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size=1024, gzip_level=6, brotli_quality=4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept = b""
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept = value
+                break
+        encoding = negotiate(accept.decode("latin-1"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await _CompressedResponder(self, encoding, send).run(scope, receive)
+
+
+class _CompressedResponder:
+    def __init__(self, config, encoding, send):
+        self.config = config
+        self.encoding = encoding
+        self.send = send
+        self.start = None
+        self.compressor = None
+        self.passthrough = False
+
+    async def run(self, scope, receive):
+        await self.config.app(scope, receive, self.on_send)
+
+    def _should_compress(self, message):
+        # A 206 or any content-range body is a byte slice of the full
+        # representation; encoding the slice would not match the range.
+        if message.get("status") == 206:
+            return False
+        content_type = ""
+        for name, value in message.get("headers", []):
+            if name in (b"content-encoding", b"content-range"):
+                return False
+            if name == b"content-type":
+                content_type = value.decode("latin-1").lower()
+        return content_type.startswith(COMPRESSIBLE_TYPES)
+
+    async def on_send(self, message):
+        if message["type"] == "http.response.start":
+            self.start = message
+            self.passthrough = not self._should_compress(message)
+            if self.passthrough:
+                await self.send(message)
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.compressor is None:
+            if not more_body and len(body) < self.config.minimum_size:
+                self.passthrough = True
+                await self.send(self.start)
+                await self.send(message)
+                return
+            self.compressor = StreamCompressor(self.encoding, self.config.gzip_level, self.config.brotli_quality)
+            headers = [(k, v) for k, v in self.start.get("headers", []) if k != b"content-length"]
+            headers.append((b"content-encoding", self.encoding.encode()))
+            headers = merge_vary(headers)
+            if not more_body:
+                compressed = self.compressor.finish(body)
+                headers.append((b"content-length", str(len(compressed)).encode()))
+                await self.send({**self.start, "headers": headers})
+                await self.send({"type": "http.response.body", "body": compressed})
+                return
+            await self.send({**self.start, "headers": headers})
+
+        if more_body:
+            # Flush per chunk so streamed exports reach the client as they are produced.
+            await self.send({"type": "http.response.body", "body": self.compressor.compress(body, flush=True),
+                             "more_body": True})
+        else:
+            await self.send({"type": "http.response.body", "body": self.compressor.finish(body)})
@@ -24,6 +24,8 @@ from PyQt6.QtCore import QObject, QTimer, pyqtSignal, QUrl, QByteArray
 from PyQt6.QtNetwork import QNetworkAccessManager, QNetworkRequest, QNetworkReply
 import json
 load_dotenv()
+# One keep-alive session for every poll so each refresh reuses the TLS connection.
+http = requests.Session()
 class TablePoller(QObject):
     collections_updated = pyqtSignal(list)
     assigned_updated = pyqtSignal(list)
@@ -500,7 +502,7 @@ class DashboardWindow(QMainWindow):
 
         def refresh_collections_tab(self):
             try:
-                response = requests.get("https://hazmat-collection.onrender.com/ops/collections", timeout=10)
+                response = http.get("https://hazmat-collection.onrender.com/ops/collections", timeout=10)
                 if response.status_code == 200:
                     data = response.json()
                     assigned = [item for item in data if item.get("driver") and item["driver"] != "Unassigned"]
@@ -518,7 +520,7 @@ class DashboardWindow(QMainWindow):
 
         def refresh_deliveries_tab(self):
             try:
-                response = requests.get("https://hazmat-collection.onrender.com/ops/assigned.json", timeout=10)
+                response = http.get("https://hazmat-collection.onrender.com/ops/assigned.json", timeout=10)
                 if response.status_code == 200:
                     deliveries = response.json()
                     self.deliveries_table.setRowCount(len(deliveries))
@@ -533,7 +535,7 @@ class DashboardWindow(QMainWindow):
 
         def refresh_updates_tab(self):
             try:
-                response = requests.get("https://hazmat-collection.onrender.com/ops/updates", timeout=10)
+                response = http.get("https://hazmat-collection.onrender.com/ops/updates", timeout=10)
                 if response.status_code == 200:
                     updates = response.json()
                     self.update_table.setRowCount(len(updates))
@@ -553,7 +555,7 @@ class DashboardWindow(QMainWindow):
 
         def refresh_completed_tab(self):
             try:
-                response = requests.get("https://hazmat-collection.onrender.com/ops/completed", timeout=10)
+                response = http.get("https://hazmat-collection.onrender.com/ops/completed", timeout=10)
                 if response.status_code == 200:
                     completed = response.json()
                     self.completed_table.setRowCount(len(completed))
@@ -1342,13 +1344,17 @@ class DashboardWindow(QMainWindow):
             for row in range(self.completed_table.rowCount()):
                 self.completed_table.setRowHidden(row, False)
 
-        def export_completed_to_excel(self):
+        def export_completed_to_excel(self, on_saved=None):
             """
-            Export visible rows to Excel, skipping Documents and POD columns.
+            Download the completed-shipments workbook from the server export endpoint.
+            The server builds it straight from the database, so the export covers all
+            matching rows (not just what is loaded in the table) and the GUI thread
+            only copies bytes to disk as they arrive. on_saved(filename) runs once the
+            file is complete.
             """
-            import os, xlsxwriter
+            import os
             from datetime import datetime
-            from PyQt6.QtWidgets import QMessageBox
+            from urllib.parse import urlencode
 
             documents_folder = os.path.join(os.path.expanduser("~"), "Documents")
             os.makedirs(documents_folder, exist_ok=True)
@@ -1358,50 +1364,36 @@ class DashboardWindow(QMainWindow):
                 f"completed_shipments_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
             )
 
-            workbook = xlsxwriter.Workbook(filename)
-            worksheet = workbook.add_worksheet("Completed Shipments")
-
-            header_format = workbook.add_format({
-                'bold': True, 'bg_color': '#2E7D32', 'font_color': 'white',
-                'align': 'center', 'valign': 'vcenter', 'border': 1
-            })
-            row_format = workbook.add_format({'border': 1, 'font_name': 'Segoe UI', 'font_size': 11})
-            alt_row_format = workbook.add_format(
-                {'border': 1, 'bg_color': '#F1F8E9', 'font_name': 'Segoe UI', 'font_size': 11})
-            date_format = workbook.add_format({'num_format': 'yyyy-mm-dd', 'border': 1})
-
-            # Headers (skip Document and POD)
-            headers = [self.completed_table.horizontalHeaderItem(i).text()
-                       for i in range(self.completed_table.columnCount())
-                       if i not in (8, 9)]
-            for col, header in enumerate(headers):
-                worksheet.write(0, col, header, header_format)
-                worksheet.set_column(col, col, 18)
-
-            # Data rows
-            row_excel = 1
-            for row in range(self.completed_table.rowCount()):
-                if not self.completed_table.isRowHidden(row):
-                    fmt = alt_row_format if row_excel % 2 == 0 else row_format
-                    col_excel = 0
-                    for col in range(self.completed_table.columnCount()):
-                        if col in (8, 9):  # Skip Document and POD
-                            continue
-                        item = self.completed_table.item(row, col)
-                        value = item.text() if item else ""
-                        if col in (4, 5):  # Pickup Date, Delivery Date
-                            try:
-                                date_obj = datetime.strptime(value, "%Y-%m-%d")
-                                worksheet.write_datetime(row_excel, col_excel, date_obj, date_format)
-                            except:
-                                worksheet.write(row_excel, col_excel, value, fmt)
-                        else:
-                            worksheet.write(row_excel, col_excel, value, fmt)
-                        col_excel += 1
-                    row_excel += 1
+            params = {"format": "xlsx"}
+            client = self.completed_search_input.text().strip()
+            if client:
+                params["client"] = client
+            url = f"https://hazmat-collection.onrender.com/ops/completed/export?{urlencode(params)}"
 
-            workbook.close()
-            self.toast_manager.show_toast("Report saved successfully")
+            if not hasattr(self, "export_nam"):
+                self.export_nam = QNetworkAccessManager(self)
+            reply = self.export_nam.get(QNetworkRequest(QUrl(url)))
+            out = open(filename, "wb")
+            self.toast_manager.show_toast("Exporting report...")
+
+            def write_chunk():
+                out.write(bytes(reply.readAll()))
+
+            def finish():
+                write_chunk()
+                out.close()
+                if reply.error() == QNetworkReply.NetworkError.NoError:
+                    self.toast_manager.show_toast("Report saved successfully")
+                    if on_saved:
+                        on_saved(filename)
+                else:
+                    os.remove(filename)
+                    print("❌ Export failed:", reply.errorString())
+                    self.toast_manager.show_toast("Report export failed")
+                reply.deleteLater()
+
+            reply.readyRead.connect(write_chunk)
+            reply.finished.connect(finish)
 
 
         def open_mail_dialog(self):
@@ -1422,17 +1414,13 @@ class DashboardWindow(QMainWindow):
             dialog.exec()
 
         def send_report(self, emails, dialog):
-            # Export Excel first
+            # Export Excel first; the mail goes out once the download has finished
+            self.export_completed_to_excel(on_saved=lambda filename: self._mail_report(emails, dialog, filename))
+
+        def _mail_report(self, emails, dialog, filename):
             import os
-            from datetime import datetime
             from PyQt6.QtWidgets import QMessageBox
 
-            filename = os.path.join(
-                os.path.expanduser("~"), "Documents",
-                f"completed_shipments_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-            )
-            self.export_completed_to_excel()  # ensures file is created
-
             # --- SendGrid integration ---
             from sendgrid import SendGridAPIClient
             from sendgrid.helpers.mail import Mail, Attachment, FileContent, FileName, FileType, Disposition
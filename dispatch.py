@@ -0,0 +1,122 @@
+# dispatch.py
+# Proposes drivers for unassigned bookings. Each open job, earliest pickup
+# first, is scored against the drivers near its collection point (a grid index
+# over driver positions): distance in km, plus a penalty per job already on the
+# driver's list and for drivers outside the job's branch region. The plan is
+# read-only; main applies it through the /assign/bulk path.
+import os, sqlite3, time
+import geo, locations
+
+DB_PATH = "hazmat.db"
+RADIUS_KM = float(os.getenv("DISPATCH_RADIUS_KM") or "80")
+# Open jobs a driver may carry; full drivers are skipped.
+MAX_LOAD = int(os.getenv("DISPATCH_MAX_LOAD") or "8")
+# One more job on a driver's list weighs as much as this many km of detour.
+LOAD_PENALTY_KM = float(os.getenv("DISPATCH_LOAD_PENALTY_KM") or "5")
+REGION_PENALTY_KM = 40.0
+# Older live positions are ignored and the driver counts from their depot.
+POSITION_MAX_AGE = 4 * 3600
+
+# Known drivers and the depot each starts from.
+ROSTER = {
+    "HK": {"name": "Hendrik", "lat": -26.2041, "lng": 28.0473},
+    "MV": {"name": "Morne", "lat": -26.2560, "lng": 28.3200},
+}
+
+
+def driver_positions(now=None):
+    """{code: driver} for every driver with a usable position: a recent live
+    one from locations, else the roster depot."""
+    now = now or time.time()
+    drivers = {}
+    for code, info in ROSTER.items():
+        drivers[code] = {"code": code, "name": info["name"], "lat": info["lat"], "lng": info["lng"],
+                         "live": False, "last_seen": None}
+    for code, (lat, lng, seen) in locations.snapshot().items():
+        if now - seen > POSITION_MAX_AGE:
+            continue
+        name = ROSTER.get(code, {}).get("name", code)
+        drivers[code] = {"code": code, "name": name, "lat": lat, "lng": lng, "live": True,
+                         "last_seen": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(seen))}
+    for driver in drivers.values():
+        driver["region"] = geo.nearest_branch(driver["lat"], driver["lng"])
+    return drivers
+
+
+def open_jobs(cursor, refs=None):
+    cursor.execute("""
+        SELECT reference_number, collection_lat, collection_lng, collection_region, pickup_date
+        FROM requests
+        WHERE (assigned_driver IS NULL OR assigned_driver = '')
+          AND (status IS NULL OR status != 'Delivered')
+    """)
+    wanted = set(refs) if refs else None
+    return [{"ref": ref, "lat": lat, "lng": lng, "region": region, "pickup_date": pickup}
+            for ref, lat, lng, region, pickup in cursor.fetchall() if wanted is None or ref in wanted]
+
+
+def driver_loads(cursor):
+    cursor.execute("""
+        SELECT assigned_driver, COUNT(*) FROM requests
+        WHERE assigned_driver IS NOT NULL AND assigned_driver != ''
+          AND (status IS NULL OR status != 'Delivered')
+        GROUP BY assigned_driver
+    """)
+    return dict(cursor.fetchall())
+
+
+def plan(jobs, drivers, loads, radius_km=RADIUS_KM, max_load=MAX_LOAD):
+    """Greedy assignment: returns (proposals, unplaced). Loads are updated as
+    jobs are placed, so one plan spreads work instead of piling it on the
+    nearest driver."""
+    index = geo.GridIndex(cell_km=max(5.0, radius_km / 4))
+    for code, driver in drivers.items():
+        index.move(code, driver["lat"], driver["lng"])
+    loads = {code: loads.get(code, 0) for code in drivers}
+    proposals, unplaced = [], []
+    for job in sorted(jobs, key=lambda j: (j["pickup_date"] or "9999-12-31", j["ref"])):
+        if job["lat"] is None or job["lng"] is None:
+            unplaced.append({"ref": job["ref"], "reason": "no collection coordinates"})
+            continue
+        city = geo.branch_city(job["region"])
+        best = None
+        for distance, code in index.within(job["lat"], job["lng"], radius_km):
+            # Candidates come nearest first and penalties only add, so no
+            # farther driver can beat a score this distance already exceeds.
+            if best is not None and distance >= best[0]:
+                break
+            if loads[code] >= max_load:
+                continue
+            score = distance + loads[code] * LOAD_PENALTY_KM
+            if city and drivers[code]["region"] != city:
+                score += REGION_PENALTY_KM
+            if best is None or score < best[0]:
+                best = (score, code, distance)
+        if best is None:
+            unplaced.append({"ref": job["ref"], "reason": f"no driver with capacity within {radius_km:g} km"})
+            continue
+        score, code, distance = best
+        loads[code] += 1
+        proposals.append({"ref": job["ref"], "driver": code, "distance_km": round(distance, 2),
+                          "score": round(score, 2), "driver_load": loads[code]})
+    return proposals, unplaced
+
+
+def propose(radius_km=None, refs=None):
+    started = time.perf_counter()
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        cursor = conn.cursor()
+        jobs = open_jobs(cursor, refs)
+        loads = driver_loads(cursor)
+    finally:
+        conn.close()
+    drivers = driver_positions()
+    proposals, unplaced = plan(jobs, drivers, loads, radius_km or RADIUS_KM)
+    return {
+        "jobs": len(jobs),
+        "drivers": len(drivers),
+        "proposals": proposals,
+        "unplaced": unplaced,
+        "ms": round((time.perf_counter() - started) * 1000, 1),
+    }
@@ -0,0 +1,57 @@
+# events.py
+# In-process change events. publish() hands each event to the subscribers of
+# its topic (caches that must drop stale entries) and appends it to a short
+# history that dashboards can poll with ?since=<seq> instead of re-reading
+# whole tables.
+import time, threading
+from collections import deque
+import logs
+
+HISTORY = 1000
+
+_subscribers = {}
+_history = deque(maxlen=HISTORY)
+_lock = threading.Lock()
+_seq = 0
+log = logs.get("events")
+
+
+def subscribe(topic, callback=None):
+    """subscribe("assignments", fn), or as a decorator: @events.subscribe("assignments")."""
+    def register(func):
+        with _lock:
+            _subscribers.setdefault(topic, []).append(func)
+        return func
+    return register(callback) if callback else register
+
+
+def publish(topic, **data):
+    global _seq
+    with _lock:
+        _seq += 1
+        event = {"seq": _seq, "topic": topic, "at": time.strftime("%Y-%m-%dT%H:%M:%S"), **data}
+        _history.append(event)
+        subscribers = list(_subscribers.get(topic, ()))
+    for callback in subscribers:
+        try:
+            callback(event)
+        except Exception:
+            log.exception("event subscriber failed", extra={"topic": topic, "subscriber": callback.__name__})
+    return event
+
+
+def since(seq, topic=None):
+    """(latest seq, events after seq, complete). complete is False when events
+    after seq have already dropped out of the history, or seq is from before a
+    restart; the caller should reload instead."""
+    with _lock:
+        latest = _seq
+        oldest = _history[0]["seq"] if _history else latest + 1
+        events = [e for e in _history if e["seq"] > seq and (topic is None or e["topic"] == topic)]
+    return latest, events, oldest - 1 <= seq <= latest
+
+
+def stats():
+    with _lock:
+        return {"seq": _seq, "history": len(_history),
+                "subscribers": {topic: len(callbacks) for topic, callbacks in _subscribers.items()}}
@@ -0,0 +1,138 @@
+# exports.py
+# Server-side export of completed shipments straight from a SQLite cursor.
+# CSV is streamed chunk by chunk; XLSX is written with xlsxwriter in
+# constant_memory mode (rows are flushed to disk as they are written).
+import sqlite3, csv, io, os, tempfile
+from datetime import datetime
+
+DB_PATH = "hazmat.db"
+CHUNK_SIZE = 1000
+
+# Same columns as the dashboard's Completed Shipments export (Document/POD skipped).
+EXPORT_HEADERS = ["Ops", "HMJ Ref", "HAZJNB Ref", "Client", "Pickup Date", "Delivery Date", "Time", "Signed By"]
+
+
+def _completed_query(date_from=None, date_to=None, client=None):
+    filters = []
+    params = []
+    if date_from:
+        filters.append("c.delivery_date >= ?")
+        params.append(date_from)
+    if date_to:
+        filters.append("c.delivery_date <= ?")
+        params.append(date_to)
+    if client:
+        filters.append("c.company LIKE ?")
+        params.append(f"%{client}%")
+    where = f"WHERE {' AND '.join(filters)}" if filters else ""
+    # Rows written before completed.haz_ref existed reach their booking (and its
+    # pickup date) through updates.ops -> updates.haz, as /ops/completed does.
+    sql = f"""
+        SELECT ops, hmj, haz_ref, company,
+               (SELECT r.pickup_date FROM requests r WHERE r.reference_number = haz_ref),
+               delivery_date, time, signed_by
+        FROM (
+            SELECT c.id, c.ops, c.company, c.delivery_date, c.time, c.signed_by,
+                   (SELECT u.hmj FROM updates u WHERE u.ops = c.ops ORDER BY u.id DESC LIMIT 1) AS hmj,
+                   COALESCE(c.haz_ref, (SELECT u.haz FROM updates u WHERE u.ops = c.ops ORDER BY u.id DESC LIMIT 1))
+                       AS haz_ref
+            FROM completed c
+            {where}
+        )
+        ORDER BY delivery_date, id
+    """
+    return sql, params
+
+
+def iter_completed_rows(date_from=None, date_to=None, client=None):
+    sql, params = _completed_query(date_from, date_to, client)
+    # StreamingResponse advances this generator through iterate_in_threadpool,
+    # so each step (and the close) may run on a different worker thread. The
+    # steps never overlap, which makes sharing the connection across them safe.
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(CHUNK_SIZE)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        conn.close()
+
+
+def stream_completed_csv(date_from=None, date_to=None, client=None):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_HEADERS)
+    pending = 1
+    for row in iter_completed_rows(date_from, date_to, client):
+        writer.writerow(["" if v is None else v for v in row])
+        pending += 1
+        if pending >= CHUNK_SIZE:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def write_completed_xlsx(date_from=None, date_to=None, client=None):
+    """Write the export to a temp .xlsx and return its path; the caller deletes it.
+    If writing fails the file is removed here."""
+    import xlsxwriter
+
+    fd, path = tempfile.mkstemp(suffix=".xlsx", prefix="completed_")
+    os.close(fd)
+    try:
+        _write_xlsx(xlsxwriter.Workbook(path, {"constant_memory": True}), date_from, date_to, client)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path
+
+
+def _write_xlsx(workbook, date_from, date_to, client):
+    worksheet = workbook.add_worksheet("Completed Shipments")
+
+    header_format = workbook.add_format({
+        'bold': True, 'bg_color': '#2E7D32', 'font_color': 'white',
+        'align': 'center', 'valign': 'vcenter', 'border': 1
+    })
+    row_format = workbook.add_format({'border': 1, 'font_name': 'Segoe UI', 'font_size': 11})
+    alt_row_format = workbook.add_format(
+        {'border': 1, 'bg_color': '#F1F8E9', 'font_name': 'Segoe UI', 'font_size': 11})
+    date_format = workbook.add_format(
+        {'num_format': 'yyyy-mm-dd', 'border': 1, 'font_name': 'Segoe UI', 'font_size': 11})
+    alt_date_format = workbook.add_format(
+        {'num_format': 'yyyy-mm-dd', 'border': 1, 'bg_color': '#F1F8E9', 'font_name': 'Segoe UI', 'font_size': 11})
+
+    # constant_memory requires row-by-row writing, so column widths go first.
+    worksheet.set_column(0, len(EXPORT_HEADERS) - 1, 18)
+    for col, header in enumerate(EXPORT_HEADERS):
+        worksheet.write(0, col, header, header_format)
+
+    row_excel = 1
+    for row in iter_completed_rows(date_from, date_to, client):
+        alternate = row_excel % 2 == 0
+        fmt = alt_row_format if alternate else row_format
+        for col, value in enumerate(row):
+            value = "" if value is None else value
+            if col in (4, 5):  # Pickup Date, Delivery Date
+                try:
+                    worksheet.write_datetime(row_excel, col, datetime.strptime(value, "%Y-%m-%d"),
+                                             alt_date_format if alternate else date_format)
+                    continue
+                except (TypeError, ValueError):
+                    pass
+            worksheet.write(row_excel, col, value, fmt)
+        row_excel += 1
+
+    workbook.close()
+
+
+def export_filename(extension, date_from=None, date_to=None):
+    span = "_".join(p for p in (date_from, date_to) if p) or datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"completed_shipments_{span}.{extension}"
@@ -0,0 +1,97 @@
+# geo.py
+# Small geographic helpers shared by dispatch, route planning and the driver
+# location store: great-circle distance, the branch nearest a point, and a
+# uniform grid index for "what is within X km of here" over moving points.
+import math
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 111.32
+
+# Branch cities and their centres.
+BRANCHES = {
+    "Johannesburg": (-26.2041, 28.0473),
+    "Durban": (-29.8587, 31.0218),
+    "Cape Town": (-33.9249, 18.4241),
+    "Port Elizabeth": (-33.9608, 25.6022),
+}
+
+# Region codes used on the booking form.
+REGION_CODES = {"JNB": "Johannesburg", "KZN": "Durban", "CPT": "Cape Town", "PLZ": "Port Elizabeth"}
+
+# Region code or city name -> branch city; the geocoder's hint and dispatch's
+# branch both come from here.
+BRANCH_CITY_MAP = {**{city: city for city in BRANCHES}, **REGION_CODES}
+
+
+def branch_city(region):
+    """Branch city for a region code or city name, else None."""
+    return BRANCH_CITY_MAP.get(region) if region else None
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def nearest_branch(lat, lng):
+    return min(BRANCHES, key=lambda city: haversine_km(lat, lng, *BRANCHES[city]))
+
+
+class GridIndex:
+    """Points bucketed into square cells of cell_km (in latitude degrees; the
+    longitude span of a query is widened by 1/cos(lat)). move() re-buckets a
+    point only when it changes cell, so frequent position updates are cheap."""
+
+    def __init__(self, cell_km=10.0):
+        self.cell_deg = cell_km / KM_PER_DEGREE_LAT
+        self.cells = {}
+        self.points = {}
+
+    def _cell(self, lat, lng):
+        return (math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg))
+
+    def move(self, key, lat, lng):
+        cell = self._cell(lat, lng)
+        previous = self.points.get(key)
+        if previous is not None and previous[2] != cell:
+            bucket = self.cells[previous[2]]
+            bucket.discard(key)
+            if not bucket:
+                del self.cells[previous[2]]
+        if previous is None or previous[2] != cell:
+            self.cells.setdefault(cell, set()).add(key)
+        self.points[key] = (lat, lng, cell)
+
+    def remove(self, key):
+        previous = self.points.pop(key, None)
+        if previous is not None:
+            bucket = self.cells[previous[2]]
+            bucket.discard(key)
+            if not bucket:
+                del self.cells[previous[2]]
+
+    def within(self, lat, lng, radius_km):
+        """[(distance_km, key)] for points within radius_km, nearest first."""
+        lat_span = radius_km / KM_PER_DEGREE_LAT
+        lng_span = lat_span / max(0.01, math.cos(math.radians(lat)))
+        row_lo, col_lo = self._cell(lat - lat_span, lng - lng_span)
+        row_hi, col_hi = self._cell(lat + lat_span, lng + lng_span)
+        found = []
+        if (row_hi - row_lo + 1) * (col_hi - col_lo + 1) > len(self.cells):
+            candidates = (key for bucket in self.cells.values() for key in bucket)
+        else:
+            candidates = (key for row in range(row_lo, row_hi + 1) for col in range(col_lo, col_hi + 1)
+                          for key in self.cells.get((row, col), ()))
+        for key in candidates:
+            plat, plng, _ = self.points[key]
+            distance = haversine_km(lat, lng, plat, plng)
+            if distance <= radius_km:
+                found.append((distance, key))
+        found.sort()
+        return found
+
+    def __len__(self):
+        return len(self.points)
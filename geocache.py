@@ -0,0 +1,44 @@
+# geocache.py
+# In-process LRU of geocoding results keyed by the exact Nominatim query. Only
+# confident hits are kept; the scheduler primes it from recent bookings so a
+# wake-up does not send every repeat address back to Nominatim.
+import threading
+from collections import OrderedDict
+
+MAX_ENTRIES = 4096
+
+_entries = OrderedDict()
+_lock = threading.Lock()
+hits = 0
+misses = 0
+
+
+def query_for(address, hint=None):
+    return f"{address}, {hint}" if hint else address
+
+
+def get(query):
+    """Returns ((lat, lng), confidence) or None."""
+    global hits, misses
+    key = query.strip().lower()
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            misses += 1
+            return None
+        _entries.move_to_end(key)
+        hits += 1
+        return entry
+
+
+def put(query, coords, confidence):
+    key = query.strip().lower()
+    with _lock:
+        _entries[key] = (tuple(coords), confidence)
+        _entries.move_to_end(key)
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+
+
+def stats():
+    return {"entries": len(_entries), "hits": hits, "misses": misses}
@@ -0,0 +1,174 @@
+# idempotency.py
+# Idempotency keys for write endpoints. A client (or the booking form's hidden
+# idempotency_key field) sends a key; the first request with that key does the
+# work and its response is stored for 24 h. Retries get the stored response
+# back instead of booking, assigning or completing a second time. The key is
+# bound to a fingerprint of the request it was first used with, so reusing it
+# for a different request is refused rather than answered with a stale replay.
+import sqlite3, time, json, hashlib
+from fastapi.responses import JSONResponse, Response
+import sessions
+
+DB_PATH = "hazmat.db"
+TTL_SECONDS = 24 * 3600
+# A claim still pending after this long belongs to a request that died mid-way.
+PENDING_TIMEOUT_SECONDS = 600
+HEADER = "Idempotency-Key"
+FORM_FIELD = "idempotency_key"
+
+
+def init_idempotency_table():
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute("""CREATE TABLE IF NOT EXISTS idempotency_keys (
+        key TEXT,
+        path TEXT,
+        status_code INTEGER,
+        media_type TEXT,
+        body BLOB,
+        created_at REAL,
+        fingerprint TEXT,
+        PRIMARY KEY (key, path)
+    );""")
+    conn.commit()
+    conn.close()
+
+
+def request_key(request, form=None):
+    key = request.headers.get(HEADER)
+    if not key and form is not None:
+        key = form.get(FORM_FIELD)
+    key = (key or "").strip()
+    return key[:255] or None
+
+
+def fingerprint(request, payload):
+    """Hash of method, path, signed-in client and payload (a JSON body or a
+    form; uploads count by name and size, the key field itself is left out)."""
+    if hasattr(payload, "multi_items"):
+        items = []
+        for name, value in payload.multi_items():
+            if name == FORM_FIELD:
+                continue
+            if hasattr(value, "filename"):
+                value = {"filename": value.filename, "size": value.size}
+            items.append([name, value])
+        payload = sorted(items, key=lambda item: item[0])
+    digest = hashlib.sha256()
+    for part in (request.method, request.url.path, sessions.current_client_id(request) or ""):
+        digest.update(str(part).encode())
+        digest.update(b"\0")
+    digest.update(json.dumps(payload, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def purge_expired():
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM idempotency_keys WHERE created_at < ?", (time.time() - TTL_SECONDS,))
+    removed = cursor.rowcount
+    conn.commit()
+    conn.close()
+    return removed
+
+
+def claim(key, path, fingerprint=None):
+    """Reserve key for this request, or return the response to replay.
+
+    Returns None when the caller should go ahead and do the work.
+    """
+    if not key:
+        return None
+    now = time.time()
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            DELETE FROM idempotency_keys
+            WHERE key = ? AND path = ?
+              AND (created_at < ? OR (status_code IS NULL AND created_at < ?))
+        """, (key, path, now - TTL_SECONDS, now - PENDING_TIMEOUT_SECONDS))
+        try:
+            cursor.execute(
+                "INSERT INTO idempotency_keys (key, path, created_at, fingerprint) VALUES (?, ?, ?, ?)",
+                (key, path, now, fingerprint)
+            )
+            conn.commit()
+            return None
+        except sqlite3.IntegrityError:
+            cursor.execute(
+                "SELECT status_code, media_type, body, fingerprint FROM idempotency_keys WHERE key = ? AND path = ?",
+                (key, path)
+            )
+            row = cursor.fetchone()
+    finally:
+        conn.close()
+
+    if row is None:
+        return None
+    status_code, media_type, body, stored = row
+    if fingerprint and stored and stored != fingerprint:
+        return JSONResponse(
+            {"status": "error", "message": "This Idempotency-Key was already used for a different request"},
+            status_code=422
+        )
+    if status_code is None:
+        return JSONResponse(
+            {"status": "error", "message": "A request with this Idempotency-Key is still in progress"},
+            status_code=409,
+            headers={"Retry-After": "5"}
+        )
+    return Response(content=body, status_code=status_code, media_type=media_type,
+                    headers={"Idempotent-Replayed": "true"})
+
+
+def release(key, path):
+    # Forget a claim whose request failed so the client's retry can run.
+    if not key:
+        return
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute("DELETE FROM idempotency_keys WHERE key = ? AND path = ? AND status_code IS NULL", (key, path))
+    conn.commit()
+    conn.close()
+
+
+def remember(key, path, result):
+    response = result if isinstance(result, Response) else JSONResponse(result)
+    if not key:
+        return response
+    # Only successes are replayed: after a validation error or a failure the
+    # client fixes the request and resubmits it under the same key.
+    if not 200 <= response.status_code < 300 or not hasattr(response, "body"):
+        release(key, path)
+        return response
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute("""
+        UPDATE idempotency_keys SET status_code = ?, media_type = ?, body = ?
+        WHERE key = ? AND path = ?
+    """, (response.status_code, response.media_type, bytes(response.body), key, path))
+    conn.commit()
+    conn.close()
+    return response
+
+
+def call(key, path, handler, fingerprint=None):
+    replay = claim(key, path, fingerprint)
+    if replay is not None:
+        return replay
+    try:
+        result = handler()
+    except Exception:
+        release(key, path)
+        raise
+    return remember(key, path, result)
+
+
+async def acall(key, path, handler, fingerprint=None):
+    replay = claim(key, path, fingerprint)
+    if replay is not None:
+        return replay
+    try:
+        result = await handler()
+    except Exception:
+        release(key, path)
+        raise
+    return remember(key, path, result)
@@ -0,0 +1,188 @@
+# locations.py
+# Driver positions from the driver app's POST /ops/update_location. Each driver
+# has a fixed-size ring buffer of (lat, lng, unix time) in one array('d'), so a
+# ping is a few slot writes with no allocation, and the latest positions sit in
+# a geo.GridIndex for "which drivers are within X km of here". The scheduler
+# flushes a downsampled copy of each track to driver_tracks; the ring itself
+# only ever holds the last TRACK_POINTS pings.
+import os, sqlite3, threading, time
+from array import array
+import geo
+
+DB_PATH = "hazmat.db"
+TRACK_POINTS = int(os.getenv("LOCATION_TRACK_POINTS") or "256")
+# Flushed tracks keep a point once TRACK_MIN_SECONDS have passed or the driver
+# has moved TRACK_MIN_KM since the last point kept.
+TRACK_MIN_SECONDS = float(os.getenv("LOCATION_TRACK_MIN_SECONDS") or "60")
+TRACK_MIN_KM = float(os.getenv("LOCATION_TRACK_MIN_KM") or "0.25")
+TRACK_RETENTION_DAYS = int(os.getenv("LOCATION_TRACK_RETENTION_DAYS") or "30")
+CELL_KM = 5.0
+
+
+class Track:
+    """Ring buffer of the last TRACK_POINTS pings, stored flat as
+    lat, lng, time triples."""
+    __slots__ = ("points", "head", "count", "flushed_to", "kept")
+
+    def __init__(self):
+        self.points = array("d", [0.0]) * (3 * TRACK_POINTS)
+        self.head = 0
+        self.count = 0
+        # Time of the newest ping already flushed, and the last point kept then.
+        self.flushed_to = 0.0
+        self.kept = None
+
+    def append(self, lat, lng, at):
+        i = self.head * 3
+        self.points[i], self.points[i + 1], self.points[i + 2] = lat, lng, at
+        self.head = (self.head + 1) % TRACK_POINTS
+        if self.count < TRACK_POINTS:
+            self.count += 1
+
+    def last(self):
+        i = (self.head - 1) % TRACK_POINTS * 3
+        return self.points[i], self.points[i + 1], self.points[i + 2]
+
+    def since(self, at):
+        """Pings newer than at, oldest first."""
+        found = []
+        for n in range(self.count):
+            i = (self.head - self.count + n) % TRACK_POINTS * 3
+            if self.points[i + 2] > at:
+                found.append((self.points[i], self.points[i + 1], self.points[i + 2]))
+        return found
+
+
+_tracks = {}
+_index = geo.GridIndex(cell_km=CELL_KM)
+_lock = threading.Lock()
+updates = 0
+# Pings older than the driver's latest one (late retries); not stored.
+out_of_order = 0
+flushed_points = 0
+
+
+def init_tracks_table():
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute("""CREATE TABLE IF NOT EXISTS driver_tracks (
+        driver TEXT,
+        lat REAL,
+        lng REAL,
+        recorded_at REAL
+    );""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_driver_tracks_driver ON driver_tracks (driver, recorded_at)")
+    conn.commit()
+    conn.close()
+
+
+def update(driver, lat, lng, at=None):
+    global updates, out_of_order
+    at = at or time.time()
+    with _lock:
+        track = _tracks.get(driver)
+        if track is None:
+            track = _tracks[driver] = Track()
+        elif at < track.last()[2]:
+            out_of_order += 1
+            return False
+        track.append(lat, lng, at)
+        _index.move(driver, lat, lng)
+        updates += 1
+    return True
+
+
+def latest(driver):
+    """(lat, lng, unix time) or None."""
+    with _lock:
+        track = _tracks.get(driver)
+        return track.last() if track else None
+
+
+def snapshot():
+    """{driver: (lat, lng, unix time)} of everyone's latest ping."""
+    with _lock:
+        return {driver: track.last() for driver, track in _tracks.items()}
+
+
+def within(lat, lng, radius_km, max_age=None, now=None):
+    """[(distance_km, driver, last seen)] nearest first, skipping drivers not
+    heard from in max_age seconds."""
+    now = now or time.time()
+    with _lock:
+        found = []
+        for distance, driver in _index.within(lat, lng, radius_km):
+            seen = _tracks[driver].last()[2]
+            if max_age is None or now - seen <= max_age:
+                found.append((distance, driver, seen))
+    return found
+
+
+def recent(driver, since=0.0):
+    """Pings still in the driver's ring newer than since, oldest first."""
+    with _lock:
+        track = _tracks.get(driver)
+        return track.since(since) if track else []
+
+
+def track(driver, since):
+    """Flushed points from driver_tracks plus the pings not flushed yet."""
+    with _lock:
+        t = _tracks.get(driver)
+        flushed_to = t.flushed_to if t else float("inf")
+        pending = t.since(max(since, flushed_to)) if t else []
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        rows = conn.execute("""
+            SELECT lat, lng, recorded_at FROM driver_tracks
+            WHERE driver = ? AND recorded_at > ? AND recorded_at <= ?
+            ORDER BY recorded_at
+        """, (driver, since, flushed_to)).fetchall()
+    except sqlite3.OperationalError:
+        rows = []
+    finally:
+        conn.close()
+    return rows + pending
+
+
+def downsample(points, kept=None):
+    """Points worth keeping, given the last one kept before them."""
+    out = []
+    for lat, lng, at in points:
+        if (kept is None or at - kept[2] >= TRACK_MIN_SECONDS
+                or geo.haversine_km(kept[0], kept[1], lat, lng) >= TRACK_MIN_KM):
+            kept = (lat, lng, at)
+            out.append(kept)
+    return out
+
+
+def flush(now=None):
+    """Writes each driver's new pings, downsampled, to driver_tracks and drops
+    rows past the retention period. Returns the number of points written."""
+    global flushed_points
+    now = now or time.time()
+    with _lock:
+        pending = {driver: (t.since(t.flushed_to), t.kept) for driver, t in _tracks.items()}
+    rows, marks = [], {}
+    for driver, (points, kept) in pending.items():
+        if not points:
+            continue
+        keep = downsample(points, kept)
+        rows += [(driver, lat, lng, at) for lat, lng, at in keep]
+        marks[driver] = (points[-1][2], keep[-1] if keep else kept)
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        conn.executemany("INSERT INTO driver_tracks (driver, lat, lng, recorded_at) VALUES (?, ?, ?, ?)", rows)
+        conn.execute("DELETE FROM driver_tracks WHERE recorded_at < ?", (now - TRACK_RETENTION_DAYS * 86400,))
+        conn.commit()
+    finally:
+        conn.close()
+    with _lock:
+        for driver, (flushed_to, kept) in marks.items():
+            _tracks[driver].flushed_to, _tracks[driver].kept = flushed_to, kept
+        flushed_points += len(rows)
+    return len(rows)
+
+
+def stats():
+    return {"drivers": len(_tracks), "updates": updates, "out_of_order": out_of_order,
+            "flushed_points": flushed_points, "track_points": TRACK_POINTS}
@@ -0,0 +1,183 @@
+# logs.py
+# Structured JSON-lines logging that never blocks a request: records go onto an
+# in-memory queue (QueueHandler) and a background QueueListener thread formats
+# and writes them. Every record carries the request's correlation id, and debug
+# output is kept only for a sampled fraction of requests (all of a sampled
+# request's debug lines, so its trace stays complete).
+import os, sys, copy, json, time, queue, random, logging, contextvars, uuid
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+_BASE_LEVEL = logging.getLevelName(LOG_LEVEL) if isinstance(logging.getLevelName(LOG_LEVEL), int) else logging.INFO
+# Fraction of requests whose DEBUG records are emitted.
+DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE") or "0.01")
+REQUEST_ID_HEADER = "x-request-id"
+
+request_id = contextvars.ContextVar("request_id", default=None)
+debug_sampled = contextvars.ContextVar("debug_sampled", default=False)
+# Per-request {"<logger>.<stage>": ms} filled by Trace.mark; read back when the
+# request finishes (metrics.slow_requests). A dict, so marks made in threadpool
+# copies of the context land in the same object.
+request_spans = contextvars.ContextVar("request_spans", default=None)
+
+# Attributes every LogRecord has; anything else came from extra= and is emitted as a field.
+_STANDARD = set(logging.makeLogRecord({}).__dict__) | {"message", "asctime", "taskName"}
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        rid = getattr(record, "request_id", None)
+        if rid:
+            entry["request_id"] = rid
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD and key not in ("request_id", "sampled"):
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class ContextFilter(logging.Filter):
+    # Runs on the calling thread, where the request's contextvars are visible.
+    def filter(self, record):
+        record.request_id = request_id.get()
+        return record.levelno >= _BASE_LEVEL or debug_sampled.get()
+
+
+class _QueueHandler(QueueHandler):
+    def prepare(self, record):
+        # The stock prepare() folds the traceback into msg; keep it separate so it
+        # becomes its own "exc" field.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup():
+    """Route the "hazmat" logger through a queue to a JSON stdout writer."""
+    global _listener
+    if _listener is not None:
+        return
+    log_queue = queue.SimpleQueue()
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter())
+    handler = _QueueHandler(log_queue)
+    handler.addFilter(ContextFilter())
+    root = logging.getLogger("hazmat")
+    root.handlers[:] = [handler]
+    root.setLevel(logging.DEBUG if DEBUG_SAMPLE_RATE > 0 else _BASE_LEVEL)
+    root.propagate = False
+    _listener = QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown():
+    # Drains whatever is still queued before the process exits.
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get(name):
+    return logging.getLogger(f"hazmat.{name}")
+
+
+def begin_request(incoming_id=None):
+    """Bind a correlation id (the caller's X-Request-ID if given) and sampling
+    decision to the current request context; returns the id."""
+    rid = (incoming_id or uuid.uuid4().hex[:16])[:64]
+    request_id.set(rid)
+    debug_sampled.set(random.random() < DEBUG_SAMPLE_RATE)
+    request_spans.set({})
+    return rid
+
+
+# Requests slower than this (or failing with 5xx) are logged at INFO; the rest at DEBUG.
+SLOW_REQUEST_MS = float(os.getenv("LOG_SLOW_MS") or "1000")
+
+
+class RequestLogMiddleware:
+    """Pure ASGI: binds the correlation id, echoes it as X-Request-ID and logs
+    method, path, status and duration when the response finishes."""
+
+    def __init__(self, app):
+        self.app = app
+        self.log = get("http")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        incoming = None
+        for name, value in scope["headers"]:
+            if name == REQUEST_ID_HEADER.encode():
+                incoming = value.decode("latin-1")
+                break
+        rid = begin_request(incoming)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message = {**message, "headers": list(message.get("headers", [])) + [
+                    (REQUEST_ID_HEADER.encode(), rid.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            ms = round((time.perf_counter() - started) * 1000, 1)
+            level = logging.INFO if ms >= SLOW_REQUEST_MS or status >= 500 else logging.DEBUG
+            self.log.log(level, "request", extra={"method": scope["method"], "path": scope["path"],
+                                                  "status": status, "ms": ms})
+
+
+class Trace:
+    """Stage timings for one multi-step operation: call mark(stage) after each
+    step (logged at DEBUG), then finish() logs one line with the total and a
+    per-stage breakdown, so a slow booking shows where its time went.
+    on_mark(stage, ms) is also called per stage (e.g. metrics.stage_recorder),
+    and inside a request each stage is added to request_spans."""
+
+    def __init__(self, logger, on_mark=None, **fields):
+        self.logger = logger
+        self.prefix = logger.name.rsplit(".", 1)[-1]
+        self.on_mark = on_mark
+        self.fields = fields
+        self.started = self.last = time.perf_counter()
+        self.stages = {}
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        ms = round((now - self.last) * 1000, 1)
+        self.stages[stage] = ms
+        self.last = now
+        self.logger.debug(stage, extra={**self.fields, "ms": ms})
+        if self.on_mark:
+            self.on_mark(stage, ms)
+        spans = request_spans.get()
+        if spans is not None:
+            key = f"{self.prefix}.{stage}"
+            spans[key] = round(spans.get(key, 0) + ms, 1)
+        return ms
+
+    def finish(self, msg, level=logging.INFO, exc_info=None, **fields):
+        ms = round((time.perf_counter() - self.started) * 1000, 1)
+        self.logger.log(level, msg, exc_info=exc_info,
+                        extra={**self.fields, **fields, "ms": ms, "stages": self.stages})
+        return ms
@@ -1,26 +1,91 @@
 # main.py
-from fastapi import FastAPI, Request, UploadFile, Form, File
-from fastapi.responses import HTMLResponse, StreamingResponse, JSONResponse, FileResponse, RedirectResponse, Response
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, Request, UploadFile, Form, File, HTTPException
+from fastapi.responses import HTMLResponse, StreamingResponse, JSONResponse, FileResponse, RedirectResponse, Response, PlainTextResponse
+from starlette.background import BackgroundTask
+from contextlib import asynccontextmanager
 from datetime import datetime, date
-import qrcode
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import mm
-from reportlab.lib.colors import HexColor
-import sqlite3, json, os, re
-import smtplib, ssl
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.base import MIMEBase
-from email import encoders
+import sqlite3, json, os, re, hmac, time, asyncio, logging, threading, shutil
 from dotenv import load_dotenv
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
-import requests
+# Before the project imports: several of them read settings at import time
+# (SESSION_SECRET, rate limits, outbound pools, log level), which must see .env.
+load_dotenv()
+import ops_stats
+import analytics
+import exports
+import idempotency
+import ratelimit
+import pages
+import assets
+import compression
+import sessions
+import addressbook
+import outbound
+import logs
+import metrics
+import geocache
+import qr
+import bulk
+import events
+import locations
+import dispatch
+import routes
+import profiler
+from scheduler import scheduler
+from geo import BRANCH_CITY_MAP
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Database setup and page pre-rendering run here rather than at import time,
+    # so `import main` stays cheap; see benchmarks/bench_startup.py.
+    logs.setup()
+    startup()
+    scheduler.start()
+    yield
+    await scheduler.stop()
+    flush_backup()
+    flush_locations()
+    await outbound.aclose()
+    logs.shutdown()
+
+app = FastAPI(lifespan=lifespan)
+app.mount("/static", assets.AssetStaticFiles(directory="static"), name="static")
+app.add_middleware(compression.CompressionMiddleware, minimum_size=int(os.getenv("COMPRESS_MIN_BYTES") or "1024"))
+
+def too_many_requests(request: Request, retry_after: int, message: str):
+    headers = {"Retry-After": str(retry_after)}
+    if "text/html" in request.headers.get("accept", ""):
+        return HTMLResponse(f"<h3>{message}</h3><p>Please try again in {retry_after} seconds.</p>",
+                            status_code=429, headers=headers)
+    return JSONResponse({"status": "error", "message": message}, status_code=429, headers=headers)
+
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    # Token buckets (per IP, per client_id cookie, global) on the endpoints that
+    # send mail and write files, and a bounded number of concurrent /submit runs.
+    if request.method != "POST" or request.url.path not in ratelimit.LIMITED_PATHS:
+        return await call_next(request)
+    retry_after = ratelimit.limiter.check(ratelimit.client_ip(request), sessions.current_client_id(request))
+    if retry_after:
+        return too_many_requests(request, retry_after, "Too many requests")
+    if request.url.path != "/submit":
+        return await call_next(request)
+    if not await ratelimit.acquire_submit_slot():
+        return too_many_requests(request, ratelimit.SUBMIT_RETRY_AFTER, "Booking service is busy")
+    try:
+        return await call_next(request)
+    finally:
+        ratelimit.release_submit_slot()
 
-app = FastAPI()
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Added last so they wrap everything: per-route metrics, then correlation id +
+# request log line outermost.
+app.add_middleware(metrics.MetricsMiddleware, router_app=app)
+app.add_middleware(logs.RequestLogMiddleware)
+
+submit_log = logs.get("submit")
+assign_log = logs.get("assign")
+bulk_log = logs.get("bulk")
+qr_log = logs.get("scan")
+mail_log = logs.get("mail")
 
 signature_block = """
 <br><br>
@@ -63,17 +128,44 @@ def debug_smtp():
             results[f"{host}:{port}"] = f"❌ {type(e).__name__}: {e}"
     return results
 
-os.makedirs("static/waybills", exist_ok=True)
-os.makedirs("static/qrcodes", exist_ok=True)
-os.makedirs("static/uploads", exist_ok=True)
-os.makedirs("static/backups", exist_ok=True)
+# Diagnostics below expose stack traces and request paths, so they need the
+# ADMIN_TOKEN (X-Admin-Token header); without one configured they are disabled.
+# Read per request, so a token set in .env is seen however the app was started.
+def is_admin(request: Request):
+    token = os.getenv("ADMIN_TOKEN", "")
+    supplied = request.headers.get("x-admin-token", "")
+    return bool(token) and hmac.compare_digest(supplied.encode(), token.encode())
+
+def require_admin(request: Request):
+    if not is_admin(request):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+@app.get("/debug/profile")
+async def debug_profile(request: Request, seconds: float = 10, idle: bool = False):
+    """Samples every thread's stack for `seconds` and returns collapsed stacks
+    (flamegraph.pl / speedscope input). The sampler runs in a worker thread, so
+    the event loop keeps serving the traffic being profiled."""
+    require_admin(request)
+    try:
+        text, samples = await asyncio.to_thread(profiler.sample, seconds, include_idle=idle)
+    except profiler.ProfileBusy:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    return PlainTextResponse(text, headers={"X-Profile-Samples": str(samples)})
+
+@app.get("/debug/slow-requests")
+def debug_slow_requests(request: Request, clear: bool = False):
+    require_admin(request)
+    slowest = metrics.slow_requests.snapshot()
+    if clear:
+        metrics.slow_requests.clear()
+    return {"kept": metrics.slow_requests.size, "requests": slowest}
 
-load_dotenv()
 SMTP_SERVER = os.getenv("SMTP_SERVER", "")
 SMTP_PORT = int(os.getenv("SMTP_PORT") or "587")
 SMTP_USER = os.getenv("SMTP_USER", "")
 SMTP_PASS = os.getenv("SMTP_PASS", "")
 OPS_CC = os.getenv("OPS_CC", "")
+OPS_CC_LIST = ["hendrik.krueger@hazglobal.com"]
 SENDGRID_API_KEY = os.getenv("SENDGRID_API_KEY")
 
 ADDRESS_ALIASES = {
@@ -87,17 +179,6 @@ ADDRESS_ALIASES = {
     "Boksberg": "Boksburg",
 }
 
-BRANCH_CITY_MAP = {
-    "Johannesburg": "Johannesburg",
-    "Durban": "Durban",
-    "Cape Town": "Cape Town",
-    "Port Elizabeth": "Port Elizabeth",
-    "JNB": "Johannesburg",
-    "KZN": "Durban",
-    "CPT": "Cape Town",
-    "PLZ": "Port Elizabeth",
-}
-
 def apply_aliases(text: str) -> str:
     if not text:
         return ""
@@ -105,16 +186,16 @@ def apply_aliases(text: str) -> str:
         text = re.sub(rf"\b{k}\b", v, text, flags=re.IGNORECASE)
     return text
 
-def geocode_address(full_address: str, branch_hint: str = None):
+async def geocode_address(full_address: str, branch_hint: str = None):
     # Nominatim (OpenStreetMap) basic geocode
     try:
-        query = full_address
-        if branch_hint:
-            query = f"{full_address}, {branch_hint}"
-        url = "https://nominatim.openstreetmap.org/search"
+        query = geocache.query_for(full_address, branch_hint)
+        cached = geocache.get(query)
+        if cached:
+            return cached
+        url = f"{outbound.NOMINATIM_URL}/search"
         params = {"q": query, "format": "json", "addressdetails": 1}
-        headers = {"User-Agent": "HazmatGlobal/1.0"}
-        r = requests.get(url, params=params, headers=headers, timeout=8)
+        r = await outbound.get(url, params=params, timeout=8)
         results = r.json()
         if not results:
             return None, 0.0
@@ -123,23 +204,82 @@ def geocode_address(full_address: str, branch_hint: str = None):
         lon = float(best.get("lon"))
         # crude confidence: importance or class rank
         confidence = float(best.get("importance", 0.7))
+        if confidence >= 0.7:
+            geocache.put(query, (lat, lon), confidence)
         return (lat, lon), confidence
     except Exception:
         return None, 0.0
 
-def centroid_for_postal(postal_code: str, city_hint: str = None):
+async def centroid_for_postal(postal_code: str, city_hint: str = None):
     # Fallback centroid—simple heuristic: geocode postal code + city
     if not postal_code:
         return None
-    coords, conf = geocode_address(postal_code if not city_hint else f"{postal_code}, {city_hint}")
+    coords, conf = await geocode_address(postal_code if not city_hint else f"{postal_code}, {city_hint}")
     return coords
 
-def centroid_for_city(city: str):
+async def centroid_for_city(city: str):
     if not city:
         return None
-    coords, conf = geocode_address(city)
+    coords, conf = await geocode_address(city)
     return coords
 
+async def geocode_with_fallback(address: str, postal_code: str, hint: str = None):
+    coords, conf = await geocode_address(address, hint)
+    if not coords:
+        coords = await centroid_for_postal(postal_code, hint) or await centroid_for_city(hint)
+        conf = 0.5 if coords else 0.0
+    return coords, conf
+
+async def locate_address(client_id, saved_address_id, entered_address: str, address: str, postal_code: str, hint: str = None):
+    # A saved site chosen on the form reuses its stored coordinates, as long as the
+    # address was not edited after loading it. The first booking from a site that
+    # has none geocodes as usual and stores a confident result for next time.
+    saved = None
+    if client_id and saved_address_id and str(saved_address_id).isdigit():
+        saved = addressbook.get(client_id, saved_address_id)
+    if saved and (saved["address"] or "").strip().lower() != entered_address.strip().lower():
+        saved = None
+    if saved and saved["lat"] is not None and saved["lng"] is not None:
+        return (saved["lat"], saved["lng"]), saved["confidence"] or 0.0
+    coords, conf = await geocode_with_fallback(address, postal_code, hint)
+    if saved and coords and conf >= 0.7:
+        addressbook.store_geocode(client_id, saved["id"], coords[0], coords[1], conf)
+    return coords, conf
+
+async def fill_saved_geocode(client_id, address_id, address: str):
+    coords, conf = await geocode_address(address)
+    if coords and conf >= 0.7:
+        addressbook.store_geocode(client_id, address_id, coords[0], coords[1], conf)
+
+# The JSON backups and the reference counter hold customer names and contact
+# details, so they live outside the public /static mount.
+BACKUP_DIR = os.getenv("BACKUP_DIR") or "backups"
+LEGACY_BACKUP_DIR = "static/backups"
+
+def move_legacy_backups():
+    # Deployments before BACKUP_DIR kept these under static/backups, where
+    # /static served them to anyone. Move them (counter included) once. The
+    # .gz/.br siblings were only written so /static could serve the backups
+    # compressed; they are copies of the same customer data and are dropped.
+    # A file that already exists in BACKUP_DIR is never overwritten: the
+    # legacy copy stays put (the static mount no longer serves it) for ops to
+    # compare by hand.
+    if not os.path.isdir(LEGACY_BACKUP_DIR):
+        return
+    for name in os.listdir(LEGACY_BACKUP_DIR):
+        source, target = os.path.join(LEGACY_BACKUP_DIR, name), os.path.join(BACKUP_DIR, name)
+        if name.endswith((".gz", ".br")):
+            os.remove(source)
+        elif os.path.exists(target):
+            print(f"⚠️ Left {source} in place: {target} already exists")
+        else:
+            shutil.move(source, target)
+            print(f"✅ Moved {source} to {target}")
+    try:
+        os.rmdir(LEGACY_BACKUP_DIR)
+    except OSError:
+        pass
+
 def init_db():
     if os.path.exists("hazmat.db"):
         print("✅ hazmat.db already exists")
@@ -179,7 +319,8 @@ def init_db():
             time TEXT,
             signed_by TEXT,
             document TEXT,
-            pod TEXT
+            pod TEXT,
+            haz_ref TEXT
         );""")
 
         cursor.execute("""CREATE TABLE IF NOT EXISTS requests (
@@ -211,6 +352,7 @@ def init_db():
                 shipment_docs TEXT,
 
                 assigned_driver TEXT,
+                assigned_at TEXT,
                 status TEXT DEFAULT 'Pending',
 
                 delivery_date TEXT,
@@ -241,6 +383,9 @@ def init_db():
             contact_person TEXT,
             contact_number TEXT,
             email TEXT,
+            lat REAL,
+            lng REAL,
+            confidence REAL,
             FOREIGN KEY (client_id) REFERENCES clients(id)
         );""")
         print("✅ saved_addresses table created")
@@ -263,9 +408,9 @@ def init_db():
                             )
                 print(f"✅ Restored {table_name} from {json_path}")
 
-        restore_table("static/backups/requests.json", "requests")
-        restore_table("static/backups/updates.json", "updates")
-        restore_table("static/backups/completed.json", "completed")
+        restore_table(os.path.join(BACKUP_DIR, "requests.json"), "requests")
+        restore_table(os.path.join(BACKUP_DIR, "updates.json"), "updates")
+        restore_table(os.path.join(BACKUP_DIR, "completed.json"), "completed")
 
         conn.commit()
         print("✅ hazmat.db initialized and restored")
@@ -274,43 +419,205 @@ def init_db():
     finally:
         conn.close()
 
+def migrate_db():
+    # init_db() only builds a fresh database, so columns added later are patched
+    # onto existing tables here.
+    added_columns = {
+        "completed": [("haz_ref", "TEXT")],
+        "requests": [("assigned_at", "TEXT")],
+        "saved_addresses": [("lat", "REAL"), ("lng", "REAL"), ("confidence", "REAL")],
+        "idempotency_keys": [("fingerprint", "TEXT")],
+    }
+    indexes = {
+        "idx_requests_reference": ("requests", "reference_number"),
+        "idx_requests_timestamp": ("requests", "timestamp"),
+        "idx_scan_log_reference": ("scan_log", "reference_number"),
+        "idx_completed_haz_ref": ("completed", "haz_ref"),
+        "idx_completed_ops": ("completed", "ops"),
+        "idx_completed_delivery_date": ("completed", "delivery_date"),
+        "idx_updates_haz": ("updates", "haz"),
+        "idx_saved_addresses_client": ("saved_addresses", "client_id"),
+    }
+    conn = sqlite3.connect("hazmat.db")
+    cursor = conn.cursor()
+    # WAL lets readers (dashboards, exports) proceed while a booking is written;
+    # the scheduler checkpoints it so the -wal file stays small.
+    cursor.execute("PRAGMA journal_mode=WAL")
+    for table, columns in added_columns.items():
+        existing = [c[1] for c in cursor.execute(f"PRAGMA table_info({table})").fetchall()]
+        if not existing:
+            continue
+        for name, col_type in columns:
+            if name not in existing:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {col_type}")
+                print(f"✅ Added {table}.{name}")
+    for index, (table, column) in indexes.items():
+        try:
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {index} ON {table} ({column})")
+        except sqlite3.OperationalError as e:
+            print(f"⚠️ Skipped index {index}:", e)
+    conn.commit()
+    conn.close()
 
-init_db()
 
-def get_next_reference_number():
-    counter_path = "static/backups/ref_counter.txt"
-    if not os.path.exists(counter_path):
-        with open(counter_path, "w") as f:
-            f.write("0")
-    with open(counter_path, "r") as f:
+def startup():
+    for folder in ("static/waybills", "static/qrcodes", "static/uploads", BACKUP_DIR):
+        os.makedirs(folder, exist_ok=True)
+    move_legacy_backups()
+    init_db()
+    migrate_db()
+    ops_stats.init_stats_tables()
+    idempotency.init_idempotency_table()
+    locations.init_tracks_table()
+    assets.build()
+    pages.warm()
+
+@scheduler.every(300, run_at_start=False)
+def prerender_pages():
+    # Picks up date-keyed variants (the booking form) as the day rolls over.
+    return pages.warm()
+
+@scheduler.every(1800)
+def prime_caches(limit=500):
+    # Load recent confident geocodes, recent clients and the address books of
+    # recently active clients so the first requests after a wake-up hit memory.
+    conn = sqlite3.connect("hazmat.db")
+    cursor = conn.cursor()
+    primed = {"geocodes": 0, "clients": 0, "address_books": 0}
+    try:
+        rows = cursor.execute("""
+            SELECT service_type, collection_address, collection_region, collection_lat, collection_lng,
+                   delivery_address, delivery_region, delivery_lat, delivery_lng, geocode_confidence
+            FROM requests WHERE geocode_confidence >= 0.7 ORDER BY id DESC LIMIT ?
+        """, (limit,)).fetchall()
+    except sqlite3.OperationalError:
+        rows = []
+    for service_type, c_addr, c_region, c_lat, c_lng, d_addr, d_region, d_lat, d_lng, confidence in rows:
+        # Same queries process_submission sends for each shipment type.
+        branch_hint = BRANCH_CITY_MAP.get(c_region) if c_region else None
+        if service_type in ("local", "export") and c_lat is not None:
+            geocache.put(geocache.query_for(c_addr, branch_hint), (c_lat, c_lng), confidence)
+            primed["geocodes"] += 1
+        if service_type in ("local", "import") and d_lat is not None:
+            d_hint = branch_hint if service_type == "local" else BRANCH_CITY_MAP.get(d_region)
+            geocache.put(geocache.query_for(d_addr, d_hint), (d_lat, d_lng), confidence)
+            primed["geocodes"] += 1
+    for client_id, name, email in cursor.execute(
+            "SELECT id, name, email FROM clients ORDER BY id DESC LIMIT ?", (limit,)).fetchall():
+        sessions.clients.put(client_id, {"id": client_id, "name": name, "email": email})
+        primed["clients"] += 1
+    active = cursor.execute(
+        "SELECT client_id FROM saved_addresses GROUP BY client_id ORDER BY MAX(id) DESC LIMIT ?",
+        (addressbook.MAX_CLIENTS // 4,)).fetchall()
+    conn.close()
+    for (client_id,) in active:
+        if client_id is not None:
+            addressbook.index_for(client_id)
+            primed["address_books"] += 1
+    return primed
+
+@scheduler.every(300, run_at_start=False)
+def checkpoint_wal():
+    conn = sqlite3.connect("hazmat.db")
+    busy, wal_pages, checkpointed = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+    conn.close()
+    return {"busy": busy, "wal_pages": wal_pages, "checkpointed": checkpointed}
+
+@scheduler.every(3600)
+def purge_idempotency_keys():
+    # Stored responses (whole confirmation pages among them) past their 24 h.
+    return idempotency.purge_expired()
+
+# Writes mark the JSON backups stale; the scheduler (and shutdown) rewrite them
+# once, instead of dumping every table after each individual write.
+backup_pending = False
+# Held from the check-and-clear through the write, so the scheduler and
+# /ops/backup never dump at the same time, and a caller that finds a write in
+# progress waits for it and then writes whatever changed since.
+_backup_lock = threading.Lock()
+
+def schedule_backup():
+    # Not under _backup_lock: a request must not wait for a dump. A flag set
+    # while one is running is picked up by the next flush.
+    global backup_pending
+    backup_pending = True
+
+@scheduler.every(60, run_at_start=False)
+def flush_backup():
+    global backup_pending
+    with _backup_lock:
+        if not backup_pending:
+            return False
+        backup_pending = False
         try:
-            last_id = int(f.read().strip())
-        except ValueError:
-            last_id = 0
-    new_id = last_id + 1
-    with open(counter_path, "w") as f:
-        f.write(str(new_id))
-    return f"HAZJNB{str(new_id).zfill(4)}"
+            with metrics.timed("backup", "backup_database"):
+                backup_database()
+        except Exception:
+            backup_pending = True
+            raise
+    return True
+
+@scheduler.every(int(os.getenv("LOCATION_FLUSH_SECONDS") or "30"), run_at_start=False)
+def flush_locations():
+    # Downsampled driver tracks from the in-memory ring buffers to driver_tracks.
+    return locations.flush()
+
+# Opt-in: every DISPATCH_AUTO_SECONDS the current dispatch proposals are applied.
+DISPATCH_AUTO_SECONDS = int(os.getenv("DISPATCH_AUTO_SECONDS") or "0")
+if DISPATCH_AUTO_SECONDS > 0:
+    @scheduler.every(DISPATCH_AUTO_SECONDS, run_at_start=False)
+    def auto_dispatch():
+        return apply_dispatch({})["assigned"]
+
+_reference_lock = threading.Lock()
+
+def allocate_reference_numbers(count):
+    # One read-modify-write of the counter per block, under a lock, so a bulk
+    # import gets consecutive references and concurrent bookings never share one.
+    counter_path = os.path.join(BACKUP_DIR, "ref_counter.txt")
+    with _reference_lock:
+        last_id = 0
+        if os.path.exists(counter_path):
+            with open(counter_path, "r") as f:
+                try:
+                    last_id = int(f.read().strip())
+                except ValueError:
+                    last_id = 0
+        tmp_path = f"{counter_path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(last_id + count))
+        os.replace(tmp_path, counter_path)
+    return [f"HAZJNB{str(n).zfill(4)}" for n in range(last_id + 1, last_id + count + 1)]
+
+def get_next_reference_number():
+    return allocate_reference_numbers(1)[0]
+
+def _write_backup_file(filename, data, **json_options):
+    # Written beside the target and swapped in, so init_db() never restores
+    # from a file cut short by a crash mid-write.
+    path = os.path.join(BACKUP_DIR, filename)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, **json_options)
+    os.replace(tmp_path, path)
 
 def backup_database():
-    os.makedirs("static/backups", exist_ok=True)
+    os.makedirs(BACKUP_DIR, exist_ok=True)
     conn = sqlite3.connect("hazmat.db")
     cursor = conn.cursor()
     def dump_table(table_name, filename):
         cursor.execute(f"SELECT * FROM {table_name}")
         columns = [desc[0] for desc in cursor.description]
         rows = cursor.fetchall()
-        with open(f"static/backups/{filename}", "w") as f:
-            json.dump([dict(zip(columns, row)) for row in rows], f, indent=2)
+        _write_backup_file(filename, [dict(zip(columns, row)) for row in rows], indent=2)
     dump_table("requests", "requests.json")
     dump_table("updates", "updates.json")
     dump_table("completed", "completed.json")
-    counter_path = "static/backups/ref_counter.txt"
+    counter_path = os.path.join(BACKUP_DIR, "ref_counter.txt")
     if os.path.exists(counter_path):
         with open(counter_path) as f:
             ref_value = f.read().strip()
-        with open("static/backups/ref_counter_backup.json", "w") as f:
-            json.dump({"last_ref": ref_value}, f)
+        _write_backup_file("ref_counter_backup.json", {"last_ref": ref_value})
     conn.close()
     print("✅ Database and counter backed up to JSON")
 
@@ -343,9 +650,9 @@ async def signup(request: Request, name: str = Form(None), email: str = Form(Non
         conn.close()
         return {"status": "error", "message": "Email already registered"}
     conn.close()
+    sessions.clients.invalidate(client_id)
     response = RedirectResponse("/", status_code=302)
-    response.set_cookie(key="client_id", value=str(client_id), httponly=True)
-    return response
+    return sessions.set_session(response, client_id, name)
 
 @app.post("/login")
 async def login(request: Request, email: str = Form(None), password: str = Form(None)):
@@ -360,8 +667,7 @@ async def login(request: Request, email: str = Form(None), password: str = Form(
     conn.close()
     if row:
         response = RedirectResponse("/", status_code=302)
-        response.set_cookie(key="client_id", value=str(row[0]), httponly=True)
-        return response
+        return sessions.set_session(response, row[0], row[1])
     return {"status": "error", "message": "Invalid credentials"}
 
 @app.post("/login")
@@ -375,35 +681,28 @@ def login_json(payload: dict):
     conn.close()
     if row:
         response = JSONResponse({"status": "success", "client_id": row[0], "name": row[1]})
-        response.set_cookie(key="client_id", value=str(row[0]), httponly=True)
-        return response
+        return sessions.set_session(response, row[0], row[1])
     return {"status": "error", "message": "Invalid credentials"}
 
 @app.get("/api/me")
 def get_client_name(request: Request):
-    client_id = request.cookies.get("client_id")
-    if not client_id:
+    claims = sessions.current(request)
+    if not claims:
         return {"name": None}
-    conn = sqlite3.connect("hazmat.db")
-    cursor = conn.cursor()
-    cursor.execute("SELECT name FROM clients WHERE id = ?", (client_id,))
-    row = cursor.fetchone()
-    conn.close()
-    return {"name": row[0] if row else None}
+    client = sessions.clients.get(claims["id"])
+    return {"name": client["name"] if client else None}
 
 @app.get("/", response_class=HTMLResponse)
-def home():
-    return """
+def home(request: Request):
+    return pages.serve(request, "home")
+
+@pages.page("home")
+def render_home():
+    return assets.head_tags() + """
         <style>
-          html, body { margin:0; padding:0; height:100%; background:#F1F8E9; font-family:'Segoe UI',sans-serif; display:flex; flex-direction:column; }
-          header { background:#2E7D32; color:white; padding:1rem 2rem; display:flex; align-items:center; justify-content:space-between; }
-          header img { height:60px; }
-          nav a { color:white; margin-left:1rem; text-decoration:none; font-weight:500; }
-          nav a:hover { text-decoration:underline; }
           main { flex:1; max-width:960px; margin:2rem auto; padding:1rem; text-align:center; }
           h1 { color:#2E7D32; margin-bottom:1rem; }
           p { font-size:16px; line-height:1.6; }
-          footer { background:#2E7D32; color:white; text-align:center; padding:1rem; font-size:14px; line-height:1.6; }
         </style>
 
         <header>
@@ -417,21 +716,6 @@ def home():
   <span id="client-nav" style="margin-left:auto; font-weight:600;"></span>
 </nav>
 
-<script>
-  document.addEventListener("DOMContentLoaded", function() {
-    fetch("/api/me")
-      .then(res => res.json())
-      .then(data => {
-        const navSpan = document.getElementById("client-nav");
-        if (data.name) {
-          navSpan.innerText = data.name;
-        } else {
-          navSpan.innerHTML = '<a href="/embed/login">Login / Sign Up</a>';
-        }
-      })
-      .catch(err => console.error("⚠️ Failed to fetch client info", err));
-  });
-</script>
         </header>
 
         <main>
@@ -448,34 +732,13 @@ def home():
         """
 
 @app.get("/embed/login", response_class=HTMLResponse)
-def embed_login():
-    return """
+def embed_login(request: Request):
+    return pages.serve(request, "embed_login")
+
+@pages.page("embed_login")
+def render_embed_login():
+    return assets.head_tags() + """
     <style>
-      html, body {
-        margin: 0;
-        padding: 0;
-        height: 100%;
-        background: #F1F8E9;
-        font-family: 'Segoe UI', sans-serif;
-        display: flex;
-        flex-direction: column;
-      }
-      header {
-        background: #2E7D32;
-        color: white;
-        padding: 1rem 2rem;
-        display: flex;
-        align-items: center;
-        justify-content: space-between;
-      }
-      header img { height: 60px; }
-      nav a {
-        color: white;
-        margin-left: 1rem;
-        text-decoration: none;
-        font-weight: 500;
-      }
-      nav a:hover { text-decoration: underline; }
       main {
         flex: 1;
         display: flex;
@@ -486,14 +749,6 @@ def embed_login():
         margin: 0 auto;
         padding: 2rem 1rem;
       }
-      footer {
-        background: #2E7D32;
-        color: white;
-        text-align: center;
-        padding: 1rem;
-        font-size: 14px;
-        line-height: 1.6;
-      }
       .auth-wrapper {
         display: grid;
         grid-template-columns: 1fr 1fr;
@@ -546,21 +801,6 @@ def embed_login():
         <a href="/embed/rate">Rate Our Services</a>
         <span id="client-nav" style="margin-left:auto; font-weight:600;"></span>
       </nav>
-      <script>
-        document.addEventListener("DOMContentLoaded", function() {
-          fetch("/api/me")
-            .then(res => res.json())
-            .then(data => {
-              const navSpan = document.getElementById("client-nav");
-              if (data.name) {
-                navSpan.innerText = data.name;
-              } else {
-                navSpan.innerHTML = '<a href="/embed/login">Login / Sign Up</a>';
-              }
-            })
-            .catch(err => console.error("⚠️ Failed to fetch client info", err));
-        });
-      </script>
     </header>
 
     <main>
@@ -672,7 +912,8 @@ async def api_signup(payload: dict, response: Response):
         cursor.execute("INSERT INTO clients (name, email, password) VALUES (?, ?, ?)", (name, email, password))
         conn.commit()
         client_id = cursor.lastrowid
-        response.set_cookie(key="client_id", value=str(client_id))
+        sessions.clients.invalidate(client_id)
+        sessions.set_session(response, client_id, name)
         return {"status": "ok"}
     except sqlite3.IntegrityError:
         return {"status": "error", "message": "Email already exists"}
@@ -680,14 +921,13 @@ async def api_signup(payload: dict, response: Response):
         conn.close()
 
 @app.get("/embed/track", response_class=HTMLResponse)
-def embed_track():
-    return """
+def embed_track(request: Request):
+    return pages.serve(request, "embed_track")
+
+@pages.page("embed_track")
+def render_embed_track():
+    return assets.head_tags() + """
     <style>
-      html, body { margin:0; padding:0; height:100%; background:#F1F8E9; font-family:'Segoe UI',sans-serif; display:flex; flex-direction:column; }
-      header { background:#2E7D32; color:white; padding:1rem 2rem; display:flex; align-items:center; justify-content:space-between; }
-      header img { height:60px; }
-      nav a { color:white; margin-left:1rem; text-decoration:none; font-weight:500; }
-      nav a:hover { text-decoration:underline; }
       main { flex:1; max-width:960px; margin:2rem auto; padding:2rem; }
       h2 { color:#2E7D32; text-align:center; margin-bottom:1.5rem; }
       form { background:#fff; border:1px solid #C8E6C9; border-radius:8px; padding:2rem; box-shadow:0 4px 12px rgba(0,0,0,0.05); }
@@ -695,7 +935,6 @@ def embed_track():
       input { width:100%; margin-bottom:12px; padding:10px; border:1px solid #B0BEC5; border-radius:4px; font-size:14px; }
       button { background:#2E7D32; color:white; border:none; padding:0.6rem 1.2rem; border-radius:4px; cursor:pointer; font-size:14px; }
       button:hover { background:#388E3C; }
-      footer { background:#2E7D32; color:white; text-align:center; padding:1rem; font-size:14px; line-height:1.6; }
     </style>
 
     <header>
@@ -709,21 +948,6 @@ def embed_track():
   <span id="client-nav" style="margin-left:auto; font-weight:600;"></span>
 </nav>
 
-<script>
-  document.addEventListener("DOMContentLoaded", function() {
-    fetch("/api/me")
-      .then(res => res.json())
-      .then(data => {
-        const navSpan = document.getElementById("client-nav");
-        if (data.name) {
-          navSpan.innerText = data.name;
-        } else {
-          navSpan.innerHTML = '<a href="/embed/login">Login / Sign Up</a>';
-        }
-      })
-      .catch(err => console.error("⚠️ Failed to fetch client info", err));
-  });
-</script>
     </header>
 
     <main>
@@ -755,14 +979,13 @@ def embed_contact():
     """
 
 @app.get("/embed/complaint", response_class=HTMLResponse)
-def embed_complaint():
-    return """
+def embed_complaint(request: Request):
+    return pages.serve(request, "embed_complaint")
+
+@pages.page("embed_complaint")
+def render_embed_complaint():
+    return assets.head_tags() + """
     <style>
-      html, body { margin:0; padding:0; height:100%; background:#F1F8E9; font-family:'Segoe UI',sans-serif; display:flex; flex-direction:column; }
-      header { background:#2E7D32; color:white; padding:1rem 2rem; display:flex; align-items:center; justify-content:space-between; }
-      header img { height:60px; }
-      nav a { color:white; margin-left:1rem; text-decoration:none; font-weight:500; }
-      nav a:hover { text-decoration:underline; }
       main { flex:1; max-width:960px; margin:2rem auto; padding:2rem; }
       h2 { color:#2E7D32; text-align:center; margin-bottom:1.5rem; }
       form { background:#fff; border:1px solid #C8E6C9; border-radius:8px; padding:2rem; box-shadow:0 4px 12px rgba(0,0,0,0.05); }
@@ -771,7 +994,6 @@ def embed_complaint():
       textarea { resize:vertical; }
       button { background:#2E7D32; color:white; border:none; padding:0.6rem 1.2rem; border-radius:4px; cursor:pointer; font-size:14px; }
       button:hover { background:#388E3C; }
-      footer { background:#2E7D32; color:white; text-align:center; padding:1rem; font-size:14px; line-height:1.6; }
     </style>
 
     <header>
@@ -785,21 +1007,6 @@ def embed_complaint():
   <span id="client-nav" style="margin-left:auto; font-weight:600;"></span>
 </nav>
 
-<script>
-  document.addEventListener("DOMContentLoaded", function() {
-    fetch("/api/me")
-      .then(res => res.json())
-      .then(data => {
-        const navSpan = document.getElementById("client-nav");
-        if (data.name) {
-          navSpan.innerText = data.name;
-        } else {
-          navSpan.innerHTML = '<a href="/embed/login">Login / Sign Up</a>';
-        }
-      })
-      .catch(err => console.error("⚠️ Failed to fetch client info", err));
-  });
-</script>
     </header>
 
     <main>
@@ -849,7 +1056,7 @@ async def submit_complaint(request: Request):
     """
 
     try:
-        send_confirmation_email(
+        await send_confirmation_email(
             to_email="hendrik.krueger@hazglobal.com",
             subject = f"Client Complaint{f' • Ref {reference_number}' if reference_number else ''}",
             body=body,
@@ -881,14 +1088,13 @@ async def submit_complaint(request: Request):
     """)
 
 @app.get("/embed/rate", response_class=HTMLResponse)
-def embed_rate():
-    return """
+def embed_rate(request: Request):
+    return pages.serve(request, "embed_rate")
+
+@pages.page("embed_rate")
+def render_embed_rate():
+    return assets.head_tags() + """
     <style>
-      html, body { margin:0; padding:0; height:100%; background:#F1F8E9; font-family:'Segoe UI',sans-serif; display:flex; flex-direction:column; }
-      header { background:#2E7D32; color:white; padding:1rem 2rem; display:flex; align-items:center; justify-content:space-between; }
-      header img { height:60px; }
-      nav a { color:white; margin-left:1rem; text-decoration:none; font-weight:500; }
-      nav a:hover { text-decoration:underline; }
       main { flex:1; max-width:960px; margin:2rem auto; padding:2rem; }
       h2 { color:#2E7D32; text-align:center; margin-bottom:1.5rem; }
       form { background:#fff; border:1px solid #C8E6C9; border-radius:8px; padding:2rem; box-shadow:0 4px 12px rgba(0,0,0,0.05); }
@@ -896,7 +1102,6 @@ def embed_rate():
       input, select, textarea { width:100%; margin-bottom:12px; padding:10px; border:1px solid #B0BEC5; border-radius:4px; font-size:14px; }
       button { background:#2E7D32; color:white; border:none; padding:0.6rem 1.2rem; border-radius:4px; cursor:pointer; font-size:14px; }
       button:hover { background:#388E3C; }
-      footer { background:#2E7D32; color:white; text-align:center; padding:1rem; font-size:14px; line-height:1.6; }
     </style>
 
     <header>
@@ -910,21 +1115,6 @@ def embed_rate():
   <span id="client-nav" style="margin-left:auto; font-weight:600;"></span>
 </nav>
 
-<script>
-  document.addEventListener("DOMContentLoaded", function() {
-    fetch("/api/me")
-      .then(res => res.json())
-      .then(data => {
-        const navSpan = document.getElementById("client-nav");
-        if (data.name) {
-          navSpan.innerText = data.name;
-        } else {
-          navSpan.innerHTML = '<a href="/embed/login">Login / Sign Up</a>';
-        }
-      })
-      .catch(err => console.error("⚠️ Failed to fetch client info", err));
-  });
-</script>
     </header>
 
     <main>
@@ -983,7 +1173,7 @@ async def submit_rating(request: Request):
     subject = f"Client Service Rating • {rating}/5"
 
     try:
-        send_confirmation_email(
+        await send_confirmation_email(
             to_email="hendrik.krueger@hazglobal.com",
             subject=subject,
             body=body,
@@ -1018,9 +1208,49 @@ async def submit_rating(request: Request):
 def favicon():
     return FileResponse("static/icon.png")
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@metrics.collector("hazmat_cache_entries", "Entries held by each in-process cache.", ("cache",))
+def cache_entries():
+    return {
+        ("pages",): pages.stats()["pages"],
+        ("geocode",): geocache.stats()["entries"],
+        ("clients",): sessions.clients.stats()["entries"],
+        ("address_books",): addressbook.stats()["clients"],
+        ("qr",): qr.stats()["entries"],
+        ("routes",): routes.stats()["entries"],
+    }
+
+@metrics.collector("hazmat_submit_in_flight", "Bookings holding a /submit concurrency slot.")
+def submit_in_flight():
+    return {(): ratelimit.submit_in_flight}
+
 @app.get("/ping")
 def ping():
-    return {"status": "awake"}
+    # Health for uptime checks: cache sizes/hit counts, queue depth and the state
+    # of the maintenance jobs.
+    return {
+        "status": "awake",
+        "caches": {
+            "pages": pages.stats(),
+            "geocode": geocache.stats(),
+            "clients": sessions.clients.stats(),
+            "address_books": addressbook.stats(),
+            "qr": qr.stats(),
+            "routes": routes.stats(),
+            "locations": locations.stats(),
+        },
+        "queues": {
+            "submit_in_flight": ratelimit.submit_in_flight,
+            "submit_capacity": ratelimit.SUBMIT_CONCURRENCY,
+            "rate_limiter": ratelimit.limiter.stats(),
+            "backup_pending": backup_pending,
+            "bulk_jobs": bulk.stats(),
+        },
+        "scheduler": scheduler.stats(),
+    }
 
 @app.get("/ops/unassigned")
 def ops_unassigned():
@@ -1051,11 +1281,6 @@ def ops_unassigned():
         }
         for r in rows
     ])
-from fastapi import FastAPI, HTTPException
-import sqlite3
-
-app = FastAPI()
-
 @app.get("/ops/assigned")
 def get_assigned_shipments():
     try:
@@ -1089,7 +1314,7 @@ def get_assigned_shipments():
 
 @app.post("/client/addresses")
 async def save_address(request: Request, payload: dict):
-    client_id = request.cookies.get("client_id")
+    client_id = sessions.current_client_id(request)
     if not client_id:
         return {"status": "error", "message": "Not logged in"}
 
@@ -1102,13 +1327,17 @@ async def save_address(request: Request, payload: dict):
          payload.get("company"), payload.get("address"),
          payload.get("contact_person"), payload.get("contact_number"), payload.get("email"))
     )
+    address_id = cursor.lastrowid
     conn.commit()
     conn.close()
-    return {"status": "saved"}
+    addressbook.invalidate(client_id)
+    # Geocode once, after responding, so bookings from this site can skip it.
+    return JSONResponse({"status": "saved", "id": address_id},
+                        background=BackgroundTask(fill_saved_geocode, client_id, address_id, payload.get("address") or ""))
 
 @app.get("/client/addresses")
 async def list_addresses(request: Request):
-    client_id = request.cookies.get("client_id")
+    client_id = sessions.current_client_id(request)
     if not client_id:
         return []
 
@@ -1134,9 +1363,18 @@ async def list_addresses(request: Request):
         for r in rows
     ]
 
+@app.get("/client/addresses/search")
+def search_addresses(request: Request, q: str = "", limit: int = addressbook.DEFAULT_LIMIT):
+    # Autocomplete for the booking form; results carry the stored lat/lng so a
+    # booking from a saved site need not be geocoded again.
+    client_id = sessions.current_client_id(request)
+    if not client_id:
+        return []
+    return addressbook.search(client_id, q, limit)
+
 @app.get("/client/addresses/{address_id}")
 async def get_address(address_id: int, request: Request):
-    client_id = request.cookies.get("client_id")
+    client_id = sessions.current_client_id(request)
     if not client_id:
         return {}
 
@@ -1191,39 +1429,21 @@ def ops_collections():
 
 # ---------- SUBMIT PAGE (STRUCTURED ADDRESS INPUTS) ----------
 @app.get("/embed/submit", response_class=HTMLResponse)
-def embed_submit_form():
-    today = date.today().isoformat()
-    return f"""
+def embed_submit_form(request: Request):
+    return pages.serve(request, "embed_submit")
+
+# Re-rendered once per day: the only dynamic input is the default collection date.
+@pages.page("embed_submit", key_func=lambda: (date.today().isoformat(),))
+def render_embed_submit_form(today):
+    return assets.head_tags() + f"""
     <link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600&display=swap" rel="stylesheet">
     <style>
-      html, body {{
-        margin: 0;
-        padding: 0;
-        height: 100%;
-        background: #F1F8E9;
-        font-family: 'Inter', sans-serif;
-        display: flex;
-        flex-direction: column;
-      }}
+      html, body {{ font-family: 'Inter', sans-serif; }}
       header {{
         font-family: 'Segoe UI', sans-serif;
         font-size: 16px;
-        line-height: 1.6; 
-        background: #2E7D32;
-        color: white;
-        padding: 1rem 2rem;
-        display: flex;
-        align-items: center;
-        justify-content: space-between;
-      }}
-      header img {{ height: 60px; }}
-      nav a {{
-        color: white;
-        margin-left: 1rem;
-        text-decoration: none;
-        font-weight: 500;
+        line-height: 1.6;
       }}
-      nav a:hover {{ text-decoration: underline; }}
       main {{
         flex: 1;
         max-width: 1200px;
@@ -1285,14 +1505,6 @@ def embed_submit_form():
         border: 2px solid red !important;
         background-color: #fff8f8 !important;
       }}
-      footer {{
-        background: #2E7D32;
-        color: white;
-        text-align: center;
-        padding: 1rem;
-        font-size: 14px;
-        line-height: 1.6;
-      }}
       .addr-grid {{ display:grid; grid-template-columns: 1fr 1fr; gap: 1rem; }}
     </style>
 
@@ -1306,32 +1518,21 @@ def embed_submit_form():
         <a href="/embed/rate">Rate Our Services</a>
         <span id="client-nav" style="margin-left:auto; font-weight:600;"></span>
       </nav>
-      <script>
-        document.addEventListener("DOMContentLoaded", function() {{
-          fetch("/api/me")
-            .then(res => res.json())
-            .then(data => {{
-              const navSpan = document.getElementById("client-nav");
-              if (data.name) {{
-                navSpan.innerText = data.name;
-              }} else {{
-                navSpan.innerHTML = '<a href="/embed/login">Login / Sign Up</a>';
-              }}
-            }})
-            .catch(err => console.error("⚠️ Failed to fetch client info", err));
-        }});
-      </script>
     </header>
 
     <main>
       <h2>Book a Hazmat Collection</h2>
       <div class="form-wrapper">
         <form id="hazmat-form" action="/submit" method="post" enctype="multipart/form-data">
+          <input type="hidden" name="idempotency_key" id="idempotency_key">
+          <input type="hidden" name="collection_saved_address_id" id="collection_saved_address_id">
+          <input type="hidden" name="delivery_saved_address_id" id="delivery_saved_address_id">
           <div class="form-grid">
 
             <div class="form-block shipment-block">
               <h3>Shipment Information</h3>
               <label for="saved_contact">Select Saved Contact</label>
+              <input type="text" id="saved_contact_search" placeholder="Search saved contacts" autocomplete="off">
               <select id="saved_contact" name="saved_contact">
                 <option value="">-- Choose from saved contacts --</option>
               </select>
@@ -1513,8 +1714,10 @@ def embed_submit_form():
             .catch(err => console.error("❌ Email dispatch error:", err));
           }}
 
+          let savedContactTimer = null;
           function loadSavedContacts() {{
-            fetch("/client/addresses")
+            const q = document.getElementById("saved_contact_search").value;
+            fetch("/client/addresses/search?limit=20&q=" + encodeURIComponent(q))
               .then(res => res.json())
               .then(data => {{
                 const select = document.getElementById("saved_contact");
@@ -1583,6 +1786,9 @@ def embed_submit_form():
               .then(res => res.json())
               .then(data => {{
                 const parts = (data.address || "").split(",").map(s => s.trim());
+                if (data.type === "collection" || data.type === "delivery") {{
+                  document.getElementById(data.type + "_saved_address_id").value = data.id;
+                }}
                 if (data.type === "collection") {{
                   document.querySelector('[name="collection_company"]').value = data.company;
                   document.querySelector('[name="collection_street"]').value = parts[0] || "";
@@ -1619,6 +1825,11 @@ def embed_submit_form():
           }}
 
           document.addEventListener("DOMContentLoaded", function () {{
+            document.getElementById("saved_contact_search").addEventListener("input", function () {{
+              clearTimeout(savedContactTimer);
+              savedContactTimer = setTimeout(loadSavedContacts, 200);
+            }});
+
             const incoSelect = document.getElementById("inco_terms");
             const incoHidden = document.getElementById("inco_terms_hidden");
             const shipmentType = document.getElementById("shipment_type");
@@ -1663,6 +1874,16 @@ def embed_submit_form():
             fetch("/api/me").then(r=>r.json()).then(d=>{{ loadSavedContacts(); }});
           }});
 
+          // One key per visit to the form: a double-click or browser retry of this
+          // booking replays the first response instead of creating a second one.
+          // pageshow also fires when Back restores the page from the cache, after
+          // the previous booking went through, so the next booking gets its own key.
+          window.addEventListener("pageshow", function () {{
+            document.getElementById("idempotency_key").value =
+              (window.crypto && crypto.randomUUID) ? crypto.randomUUID()
+                : Date.now().toString(36) + "-" + Math.random().toString(36).slice(2);
+          }});
+
           document.getElementById("hazmat-form").addEventListener("submit", function (e) {{
             let requiredFields = [
               "collection_company", "collection_street", "collection_suburb", "collection_city", "collection_postal",
@@ -1717,43 +1938,58 @@ def embed_submit_form():
     """
 
 # ---------- EMAIL ----------
-def send_confirmation_email(to_email, subject, body, attachments=None, cc_email=None):
-    from sendgrid.helpers.mail import Mail, Attachment, FileContent, FileName, FileType, Disposition
-    import base64
+def _email_list(value):
+    if not value:
+        return []
+    addresses = [value] if isinstance(value, str) else value
+    return [{"email": a} for a in addresses]
 
-    message = Mail(
-        from_email="jnb@hazglobal.com",
-        to_emails=to_email,
-        subject=subject,
-        html_content=f"<html><body>{body}{signature_block}</body></html>"
-    )
+async def send_confirmation_email(to_email, subject, body, attachments=None, cc_email=None):
+    # SendGrid v3 mail/send over the shared pooled client (outbound.py).
+    import base64
 
+    personalization = {"to": _email_list(to_email)}
     if cc_email:
-        message.cc = cc_email
+        personalization["cc"] = _email_list(cc_email)
+    message = {
+        "personalizations": [personalization],
+        "from": {"email": "jnb@hazglobal.com"},
+        "subject": subject,
+        "content": [{"type": "text/html", "value": f"<html><body>{body}{signature_block}</body></html>"}],
+    }
 
     if attachments:
+        message["attachments"] = []
         for path in attachments:
             if os.path.exists(path):
                 with open(path, "rb") as f:
                     data = f.read()
-                encoded = base64.b64encode(data).decode()
-                attachment = Attachment(
-                    FileContent(encoded),
-                    FileName(os.path.basename(path)),
-                    FileType("application/octet-stream"),
-                    Disposition("attachment")
-                )
-                message.add_attachment(attachment)
-
+                message["attachments"].append({
+                    "content": base64.b64encode(data).decode(),
+                    "filename": os.path.basename(path),
+                    "type": "application/octet-stream",
+                    "disposition": "attachment",
+                })
+
+    trace = logs.Trace(mail_log, subject=subject)
     try:
-        sg = SendGridAPIClient(SENDGRID_API_KEY)
-        response = sg.send(message)
-        print("📧 SendGrid status:", response.status_code)
-        print("📧 SendGrid body:", response.body)
-        print("📧 SendGrid headers:", response.headers)
+        response = await outbound.post(
+            f"{outbound.SENDGRID_URL}/v3/mail/send",
+            json=message,
+            headers={"Authorization": f"Bearer {SENDGRID_API_KEY}"},
+        )
+        # Full response only for sampled requests; errors always carry the body.
+        mail_log.debug("sendgrid response", extra={"body": response.text, "headers": dict(response.headers)})
+        if response.status_code >= 400:
+            trace.finish("sendgrid rejected", level=logging.WARNING,
+                         status=response.status_code, body=response.text[:500])
+        else:
+            trace.finish("sendgrid accepted", status=response.status_code,
+                         recipients=len(personalization["to"]) + len(personalization.get("cc", [])),
+                         attachments=len(message.get("attachments", [])))
         return response.status_code
-    except Exception as e:
-        print("❌ send_confirmation_email failed:", e)
+    except Exception:
+        trace.finish("sendgrid failed", level=logging.ERROR, exc_info=True)
         return None
 
 @app.post("/api/sendmail")
@@ -1765,7 +2001,7 @@ async def api_sendmail(request: Request):
     attachments = payload.get("attachments", [])
     cc_email = payload.get("cc")
     try:
-        send_confirmation_email(
+        await send_confirmation_email(
             to_email=to_email,
             subject=subject,
             body=body,
@@ -1780,6 +2016,24 @@ async def api_sendmail(request: Request):
 @app.post("/submit")
 async def submit(request: Request):
     form = await request.form()
+    # Retries carrying the same Idempotency-Key (header or hidden form field)
+    # replay the first response instead of booking again.
+    key = idempotency.request_key(request, form)
+    client_id = sessions.current_client_id(request)
+    return await idempotency.acall(key, "/submit", lambda: process_submission(form, client_id),
+                                   idempotency.fingerprint(request, form))
+
+INSERT_BOOKING = """
+    INSERT INTO requests (
+        reference_number, service_type, collection_company, collection_address, collection_person, collection_number,
+        delivery_company, delivery_address, delivery_person, delivery_number,
+        client_reference, pickup_date, inco_terms, client_notes, pdf_path, timestamp,
+        assigned_driver, status, collection_email, delivery_email, collection_region, delivery_region,
+        collection_lat, collection_lng, delivery_lat, delivery_lng, geocode_confidence, address_flag
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+async def process_submission(form, client_id=None):
     required_fields = [
         "shipment_type", "inco_terms", "collection_date",
         "collection_company", "collection_street", "collection_suburb", "collection_city", "collection_postal",
@@ -1791,6 +2045,7 @@ async def submit(request: Request):
     if missing or not form.getlist("shipment_docs"):
         return HTMLResponse(content=f"<h3>Missing required fields: {', '.join(missing)}</h3>", status_code=400)
 
+    trace = logs.Trace(submit_log, on_mark=metrics.stage_recorder("submit"))
     uploaded_files = form.getlist("shipment_docs")
     service_type = form.get("shipment_type") or form.get("serviceType")
     inco_terms = form.get("inco_terms") if service_type != "local" else "DTD"
@@ -1802,6 +2057,8 @@ async def submit(request: Request):
     collection_city = apply_aliases(form.get("collection_city") or "")
     collection_postal = form.get("collection_postal") or ""
     collection_address = ", ".join([v for v in [collection_street, collection_suburb, collection_city, collection_postal] if v])
+    collection_entered = ", ".join(form.get(f) for f in ("collection_street", "collection_suburb", "collection_city", "collection_postal") if form.get(f))
+    collection_saved_id = form.get("collection_saved_address_id")
 
     collection_region = form.get("collection_region") or ""
     collection_person = form.get("collection_contact_name") or ""
@@ -1815,6 +2072,8 @@ async def submit(request: Request):
     delivery_city = apply_aliases(form.get("delivery_city") or "")
     delivery_postal = form.get("delivery_postal") or ""
     delivery_address = ", ".join([v for v in [delivery_street, delivery_suburb, delivery_city, delivery_postal] if v])
+    delivery_entered = ", ".join(form.get(f) for f in ("delivery_street", "delivery_suburb", "delivery_city", "delivery_postal") if form.get(f))
+    delivery_saved_id = form.get("delivery_saved_address_id")
 
     delivery_region = form.get("delivery_region") or ""
     delivery_person = form.get("delivery_contact_name") or ""
@@ -1830,6 +2089,8 @@ async def submit(request: Request):
 
     timestamp = datetime.now().isoformat()
     reference_number = get_next_reference_number()
+    trace.fields.update(ref=reference_number, service_type=service_type)
+    trace.mark("prepare")
 
     # Geocoding strategy per shipment type
     geocode_confidence = 0.0
@@ -1840,14 +2101,10 @@ async def submit(request: Request):
 
     if service_type == "local":
         # Geocode both addresses with branch context
-        coords_c, conf_c = geocode_address(collection_address, branch_hint)
-        if not coords_c:
-            coords_c = centroid_for_postal(collection_postal, branch_hint) or centroid_for_city(branch_hint)
-            conf_c = 0.5 if coords_c else 0.0
-        coords_d, conf_d = geocode_address(delivery_address, branch_hint)
-        if not coords_d:
-            coords_d = centroid_for_postal(delivery_postal, branch_hint) or centroid_for_city(branch_hint)
-            conf_d = 0.5 if coords_d else 0.0
+        coords_c, conf_c = await locate_address(client_id, collection_saved_id, collection_entered,
+                                          collection_address, collection_postal, branch_hint)
+        coords_d, conf_d = await locate_address(client_id, delivery_saved_id, delivery_entered,
+                                          delivery_address, delivery_postal, branch_hint)
         if coords_c:
             collection_lat, collection_lng = coords_c
         if coords_d:
@@ -1857,10 +2114,8 @@ async def submit(request: Request):
 
     elif service_type == "import":
         # Only delivery address geocoded
-        coords_d, conf_d = geocode_address(delivery_address, BRANCH_CITY_MAP.get(delivery_region))
-        if not coords_d:
-            coords_d = centroid_for_postal(delivery_postal, BRANCH_CITY_MAP.get(delivery_region)) or centroid_for_city(BRANCH_CITY_MAP.get(delivery_region))
-            conf_d = 0.5 if coords_d else 0.0
+        coords_d, conf_d = await locate_address(client_id, delivery_saved_id, delivery_entered,
+                                          delivery_address, delivery_postal, BRANCH_CITY_MAP.get(delivery_region))
         if coords_d:
             delivery_lat, delivery_lng = coords_d
         geocode_confidence = conf_d
@@ -1868,27 +2123,18 @@ async def submit(request: Request):
 
     elif service_type == "export":
         # Only collection address geocoded
-        coords_c, conf_c = geocode_address(collection_address, branch_hint)
-        if not coords_c:
-            coords_c = centroid_for_postal(collection_postal, branch_hint) or centroid_for_city(branch_hint)
-            conf_c = 0.5 if coords_c else 0.0
+        coords_c, conf_c = await locate_address(client_id, collection_saved_id, collection_entered,
+                                          collection_address, collection_postal, branch_hint)
         if coords_c:
             collection_lat, collection_lng = coords_c
         geocode_confidence = conf_c
         address_flag = "low_confidence" if geocode_confidence < 0.7 else None
+    trace.mark("geocode")
 
     # Insert into DB
     conn = sqlite3.connect("hazmat.db")
     cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO requests (
-            reference_number, service_type, collection_company, collection_address, collection_person, collection_number,
-            delivery_company, delivery_address, delivery_person, delivery_number,
-            client_reference, pickup_date, inco_terms, client_notes, pdf_path, timestamp,
-            assigned_driver, status, collection_email, delivery_email, collection_region, delivery_region,
-            collection_lat, collection_lng, delivery_lat, delivery_lng, geocode_confidence, address_flag
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
+    cursor.execute(INSERT_BOOKING, (
         reference_number, service_type, collection_company, collection_address, collection_person, collection_number,
         delivery_company, delivery_address, delivery_person, delivery_number,
         client_reference, collection_date, inco_terms, client_notes, "", timestamp,
@@ -1896,9 +2142,11 @@ async def submit(request: Request):
         collection_lat, collection_lng, delivery_lat, delivery_lng, geocode_confidence, address_flag
     ))
     request_id = cursor.lastrowid
+    ops_stats.record_status_event(cursor, reference_number, "booked", at=timestamp)
     conn.commit()
     conn.close()
-    backup_database()
+    schedule_backup()
+    trace.mark("db_insert")
 
     # Save uploaded files
     uploaded_paths = []
@@ -1908,12 +2156,11 @@ async def submit(request: Request):
         with open(save_path, "wb") as f:
             f.write(contents)
         uploaded_paths.append(save_path)
+    trace.mark("uploads")
 
-    # QR code
-    qr_url = f"https://hazmat-collection.onrender.com/confirm/{reference_number}"
-    qr_img = qrcode.make(qr_url)
-    qr_path = f"static/qrcodes/qr_{request_id}.png"
-    qr_img.save(qr_path)
+    # QR code: the matrix only; generate_pdf draws it, the PNG is made on request
+    qr.matrix(reference_number)
+    trace.mark("qr")
 
     # Generate PDF
     pdf_path = f"static/waybills/waybill_{request_id}.pdf"
@@ -1935,7 +2182,8 @@ async def submit(request: Request):
         "delivery_number": delivery_number,
         "delivery_email": ", ".join(delivery_emails),
         "client_notes": client_notes
-    }, request_id, qr_path, pdf_path)
+    }, request_id, pdf_path)
+    trace.mark("pdf")
 
     # Update DB with pdf path
     conn = sqlite3.connect("hazmat.db")
@@ -1943,9 +2191,8 @@ async def submit(request: Request):
     cursor.execute("UPDATE requests SET pdf_path = ? WHERE id = ?", (pdf_path, request_id))
     conn.commit()
     conn.close()
-    backup_database()
+    schedule_backup()
 
-    OPS_CC_LIST = ["hendrik.krueger@hazglobal.com"]
     recipients = collection_emails + delivery_emails
     quoted = form.get("quoted")
     sales_rep_email = form.get("sales_rep") or ""
@@ -1974,18 +2221,21 @@ async def submit(request: Request):
         """
         attachments = [pdf_path] + uploaded_paths
         try:
-            status = send_confirmation_email(
+            status = await send_confirmation_email(
                 to_email=recipients,
                 subject=subject,
                 body=body,
                 attachments=attachments,
                 cc_email=cc_list
             )
-            print("📧 Confirmation email status:", status)
-        except Exception as e:
-            print("❌ Email dispatch failed:", e)
+        except Exception:
+            status = None
+            submit_log.exception("confirmation email failed", extra={"ref": reference_number})
     else:
-        print("⚠️ No client email provided; skipping confirmation email.")
+        status = None
+        submit_log.warning("no client email; confirmation skipped", extra={"ref": reference_number})
+    trace.mark("email")
+    trace.finish("booking created", email_status=status, files=len(uploaded_paths))
 
     return HTMLResponse(f"""
     <html>
@@ -2049,6 +2299,221 @@ async def submit(request: Request):
     </html>
     """)
 
+@app.post("/submit/bulk")
+async def submit_bulk(request: Request):
+    # CSV/XLSX with one booking per row (columns named like the booking form's
+    # fields). Every row is validated before anything is booked; the bookings
+    # then run as a background job polled at /submit/bulk/{job_id}. The job's
+    # status lists every booking's contacts, so it needs an owner: a signed-in
+    # client, or ops with the admin token.
+    client_id = sessions.current_client_id(request)
+    if client_id is None and not is_admin(request):
+        return JSONResponse({"status": "error", "message": "Sign in to import bookings"}, status_code=401)
+    form = await request.form()
+    upload = form.get("file")
+    if upload is None or not hasattr(upload, "read"):
+        return JSONResponse({"status": "error", "message": "Attach the sheet as 'file'"}, status_code=400)
+    content = await upload.read()
+    key = idempotency.request_key(request, form)
+    return await idempotency.acall(key, "/submit/bulk", lambda: start_bulk_job(upload.filename, content, client_id),
+                                   idempotency.fingerprint(request, form))
+
+@app.get("/submit/bulk/{job_id}")
+def bulk_job_status(job_id: str, request: Request):
+    # Only the client who uploaded the sheet (or ops) sees it; anyone else gets
+    # the same 404 as for an unknown id.
+    job = bulk.get(job_id)
+    if job is not None and not is_admin(request) and (
+            job.client_id is None or job.client_id != sessions.current_client_id(request)):
+        job = None
+    if job is None:
+        return JSONResponse({"status": "error", "message": "Unknown job"}, status_code=404)
+    return job.to_dict()
+
+async def start_bulk_job(filename, content, client_id=None):
+    try:
+        numbered_rows = bulk.parse(filename, content)
+    except bulk.BulkError as e:
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=400)
+    problems = bulk.validate(numbered_rows)
+    if problems:
+        return JSONResponse({"status": "error", "message": f"{len(problems)} rows need fixing; nothing was booked",
+                             "rows": problems}, status_code=422)
+    job = bulk.create(len(numbered_rows), client_id)
+    if job is None:
+        return JSONResponse({"status": "error", "message": "Bulk import is busy"}, status_code=429,
+                            headers={"Retry-After": "30"})
+    job.task = asyncio.create_task(run_bulk_job(job, numbered_rows))
+    return JSONResponse({**job.to_dict(), "status_url": f"/submit/bulk/{job.id}"}, status_code=202)
+
+def bulk_booking(row_number, row, reference_number):
+    # The same normalisation process_submission applies to the form.
+    booking = {"row": row_number, "reference_number": reference_number}
+    service_type = row["shipment_type"].lower()
+    booking["service_type"] = service_type
+    booking["inco_terms"] = row["inco_terms"] if service_type != "local" else "DTD"
+    for side in ("collection", "delivery"):
+        parts = [apply_aliases(row.get(f"{side}_{f}", "")) for f in ("street", "suburb", "city")] + [row.get(f"{side}_postal", "")]
+        booking[f"{side}_address"] = ", ".join(v for v in parts if v)
+        booking[f"{side}_postal"] = row.get(f"{side}_postal", "")
+        booking[f"{side}_company"] = row.get(f"{side}_company", "")
+        booking[f"{side}_region"] = row.get(f"{side}_region", "")
+        booking[f"{side}_person"] = row.get(f"{side}_contact_name", "")
+        booking[f"{side}_number"] = row.get(f"{side}_contact_number", "")
+        booking[f"{side}_emails"] = [e.strip() for e in row.get(f"{side}_email", "").split(",") if e.strip()]
+    booking["pickup_date"] = row.get("collection_date", "")
+    booking["client_reference"] = row.get("client_reference", "")
+    booking["client_notes"] = row.get("shipper_notes", "")
+    return booking
+
+def bulk_geocode_keys(booking):
+    # {side: (address, postal code, branch hint)} for the sides this service type geocodes.
+    branch_hint = BRANCH_CITY_MAP.get(booking["collection_region"]) if booking["collection_region"] else None
+    collection = (booking["collection_address"], booking["collection_postal"], branch_hint)
+    delivery_hint = BRANCH_CITY_MAP.get(booking["delivery_region"]) if booking["service_type"] == "import" else branch_hint
+    delivery = (booking["delivery_address"], booking["delivery_postal"], delivery_hint)
+    return {"local": {"collection": collection, "delivery": delivery},
+            "import": {"delivery": delivery},
+            "export": {"collection": collection}}.get(booking["service_type"], {})
+
+def bulk_confirmation_body(bookings):
+    rows = "".join(
+        f"<tr><td>{b['reference_number']}</td><td>{b['pickup_date']}</td><td>{b['collection_company']}</td>"
+        f"<td>{b['collection_address']}</td><td>{b['delivery_company']}</td><td>{b['client_reference']}</td></tr>"
+        for b in bookings)
+    return f"""
+        <p>Dear {bookings[0]['collection_person']},</p>
+        <p>{len(bookings)} collections have been booked successfully. The waybills are attached.</p>
+        <table border="1" cellpadding="4" cellspacing="0" style="border-collapse:collapse">
+          <tr><th>Reference</th><th>Collection Date</th><th>Company</th><th>Address</th><th>Deliver To</th><th>Your Ref</th></tr>
+          {rows}
+        </table>
+    """
+
+async def run_bulk_job(job, numbered_rows):
+    trace = logs.Trace(bulk_log, on_mark=metrics.stage_recorder("bulk"), job=job.id, rows=len(numbered_rows))
+    try:
+        references = allocate_reference_numbers(len(numbered_rows))
+        bookings = [bulk_booking(n, row, ref) for (n, row), ref in zip(numbered_rows, references)]
+        timestamp = datetime.now().isoformat()
+        trace.mark("prepare")
+
+        # Geocoding: each distinct (address, postal code, hint) once, all in
+        # flight together; outbound.py keeps Nominatim to its per-host limit.
+        job.status = "geocoding"
+        located = {}
+        for booking in bookings:
+            for key in bulk_geocode_keys(booking).values():
+                located.setdefault(key, None)
+        job.advance("addresses", len(located))
+
+        async def locate(key):
+            located[key] = await geocode_with_fallback(*key)
+            job.advance("geocoded")
+
+        await asyncio.gather(*(locate(key) for key in located))
+        for booking in bookings:
+            coords = {side: located[key] for side, key in bulk_geocode_keys(booking).items()}
+            for side in ("collection", "delivery"):
+                lat_lng = coords[side][0] if side in coords else None
+                booking[f"{side}_lat"], booking[f"{side}_lng"] = lat_lng or (None, None)
+            confidence = min((conf for _, conf in coords.values()), default=0.0)
+            booking["geocode_confidence"] = confidence
+            booking["address_flag"] = "low_confidence" if coords and confidence < 0.7 else None
+        trace.mark("geocode")
+
+        job.status = "inserting"
+        def insert():
+            conn = sqlite3.connect("hazmat.db")
+            try:
+                cursor = conn.cursor()
+                cursor.executemany(INSERT_BOOKING, [(
+                    b["reference_number"], b["service_type"], b["collection_company"], b["collection_address"],
+                    b["collection_person"], b["collection_number"], b["delivery_company"], b["delivery_address"],
+                    b["delivery_person"], b["delivery_number"], b["client_reference"], b["pickup_date"],
+                    b["inco_terms"], b["client_notes"], "", timestamp, None, "Unassigned",
+                    ", ".join(b["collection_emails"]), ", ".join(b["delivery_emails"]),
+                    b["collection_region"], b["delivery_region"], b["collection_lat"], b["collection_lng"],
+                    b["delivery_lat"], b["delivery_lng"], b["geocode_confidence"], b["address_flag"],
+                ) for b in bookings])
+                for b in bookings:
+                    ops_stats.record_status_event(cursor, b["reference_number"], "booked", at=timestamp)
+                cursor.execute(f"SELECT reference_number, id FROM requests WHERE reference_number IN "
+                               f"({', '.join('?' * len(references))})", references)
+                ids = dict(cursor.fetchall())
+                conn.commit()
+                return ids
+            finally:
+                conn.close()
+        ids = await asyncio.to_thread(insert)
+        for booking in bookings:
+            booking["id"] = ids[booking["reference_number"]]
+            booking["pdf_path"] = f"static/waybills/waybill_{booking['id']}.pdf"
+        job.advance("inserted", len(bookings))
+        schedule_backup()
+        trace.mark("db_insert")
+
+        job.status = "rendering"
+        loop = asyncio.get_running_loop()
+
+        async def render(b):
+            await loop.run_in_executor(bulk.pdf_pool(), generate_pdf, {
+                "reference_number": b["reference_number"], "service_type": b["service_type"],
+                "client_reference": b["client_reference"], "pickup_date": b["pickup_date"],
+                "inco_terms": b["inco_terms"], "collection_company": b["collection_company"],
+                "collection_address": b["collection_address"], "collection_region": b["collection_region"],
+                "collection_person": b["collection_person"], "collection_number": b["collection_number"],
+                "collection_email": ", ".join(b["collection_emails"]), "delivery_company": b["delivery_company"],
+                "delivery_address": b["delivery_address"], "delivery_person": b["delivery_person"],
+                "delivery_number": b["delivery_number"], "delivery_email": ", ".join(b["delivery_emails"]),
+                "client_notes": b["client_notes"],
+            }, b["id"], b["pdf_path"])
+            job.advance("rendered")
+
+        await asyncio.gather(*(render(b) for b in bookings))
+        def store_pdf_paths():
+            conn = sqlite3.connect("hazmat.db")
+            conn.executemany("UPDATE requests SET pdf_path = ? WHERE id = ?", [(b["pdf_path"], b["id"]) for b in bookings])
+            conn.commit()
+            conn.close()
+        await asyncio.to_thread(store_pdf_paths)
+        schedule_backup()
+        trace.mark("pdf")
+
+        # One merged confirmation per collection contact, listing that contact's
+        # bookings with their waybills attached.
+        job.status = "emailing"
+        groups = {}
+        for booking in bookings:
+            groups.setdefault(tuple(booking["collection_emails"]), []).append(booking)
+        for recipients, group in groups.items():
+            try:
+                status = await send_confirmation_email(
+                    to_email=list(recipients),
+                    subject=f"Hazmat Collection Confirmation • {len(group)} bookings "
+                            f"({group[0]['reference_number']}–{group[-1]['reference_number']})",
+                    body=bulk_confirmation_body(group),
+                    attachments=[b["pdf_path"] for b in group],
+                    cc_email=OPS_CC_LIST,
+                )
+            except Exception:
+                status = None
+                bulk_log.exception("bulk confirmation email failed", extra={"job": job.id})
+            job.emails.append({"to": list(recipients), "bookings": len(group), "status": status})
+            job.advance("emailed", len(group))
+        trace.mark("email")
+
+        job.bookings = [{"row": b["row"], "reference": b["reference_number"], "pdf_url": f"/pdf/{b['id']}",
+                         "address_flag": b["address_flag"]} for b in bookings]
+        job.status = "done"
+        trace.finish("bulk import done", bookings=len(bookings), addresses=len(located), emails=len(job.emails))
+    except Exception:
+        job.status = "failed"
+        job.error = "Bulk import failed; bookings already inserted keep their references"
+        trace.finish("bulk import failed", level=logging.ERROR, exc_info=True)
+    finally:
+        job.finished = time.time()
+
 @app.get("/pdf/{request_id}")
 def serve_pdf(request_id: int):
     path = f"static/waybills/waybill_{request_id}.pdf"
@@ -2059,6 +2524,16 @@ def serve_pdf(request_id: int):
         headers={"Content-Disposition": f'inline; filename="waybill_{request_id}.pdf"'}
     )
 
+@app.get("/qr/{reference}.png")
+def serve_qr(reference: str):
+    # Rendered on first request only; bookings never write the PNG.
+    conn = sqlite3.connect("hazmat.db")
+    exists = conn.execute("SELECT 1 FROM requests WHERE reference_number = ?", (reference,)).fetchone()
+    conn.close()
+    if not exists:
+        raise HTTPException(status_code=404, detail="Reference not found")
+    return FileResponse(qr.png_path(reference), media_type="image/png")
+
 @app.get("/thankyou", response_class=HTMLResponse)
 def thank_you():
     return HTMLResponse("""
@@ -2074,42 +2549,179 @@ def confirm(hazjnb_ref: str):
     return HTMLResponse(f"<h1>Driver confirmed request {hazjnb_ref}</h1>")
 
 @app.post("/assign")
-def assign_collection(payload: dict):
+def assign_collection(payload: dict, request: Request):
+    key = idempotency.request_key(request)
+    return idempotency.call(key, "/assign", lambda: assign_driver(payload), idempotency.fingerprint(request, payload))
+
+def assign_driver(payload):
     driver_code = payload.get("driver_code")
     hazjnb_ref = payload.get("hazjnb_ref")
     conn = sqlite3.connect("hazmat.db")
     cursor = conn.cursor()
-    print(f"🚨 Assigning driver {driver_code} to reference {hazjnb_ref}")
+    previous = cursor.execute("SELECT assigned_driver FROM requests WHERE reference_number = ?", (hazjnb_ref,)).fetchone()
+    assigned_at = datetime.now().isoformat()
     cursor.execute("""
-        UPDATE requests SET assigned_driver = ?, status = 'Assigned' WHERE reference_number = ?
-    """, (driver_code, hazjnb_ref))
-    conn.commit()
+        UPDATE requests SET assigned_driver = ?, assigned_at = ?, status = 'Assigned' WHERE reference_number = ?
+    """, (driver_code, assigned_at, hazjnb_ref))
     affected = cursor.rowcount
+    if affected:
+        ops_stats.record_status_event(cursor, hazjnb_ref, "assigned", at=assigned_at, driver=driver_code)
+    conn.commit()
     conn.close()
     if affected == 0:
-        print(f"❌ No matching reference_number found for {hazjnb_ref}")
+        assign_log.warning("reference not found", extra={"ref": hazjnb_ref, "driver": driver_code})
         return JSONResponse(content={"status": "error", "message": "Reference not found"}, status_code=404)
-    print(f"✅ Assignment succeeded for {hazjnb_ref}")
+    assign_log.info("driver assigned", extra={"ref": hazjnb_ref, "driver": driver_code})
+    events.publish("assignments", changes=[{"ref": hazjnb_ref, "driver": driver_code,
+                                            "previous_driver": previous[0] if previous else None}])
     return {"status": "success", "driver": driver_code, "ref": hazjnb_ref}
 
+MAX_BULK_ASSIGNMENTS = 500
+
+@app.post("/assign/bulk")
+def assign_bulk(payload: dict, request: Request):
+    key = idempotency.request_key(request)
+    return idempotency.call(key, "/assign/bulk", lambda: assign_drivers(payload), idempotency.fingerprint(request, payload))
+
+def assign_drivers(payload, only_unassigned=False):
+    # {"assignments": [{"hazjnb_ref": ..., "driver_code": ...}, ...]}: all applied
+    # in one transaction, one result per item, one change event for the batch.
+    # only_unassigned leaves jobs that gained a driver meanwhile untouched.
+    items = payload.get("assignments")
+    if not isinstance(items, list) or not items:
+        return JSONResponse({"status": "error", "message": "assignments must be a non-empty list"}, status_code=400)
+    if len(items) > MAX_BULK_ASSIGNMENTS:
+        return JSONResponse({"status": "error", "message": f"At most {MAX_BULK_ASSIGNMENTS} assignments per request"},
+                            status_code=400)
+    trace = logs.Trace(assign_log, on_mark=metrics.stage_recorder("assign_bulk"), items=len(items))
+    results, changes, seen = [], [], set()
+    conn = sqlite3.connect("hazmat.db")
+    try:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        for item in items:
+            item = item if isinstance(item, dict) else {}
+            ref, driver = item.get("hazjnb_ref"), item.get("driver_code")
+            if not ref or not driver:
+                results.append({"ref": ref, "driver": driver, "status": "invalid",
+                                "message": "hazjnb_ref and driver_code are required"})
+                continue
+            if ref in seen:
+                results.append({"ref": ref, "driver": driver, "status": "duplicate",
+                                "message": "reference appears more than once in this batch"})
+                continue
+            seen.add(ref)
+            row = cursor.execute("SELECT assigned_driver FROM requests WHERE reference_number = ?", (ref,)).fetchone()
+            if row is None:
+                results.append({"ref": ref, "driver": driver, "status": "not_found"})
+                continue
+            if only_unassigned and row[0]:
+                results.append({"ref": ref, "driver": driver, "status": "already_assigned", "current_driver": row[0]})
+                continue
+            assigned_at = datetime.now().isoformat()
+            cursor.execute("""
+                UPDATE requests SET assigned_driver = ?, assigned_at = ?, status = 'Assigned' WHERE reference_number = ?
+            """, (driver, assigned_at, ref))
+            ops_stats.record_status_event(cursor, ref, "assigned", at=assigned_at, driver=driver)
+            results.append({"ref": ref, "driver": driver, "previous_driver": row[0], "status": "assigned"})
+            changes.append({"ref": ref, "driver": driver, "previous_driver": row[0]})
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    trace.mark("db_update")
+    if changes:
+        events.publish("assignments", changes=changes)
+    applied = len(changes)
+    trace.finish("bulk assignment", assigned=applied, rejected=len(results) - applied)
+    return {"status": "success" if applied == len(results) else "partial",
+            "assigned": applied, "rejected": len(results) - applied, "results": results}
+
+@app.get("/ops/dispatch")
+def dispatch_proposals(radius_km: float = None):
+    # Read-only: which driver each unassigned job would get, and why not for the rest.
+    return dispatch.propose(radius_km)
+
+@app.post("/ops/dispatch")
+def dispatch_apply(payload: dict, request: Request):
+    key = idempotency.request_key(request)
+    return idempotency.call(key, "/ops/dispatch", lambda: apply_dispatch(payload), idempotency.fingerprint(request, payload))
+
+def apply_dispatch(payload):
+    # Re-plans and applies in one batch; {"refs": [...]} limits it to those jobs.
+    plan = dispatch.propose(payload.get("radius_km"), refs=payload.get("refs"))
+    if not plan["proposals"]:
+        return {"status": "success", "assigned": 0, "rejected": 0, "results": [], "unplaced": plan["unplaced"]}
+    result = assign_drivers({"assignments": [{"hazjnb_ref": p["ref"], "driver_code": p["driver"]}
+                                             for p in plan["proposals"]]}, only_unassigned=True)
+    assign_log.info("dispatch applied", extra={"assigned": result["assigned"], "unplaced": len(plan["unplaced"]),
+                                               "plan_ms": plan["ms"]})
+    return {**result, "unplaced": plan["unplaced"]}
+
+@app.get("/ops/events")
+def ops_events(since: int = 0, topic: str = None):
+    # Dashboards poll with the last seq they saw; reload=True means the history
+    # no longer covers that point (or the server restarted), so re-read the tables.
+    latest, changes, complete = events.since(since, topic)
+    return {"seq": latest, "reload": not complete, "events": changes}
+
 @app.get("/driver/{code}")
 def get_driver_jobs(code: str):
-    conn = sqlite3.connect("hazmat.db")
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT reference_number, collection_company, collection_address, pickup_date
-        FROM requests WHERE assigned_driver = ?
-    """, (code,))
-    rows = cursor.fetchall()
-    conn.close()
-    return [{"hazjnb_ref": r[0], "company": r[1], "address": r[2], "pickup_date": r[3]} for r in rows]
+    # Day by day, open stops in route order (stop, leg_km), then the rest.
+    return [job for day in routes.driver_days(code).values() for job in day["jobs"]]
+
+@app.get("/driver/{code}/route")
+def get_driver_route(code: str, day: str = None):
+    days = routes.driver_days(code)
+    if day is None:
+        return days
+    if day not in days:
+        raise HTTPException(status_code=404, detail="No jobs for that day")
+    return {day: days[day]}
 
 @app.get("/ops/drivers")
-def get_drivers():
-    return [
-        {"code": "HK", "name": "Hendrik", "lat": -26.2041, "lng": 28.0473},
-        {"code": "MV", "name": "Morne",   "lat": -26.2560, "lng": 28.3200},
-    ]
+def get_drivers(trail_minutes: int = 0):
+    # Roster plus anyone reporting a live position; lat/lng is the live position
+    # when recent, else the depot. load = open jobs on the driver's list;
+    # trail_minutes adds the recent pings for the map, straight from memory.
+    conn = sqlite3.connect("hazmat.db")
+    loads = dispatch.driver_loads(conn.cursor())
+    conn.close()
+    drivers = [{**driver, "load": loads.get(code, 0)} for code, driver in dispatch.driver_positions().items()]
+    if trail_minutes > 0:
+        since = time.time() - trail_minutes * 60
+        for driver in drivers:
+            driver["trail"] = [[lat, lng] for lat, lng, _ in locations.recent(driver["code"], since)]
+    return drivers
+
+@app.get("/ops/drivers/nearby")
+def drivers_nearby(ref: str = None, lat: float = None, lng: float = None, radius_km: float = 25):
+    # Drivers with a recent live position within radius_km of a booking's
+    # collection point (?ref=) or of any point (?lat=&lng=), nearest first.
+    if ref:
+        conn = sqlite3.connect("hazmat.db")
+        row = conn.execute("SELECT collection_lat, collection_lng FROM requests WHERE reference_number = ?",
+                           (ref,)).fetchone()
+        conn.close()
+        if row is None:
+            raise HTTPException(status_code=404, detail="Reference not found")
+        lat, lng = row
+    if lat is None or lng is None:
+        raise HTTPException(status_code=400, detail="ref (with a geocoded collection) or lat and lng required")
+    found = locations.within(lat, lng, radius_km, max_age=dispatch.POSITION_MAX_AGE)
+    return {"lat": lat, "lng": lng, "radius_km": radius_km, "drivers": [
+        {"code": code, "name": dispatch.ROSTER.get(code, {}).get("name", code), "distance_km": round(distance, 2),
+         "last_seen": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(seen))}
+        for distance, code, seen in found
+    ]}
+
+@app.get("/ops/drivers/{code}/track")
+def driver_track(code: str, minutes: int = 60):
+    since = time.time() - minutes * 60
+    return {"driver": code, "points": [[lat, lng, time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(at))]
+                                       for lat, lng, at in locations.track(code, since)]}
 
 @app.post("/ops/updates")
 def submit_update(payload: dict):
@@ -2124,7 +2736,7 @@ def submit_update(payload: dict):
     ))
     conn.commit()
     conn.close()
-    backup_database()
+    schedule_backup()
     return {"status": "update received"}
 
 @app.get("/ops/updates")
@@ -2153,22 +2765,32 @@ def ops_updates():
     ])
 
 @app.post("/ops/completed")
-def submit_completed(payload: dict):
+def submit_completed(payload: dict, request: Request):
+    key = idempotency.request_key(request)
+    return idempotency.call(key, "/ops/completed", lambda: complete_shipment(payload), idempotency.fingerprint(request, payload))
+
+def complete_shipment(payload):
     conn = sqlite3.connect("hazmat.db")
     cursor = conn.cursor()
     cursor.execute("""
-        INSERT INTO completed (ops, company, delivery_date, time, signed_by, document, pod)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
+        INSERT INTO completed (ops, company, delivery_date, time, signed_by, document, pod, haz_ref)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
     """, (
         payload["ops"], payload["company"], payload["delivery_date"], payload["time"],
-        payload["signed_by"], payload["document"], payload["pod"]
+        payload["signed_by"], payload["document"], payload["pod"], payload["haz_ref"]
     ))
     cursor.execute("""
         UPDATE requests SET status = 'Delivered' WHERE reference_number = ?
     """, (payload["haz_ref"],))
+    delivered = cursor.rowcount
+    if delivered:
+        delivered_at = ops_stats.parse_timestamp(payload["delivery_date"], payload.get("time"))
+        ops_stats.record_status_event(cursor, payload["haz_ref"], "delivered", at=delivered_at)
     conn.commit()
     conn.close()
-    backup_database()
+    if delivered:
+        events.publish("status", changes=[{"ref": payload["haz_ref"], "status": "Delivered"}])
+    schedule_backup()
     return {"status": "completed"}
 
 @app.get("/ops/completed")
@@ -2196,20 +2818,68 @@ def ops_completed():
         for r in rows
     ])
 
+@app.get("/ops/stats")
+def get_ops_stats(date_from: str = None, date_to: str = None, region: str = None,
+                  driver: str = None, service_type: str = None, group_by: str = ""):
+    # Answers from the daily aggregates only; never touches requests/scan_log/completed.
+    groups = [g.strip() for g in group_by.split(",") if g.strip()]
+    return ops_stats.get_stats(date_from, date_to, region, driver, service_type, groups)
+
+@app.get("/ops/completed/export")
+def export_completed(format: str = "csv", date_from: str = None, date_to: str = None, client: str = None):
+    # Streams from a SQLite cursor, so the size of the report never sits in memory.
+    if format == "xlsx":
+        path = exports.write_completed_xlsx(date_from, date_to, client)
+        return FileResponse(
+            path,
+            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            filename=exports.export_filename("xlsx", date_from, date_to),
+            background=BackgroundTask(os.remove, path)
+        )
+    return StreamingResponse(
+        exports.stream_completed_csv(date_from, date_to, client),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{exports.export_filename("csv", date_from, date_to)}"'}
+    )
+
+@app.get("/ops/sla")
+def get_sla_report(period: str = None, date_from: str = None, date_to: str = None):
+    # period: YYYY, YYYY-MM or YYYY-MM-DD; reports are cached for a few minutes
+    # (closed periods for longer) and dropped on scans, deliveries and assignments.
+    try:
+        return analytics.get_sla_report(period, date_from, date_to)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid period or dates: {e}")
+
 @app.post("/ops/update_location")
-def update_location(data: dict):
-    driver = data["driver"]
-    lat = data["lat"]
-    lng = data["lng"]
+async def update_location(data: dict):
+    # async: the store update never blocks, so pings skip the threadpool hop.
+    driver = data.get("driver")
+    if not isinstance(driver, str) or not driver.strip():
+        raise HTTPException(status_code=400, detail="driver is required")
+    driver = driver.strip()
+    try:
+        lat, lng = float(data.get("lat")), float(data.get("lng"))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="lat and lng must be numbers")
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise HTTPException(status_code=400, detail="lat/lng out of range")
+    locations.update(driver, lat, lng)
     return {"status": "ok"}
 
 @app.get("/ops/backup")
 def trigger_backup():
-    backup_database()
+    # Written now rather than on the next scheduler tick, so "complete" is true.
+    schedule_backup()
+    flush_backup()
     return {"status": "backup complete"}
 
 @app.post("/scan_qr")
-def scan_qr(payload: dict):
+def scan_qr(payload: dict, request: Request):
+    key = idempotency.request_key(request)
+    return idempotency.call(key, "/scan_qr", lambda: record_scan(payload), idempotency.fingerprint(request, payload))
+
+def record_scan(payload):
     ref = payload.get("ref")
     driver_id = payload.get("driver_id")
     timestamp = datetime.now().isoformat()
@@ -2231,13 +2901,24 @@ def scan_qr(payload: dict):
     cursor.execute("""
         UPDATE requests SET status = 'Collected' WHERE reference_number = ?
     """, (ref,))
+    collected = cursor.rowcount
+    if collected:
+        ops_stats.record_status_event(cursor, ref, "collected", at=timestamp, driver=driver_id)
     conn.commit()
     conn.close()
+    if collected:
+        events.publish("status", changes=[{"ref": ref, "status": "Collected", "driver": driver_id}])
 
-    print(f"✅ QR scan logged and status updated for {ref}")
+    qr_log.info("qr scan recorded", extra={"ref": ref, "driver": driver_id})
     return {"status": "collected", "ref": ref, "driver": driver_id}
 
-def generate_pdf(data, request_id, qr_path, pdf_path):
+def generate_pdf(data, request_id, pdf_path):
+    # reportlab is imported on first waybill rather than at startup.
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.units import mm
+    from reportlab.lib.colors import HexColor
+
     c = canvas.Canvas(pdf_path, pagesize=A4)
     width, height = A4
 
@@ -2302,9 +2983,12 @@ def generate_pdf(data, request_id, qr_path, pdf_path):
     c.setFillColor(HexColor("#212121"))
     c.drawString(25 * mm, y, data.get("client_notes") or "None")
 
-    if os.path.exists(qr_path):
-        c.drawImage(qr_path, width - 50 * mm, 20 * mm,
-                    width=30 * mm, preserveAspectRatio=True, mask='auto')
+    # Same spot the embedded PNG landed on: drawImage centred the 30 mm square in
+    # a box as tall as the image in pixels.
+    reference = data.get("reference_number")
+    if reference:
+        qr_size = 30 * mm
+        qr.draw(c, reference, width - 50 * mm, 20 * mm + (qr.pixel_size(reference) - qr_size) / 2, qr_size)
 
     c.setFont("Helvetica-Oblique", 8)
     c.setFillColor(HexColor("#607D8B"))
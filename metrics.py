@@ -0,0 +1,233 @@
+# metrics.py
+# In-process Prometheus metrics: per-route request latency histograms, request
+# counts by status (for error rates), in-flight gauges, and stage histograms for
+# multi-step operations such as /submit. Rendered in the text exposition format
+# at /metrics; no client library needed. Also keeps the slowest requests with
+# their stage breakdown for /debug/slow-requests.
+import os, time, heapq, threading
+from bisect import bisect_left
+from collections import OrderedDict
+import logs
+
+# Seconds. Upper bounds of the cumulative buckets (+Inf is implicit).
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_lock = threading.Lock()
+
+
+class Histogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+
+class Family:
+    """One metric name with a fixed label set; children are created on first use."""
+
+    def __init__(self, name, kind, help_text, labels):
+        self.name = name
+        self.kind = kind
+        self.help = help_text
+        self.labels = labels
+        self.children = {}
+
+    def _child(self, values, factory):
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = factory()
+        return child
+
+    def observe(self, seconds, *values):
+        with _lock:
+            self._child(values, Histogram).observe(seconds)
+
+    def inc(self, *values, amount=1):
+        with _lock:
+            self.children[values] = self.children.get(values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with _lock:
+            items = sorted(self.children.items())
+            snapshot = [(values, (list(v.counts), v.total, v.count) if isinstance(v, Histogram) else v)
+                        for values, v in items]
+        for values, value in snapshot:
+            labels = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.labels, values))
+            if self.kind != "histogram":
+                lines.append(f"{self.name}{{{labels}}} {value}")
+                continue
+            counts, total, count = value
+            cumulative = 0
+            sep = "," if labels else ""
+            for bound, n in zip(BUCKETS + ("+Inf",), counts):
+                cumulative += n
+                lines.append(f'{self.name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {round(total, 6)}")
+            lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+request_duration = Family("hazmat_http_request_duration_seconds", "histogram",
+                          "Request latency by route template.", ("method", "route"))
+requests_total = Family("hazmat_http_requests_total", "counter",
+                        "Completed requests by route and status code.", ("method", "route", "status"))
+in_flight = Family("hazmat_http_requests_in_flight", "gauge",
+                   "Requests currently being handled.", ("route",))
+stage_duration = Family("hazmat_stage_duration_seconds", "histogram",
+                        "Time spent in each stage of a multi-step operation.", ("operation", "stage"))
+
+
+
+class SlowRequests:
+    """The N slowest requests since start (or the last clear), each with its
+    logs.Trace span breakdown. A min-heap keyed on duration, so recording a
+    request that does not make the cut is one comparison."""
+
+    def __init__(self, size):
+        self.size = size
+        self.heap = []
+        self.seq = 0
+        self.lock = threading.Lock()
+
+    def record(self, seconds, entry):
+        with self.lock:
+            self.seq += 1
+            item = (seconds, self.seq, entry)
+            if len(self.heap) < self.size:
+                heapq.heappush(self.heap, item)
+            elif seconds > self.heap[0][0]:
+                heapq.heapreplace(self.heap, item)
+
+    def snapshot(self):
+        with self.lock:
+            items = sorted(self.heap, reverse=True)
+        return [entry for _, _, entry in items]
+
+    def clear(self):
+        with self.lock:
+            self.heap.clear()
+
+
+slow_requests = SlowRequests(int(os.getenv("SLOW_REQUESTS_KEPT") or "20"))
+
+FAMILIES = [request_duration, requests_total, in_flight, stage_duration]
+# Extra gauges computed at scrape time: name -> (help, callable returning {labels tuple: value}).
+_collectors = []
+
+
+def collector(name, help_text, labels=()):
+    # Decorator for scrape-time gauges, e.g. cache sizes owned by other modules.
+    def decorator(func):
+        _collectors.append((name, help_text, labels, func))
+        return func
+    return decorator
+
+
+def stage_recorder(operation):
+    """Callback for logs.Trace(on_mark=...): records each stage into stage_duration."""
+    def record(stage, ms):
+        stage_duration.observe(ms / 1000, operation, stage)
+    return record
+
+
+class timed:
+    """with metrics.timed("backup", "backup_database"): ..."""
+
+    def __init__(self, operation, stage):
+        self.labels = (operation, stage)
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        stage_duration.observe(time.perf_counter() - self.started, *self.labels)
+        return False
+
+
+def render():
+    lines = []
+    for family in FAMILIES:
+        lines.extend(family.render())
+    for name, help_text, labels, func in _collectors:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+        for values, value in func().items():
+            label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(labels, values))
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """Pure ASGI. Resolves the route template before the request runs (so the
+    in-flight gauge and histograms use "/driver/{code}", not every driver code)
+    and records latency and status when the response finishes. Runs inside
+    logs.RequestLogMiddleware, so the request id and spans are bound."""
+
+    MAX_CACHED_PATHS = 2048
+
+    def __init__(self, app, router_app):
+        self.app = app
+        self.router_app = router_app
+        self.route_cache = OrderedDict()
+
+    def route_for(self, scope):
+        from starlette.routing import Match
+        key = (scope["method"], scope["path"])
+        route = self.route_cache.get(key)
+        if route is not None:
+            return route
+        route = "unmatched"
+        for candidate in self.router_app.router.routes:
+            match, _ = candidate.matches(scope)
+            if match == Match.FULL:
+                route = getattr(candidate, "path", route) or route
+                break
+            if match == Match.PARTIAL and route == "unmatched":
+                route = getattr(candidate, "path", route) or route
+        self.route_cache[key] = route
+        if len(self.route_cache) > self.MAX_CACHED_PATHS:
+            self.route_cache.popitem(last=False)
+        return route
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        route = self.route_for(scope)
+        method = scope["method"]
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_flight.inc(route)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            in_flight.inc(route, amount=-1)
+            request_duration.observe(elapsed, method, route)
+            requests_total.inc(method, route, str(status))
+            if not route.startswith("/debug/"):
+                slow_requests.record(elapsed, {
+                    "at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                    "request_id": logs.request_id.get(), "method": method, "path": scope["path"],
+                    "route": route, "status": status, "ms": round(elapsed * 1000, 1),
+                    "spans": dict(logs.request_spans.get() or {}),
+                })
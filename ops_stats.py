@@ -0,0 +1,265 @@
+# ops_stats.py
+# Incremental daily aggregates for operations reporting.
+# Every status event (booked / assigned / collected / delivered) bumps a counter
+# per day × region × driver × service_type and, where a duration is known, a
+# latency histogram bucket, so reports never have to scan the raw tables.
+import sqlite3, bisect
+from datetime import datetime, date
+
+DB_PATH = "hazmat.db"
+
+# Histogram bucket upper bounds in minutes; the last bucket is open-ended.
+LATENCY_BUCKETS = [15, 30, 60, 120, 240, 480, 720, 1440, 2880, 4320, 10080, 20160]
+
+EVENTS = ("booked", "assigned", "collected", "delivered")
+
+
+def init_stats_tables(conn=None):
+    own = conn is None
+    if own:
+        conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute("""CREATE TABLE IF NOT EXISTS ops_daily_counts (
+        day TEXT,
+        region TEXT,
+        driver TEXT,
+        service_type TEXT,
+        event TEXT,
+        count INTEGER DEFAULT 0,
+        PRIMARY KEY (day, region, driver, service_type, event)
+    );""")
+    cursor.execute("""CREATE TABLE IF NOT EXISTS ops_daily_latency (
+        day TEXT,
+        region TEXT,
+        driver TEXT,
+        service_type TEXT,
+        metric TEXT,
+        bucket INTEGER,
+        count INTEGER DEFAULT 0,
+        total_minutes REAL DEFAULT 0,
+        PRIMARY KEY (day, region, driver, service_type, metric, bucket)
+    );""")
+    conn.commit()
+    if own:
+        conn.close()
+
+
+def parse_timestamp(value, time_value=None):
+    if not value:
+        return None
+    text = str(value).strip()
+    if time_value:
+        text = f"{text[:10]} {str(time_value).strip()}"
+    for candidate in (text, text.replace("T", " ")[:19], text[:16], text[:10]):
+        try:
+            return datetime.fromisoformat(candidate)
+        except ValueError:
+            continue
+    return None
+
+
+def bucket_for(minutes):
+    return bisect.bisect_left(LATENCY_BUCKETS, minutes)
+
+
+def histogram_percentile(counts, q, totals=None):
+    # counts: {bucket_index: count}, totals: {bucket_index: summed minutes}.
+    # Estimates the q-th percentile (minutes) by interpolating linearly between
+    # the bounds of the bucket that holds it. The open-ended bucket has no upper
+    # bound, so it reports the mean of its own samples (at least the last bound).
+    total = sum(counts.values())
+    if not total:
+        return None
+    rank = q / 100.0 * total
+    seen = 0
+    for bucket in sorted(counts):
+        count = counts[bucket]
+        if not count:
+            continue
+        if seen + count >= rank:
+            if bucket >= len(LATENCY_BUCKETS):
+                mean = (totals or {}).get(bucket, 0) / count
+                return round(max(LATENCY_BUCKETS[-1], mean), 1)
+            lower = LATENCY_BUCKETS[bucket - 1] if bucket else 0
+            upper = LATENCY_BUCKETS[bucket]
+            return round(lower + (upper - lower) * (rank - seen) / count, 1)
+        seen += count
+    return LATENCY_BUCKETS[-1]
+
+
+def _bump_count(cursor, day, region, driver, service_type, event):
+    cursor.execute("""
+        INSERT INTO ops_daily_counts (day, region, driver, service_type, event, count)
+        VALUES (?, ?, ?, ?, ?, 1)
+        ON CONFLICT (day, region, driver, service_type, event) DO UPDATE SET count = count + 1
+    """, (day, region, driver, service_type, event))
+
+
+def _bump_latency(cursor, day, region, driver, service_type, metric, minutes):
+    cursor.execute("""
+        INSERT INTO ops_daily_latency (day, region, driver, service_type, metric, bucket, count, total_minutes)
+        VALUES (?, ?, ?, ?, ?, ?, 1, ?)
+        ON CONFLICT (day, region, driver, service_type, metric, bucket)
+        DO UPDATE SET count = count + 1, total_minutes = total_minutes + excluded.total_minutes
+    """, (day, region, driver, service_type, metric, bucket_for(minutes), minutes))
+
+
+def record_status_event(cursor, reference_number, event, at=None, driver=None):
+    """Fold one status change into the daily aggregates.
+
+    Runs on the caller's cursor so the aggregate update commits (or rolls back)
+    together with the status change itself.
+    """
+    at_dt = parse_timestamp(at) if isinstance(at, str) else (at or datetime.now())
+    if at_dt is None:
+        at_dt = datetime.now()
+    cursor.execute("""
+        SELECT timestamp, collection_region, service_type, assigned_driver
+        FROM requests WHERE reference_number = ?
+    """, (reference_number,))
+    row = cursor.fetchone()
+    booked_at, region, service_type, assigned = row if row else (None, None, None, None)
+    region = region or ""
+    service_type = service_type or ""
+    driver = driver or assigned or ""
+    day = at_dt.date().isoformat()
+
+    _bump_count(cursor, day, region, driver, service_type, event)
+
+    booked_dt = parse_timestamp(booked_at)
+    if event == "collected" and booked_dt:
+        minutes = (at_dt - booked_dt).total_seconds() / 60.0
+        if minutes >= 0:
+            _bump_latency(cursor, day, region, driver, service_type, "booking_to_collection", minutes)
+    elif event == "delivered":
+        try:
+            cursor.execute("""
+                SELECT timestamp FROM scan_log WHERE reference_number = ? ORDER BY id DESC LIMIT 1
+            """, (reference_number,))
+            scan = cursor.fetchone()
+        except sqlite3.OperationalError:
+            scan = None
+        collected_dt = parse_timestamp(scan[0]) if scan else None
+        if collected_dt:
+            minutes = (at_dt - collected_dt).total_seconds() / 60.0
+            if minutes >= 0:
+                _bump_latency(cursor, day, region, driver, service_type, "collection_to_delivery", minutes)
+        if booked_dt:
+            minutes = (at_dt - booked_dt).total_seconds() / 60.0
+            if minutes >= 0:
+                _bump_latency(cursor, day, region, driver, service_type, "booking_to_delivery", minutes)
+
+
+def get_stats(date_from=None, date_to=None, region=None, driver=None, service_type=None, group_by=None):
+    date_from = date_from or date.today().isoformat()
+    date_to = date_to or date_from
+    filters = ["day BETWEEN ? AND ?"]
+    params = [date_from, date_to]
+    for column, value in (("region", region), ("driver", driver), ("service_type", service_type)):
+        if value is not None:
+            filters.append(f"{column} = ?")
+            params.append(value)
+    where = " AND ".join(filters)
+    group_cols = [g for g in (group_by or []) if g in ("day", "region", "driver", "service_type")]
+
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    select_cols = ", ".join(group_cols + ["event"])
+    cursor.execute(f"""
+        SELECT {select_cols}, SUM(count) FROM ops_daily_counts
+        WHERE {where} GROUP BY {select_cols}
+    """, params)
+    counts = cursor.fetchall()
+    select_cols = ", ".join(group_cols + ["metric", "bucket"])
+    cursor.execute(f"""
+        SELECT {select_cols}, SUM(count), SUM(total_minutes) FROM ops_daily_latency
+        WHERE {where} GROUP BY {select_cols}
+    """, params)
+    latency = cursor.fetchall()
+    conn.close()
+
+    groups = {}
+    n = len(group_cols)
+
+    def group_for(key):
+        if key not in groups:
+            groups[key] = {
+                **dict(zip(group_cols, key)),
+                "counts": {e: 0 for e in EVENTS},
+                "_hist": {},
+            }
+        return groups[key]
+
+    for r in counts:
+        group_for(tuple(r[:n]))["counts"][r[n]] = r[n + 1]
+    for r in latency:
+        g = group_for(tuple(r[:n]))
+        metric, bucket, count, total = r[n], r[n + 1], r[n + 2], r[n + 3]
+        hist = g["_hist"].setdefault(metric, {"buckets": {}, "totals": {}, "count": 0, "total": 0.0})
+        hist["buckets"][bucket] = count
+        hist["totals"][bucket] = total or 0.0
+        hist["count"] += count
+        hist["total"] += total or 0.0
+
+    results = []
+    for g in groups.values():
+        g["latency_minutes"] = {
+            metric: {
+                "count": h["count"],
+                "mean": round(h["total"] / h["count"], 1) if h["count"] else None,
+                "p50": histogram_percentile(h["buckets"], 50, h["totals"]),
+                "p90": histogram_percentile(h["buckets"], 90, h["totals"]),
+                "p99": histogram_percentile(h["buckets"], 99, h["totals"]),
+            }
+            for metric, h in g.pop("_hist").items()
+        }
+        results.append(g)
+
+    return {
+        "date_from": date_from,
+        "date_to": date_to,
+        "group_by": group_cols,
+        "bucket_bounds_minutes": LATENCY_BUCKETS,
+        "results": results,
+    }
+
+
+def rebuild_stats():
+    # One-off backfill from the raw tables, e.g. after first deploying the aggregates.
+    conn = sqlite3.connect(DB_PATH)
+    init_stats_tables(conn)
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM ops_daily_counts")
+    cursor.execute("DELETE FROM ops_daily_latency")
+    # Assignments are replayed at requests.assigned_at. Rows assigned before
+    # that column existed (or a database main.migrate_db() has not run on yet)
+    # have no record of when, so they fall back to the booking time.
+    columns = [c[1] for c in cursor.execute("PRAGMA table_info(requests)").fetchall()]
+    assigned_col = "assigned_at" if "assigned_at" in columns else "NULL"
+    cursor.execute(f"SELECT reference_number, timestamp, assigned_driver, {assigned_col} FROM requests")
+    for ref, booked_at, driver, assigned_at in cursor.fetchall():
+        record_status_event(cursor, ref, "booked", at=booked_at)
+        if driver:
+            record_status_event(cursor, ref, "assigned", at=assigned_at or booked_at, driver=driver)
+    cursor.execute("SELECT reference_number, driver_id, timestamp FROM scan_log")
+    for ref, driver, scanned_at in cursor.fetchall():
+        record_status_event(cursor, ref, "collected", at=scanned_at, driver=driver)
+    # Deliveries last, so their latencies see the scans replayed above. Like
+    # /ops/completed, only rows whose booking exists are counted; rows written
+    # before completed.haz_ref are matched through updates.ops -> updates.haz.
+    cursor.execute("""
+        SELECT r.reference_number, c.delivery_date, c.time
+        FROM completed c
+        JOIN requests r ON r.reference_number = COALESCE(
+            c.haz_ref, (SELECT u.haz FROM updates u WHERE u.ops = c.ops ORDER BY u.id DESC LIMIT 1))
+        ORDER BY c.id
+    """)
+    for ref, delivery_date, delivery_time in cursor.fetchall():
+        record_status_event(cursor, ref, "delivered", at=parse_timestamp(delivery_date, delivery_time))
+    conn.commit()
+    conn.close()
+    print("✅ Operations aggregates rebuilt")
+
+
+if __name__ == "__main__":
+    rebuild_stats()
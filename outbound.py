@@ -0,0 +1,78 @@
+# outbound.py
+# One pooled httpx.AsyncClient for every call the server makes to other
+# services (Nominatim geocoding, SendGrid mail, future integrations). Connections
+# are kept alive and reused, HTTP/2 is negotiated when the h2 package is
+# installed, and each host gets its own concurrency cap so a slow provider cannot
+# tie up the whole pool.
+import os, asyncio
+from importlib.util import find_spec
+from urllib.parse import urlsplit
+
+# httpx is imported when the first request is made, keeping it off cold start.
+HTTP2 = find_spec("h2") is not None
+
+NOMINATIM_URL = (os.getenv("NOMINATIM_URL") or "https://nominatim.openstreetmap.org").rstrip("/")
+SENDGRID_URL = (os.getenv("SENDGRID_URL") or "https://api.sendgrid.com").rstrip("/")
+USER_AGENT = "HazmatGlobal/1.0"
+
+TIMEOUT = {"timeout": 10.0, "connect": 5.0}
+LIMITS = {"max_connections": 32, "max_keepalive_connections": 16, "keepalive_expiry": 60}
+# Nominatim's usage policy allows one request at a time per application.
+HOST_CONCURRENCY = {
+    urlsplit(NOMINATIM_URL).hostname: 1,
+    urlsplit(SENDGRID_URL).hostname: 4,
+}
+DEFAULT_HOST_CONCURRENCY = 8
+
+_client = None
+_host_slots = {}
+requests_sent = 0
+
+
+def client():
+    # Created on first use so it binds to the running event loop.
+    global _client
+    if _client is None:
+        import httpx
+        _client = httpx.AsyncClient(http2=HTTP2, timeout=httpx.Timeout(**TIMEOUT), limits=httpx.Limits(**LIMITS),
+                                    headers={"User-Agent": USER_AGENT})
+    return _client
+
+
+def _slot(host):
+    slot = _host_slots.get(host)
+    if slot is None:
+        slot = _host_slots[host] = asyncio.Semaphore(HOST_CONCURRENCY.get(host, DEFAULT_HOST_CONCURRENCY))
+    return slot
+
+
+async def request(method, url, **kwargs):
+    global requests_sent
+    async with _slot(urlsplit(url).hostname):
+        requests_sent += 1
+        return await client().request(method, url, **kwargs)
+
+
+async def get(url, **kwargs):
+    return await request("GET", url, **kwargs)
+
+
+async def post(url, **kwargs):
+    return await request("POST", url, **kwargs)
+
+
+async def aclose():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+    _host_slots.clear()
+
+
+def stats():
+    return {
+        "http2": HTTP2,
+        "requests": requests_sent,
+        "hosts": {host: HOST_CONCURRENCY.get(host, DEFAULT_HOST_CONCURRENCY) - slot._value
+                  for host, slot in _host_slots.items()},
+    }
@@ -0,0 +1,101 @@
+# pages.py
+# Render-once cache for the public embed pages. Each page builder runs once per
+# distinct set of dynamic inputs (e.g. today's date on the booking form); the
+# rendered bytes, a gzip copy and an ETag are kept and served directly, with
+# 304 Not Modified for browsers that already hold the current version.
+import gzip, hashlib, threading
+from fastapi.responses import Response
+import compression
+
+# Older variants of a page (e.g. yesterday's booking form) are dropped beyond this.
+MAX_VARIANTS_PER_PAGE = 4
+
+
+class RenderedPage:
+    __slots__ = ("body", "gzipped", "etag")
+
+    def __init__(self, html):
+        self.body = html.encode("utf-8")
+        self.gzipped = gzip.compress(self.body, compresslevel=9, mtime=0)
+        self.etag = '"' + hashlib.sha1(self.body).hexdigest()[:20] + '"'
+
+
+_builders = {}
+_rendered = {}
+_lock = threading.Lock()
+hits = 0
+misses = 0
+
+
+def register(name, builder, key_func=None):
+    """key_func() returns the dynamic inputs passed to builder; None for static pages."""
+    _builders[name] = (builder, key_func)
+
+
+def page(name, key_func=None):
+    # Decorator form of register() for builders defined next to their route.
+    def decorator(builder):
+        register(name, builder, key_func)
+        return builder
+    return decorator
+
+
+def get(name):
+    global hits, misses
+    builder, key_func = _builders[name]
+    key = tuple(key_func()) if key_func else ()
+    variants = _rendered.get(name)
+    rendered = variants.get(key) if variants else None
+    if rendered is not None:
+        hits += 1
+        return rendered
+    misses += 1
+    rendered = RenderedPage(builder(*key))
+    with _lock:
+        variants = _rendered.setdefault(name, {})
+        variants[key] = rendered
+        while len(variants) > MAX_VARIANTS_PER_PAGE:
+            variants.pop(next(iter(variants)))
+    return rendered
+
+
+def serve(request, name):
+    rendered = get(name)
+    # Only a gzip copy is pre-rendered, so brotli is not on offer here.
+    gzip_ok = compression.negotiate(request.headers.get("accept-encoding", ""), allow_brotli=False) == "gzip"
+    etag = rendered.etag[:-1] + '-gz"' if gzip_ok else rendered.etag
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding",
+    }
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    if gzip_ok:
+        headers["Content-Encoding"] = "gzip"
+        return Response(rendered.gzipped, media_type="text/html", headers=headers)
+    return Response(rendered.body, media_type="text/html", headers=headers)
+
+
+def warm():
+    # Render every registered page for its current inputs (startup / scheduler).
+    for name in _builders:
+        get(name)
+    return len(_builders)
+
+
+def invalidate(name=None):
+    with _lock:
+        if name:
+            _rendered.pop(name, None)
+        else:
+            _rendered.clear()
+
+
+def stats():
+    return {
+        "pages": sum(len(v) for v in _rendered.values()),
+        "bytes": sum(len(p.body) + len(p.gzipped) for v in _rendered.values() for p in v.values()),
+        "hits": hits,
+        "misses": misses,
+    }
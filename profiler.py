@@ -0,0 +1,67 @@
+# profiler.py
+# On-demand sampling profiler for the live server process. A background thread
+# snapshots every thread's Python stack (sys._current_frames) at a fixed
+# interval and aggregates them into collapsed-stack lines ("a;b;c 42"), the
+# input format of flamegraph.pl and speedscope. Nothing is instrumented, so the
+# cost is a few microseconds per sample and only while a profile is running.
+import os, sys, time, threading
+from collections import Counter
+
+DEFAULT_INTERVAL = 0.005
+MAX_SECONDS = 60
+# Leaf frames that mean "waiting, not working": the event loop's selector, idle
+# worker threads, the log writer, sleeping scheduler jobs.
+IDLE_LEAVES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+    ("handlers.py", "dequeue"),
+}
+
+_running = threading.Lock()
+
+
+class ProfileBusy(Exception):
+    pass
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _is_idle(frame):
+    code = frame.f_code
+    return (os.path.basename(code.co_filename), code.co_name) in IDLE_LEAVES
+
+
+def sample(seconds, interval=DEFAULT_INTERVAL, include_idle=False):
+    """Blocks for `seconds` (run it in a worker thread) and returns
+    (collapsed_text, sample_count). Raises ProfileBusy if one is already running."""
+    if not _running.acquire(blocking=False):
+        raise ProfileBusy()
+    try:
+        seconds = max(0.1, min(float(seconds), MAX_SECONDS))
+        me = threading.get_ident()
+        names = {}
+        stacks = Counter()
+        samples = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names.update((t.ident, t.name) for t in threading.enumerate())
+            for ident, frame in sys._current_frames().items():
+                if ident == me or (not include_idle and _is_idle(frame)):
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                labels.append(names.get(ident, f"thread-{ident}"))
+                stacks[";".join(reversed(labels))] += 1
+            samples += 1
+            time.sleep(interval)
+        lines = [f"{stack} {count}" for stack, count in stacks.most_common()]
+        return "\n".join(lines) + "\n", samples
+    finally:
+        _running.release()
@@ -0,0 +1,93 @@
+# qr.py
+# Waybill QR codes. The module matrix for a reference is built once and kept in
+# an in-process LRU; generate_pdf draws it straight onto the page as vector
+# rectangles, so a booking no longer writes a PNG and reads it back. The PNG is
+# only rendered (and kept under static/qrcodes/) when someone asks for it.
+import os, threading
+from collections import OrderedDict
+
+CONFIRM_URL = "https://hazmat-collection.onrender.com/confirm/"
+PNG_DIR = "static/qrcodes"
+# qrcode.make() defaults, so lazily rendered PNGs match the ones written before.
+BOX_SIZE = 10
+BORDER = 4
+MAX_ENTRIES = 512
+
+_entries = OrderedDict()
+_lock = threading.Lock()
+hits = 0
+misses = 0
+
+
+def url_for(reference):
+    return f"{CONFIRM_URL}{reference}"
+
+
+def matrix(reference):
+    """Rows of booleans (True = dark), quiet zone included."""
+    global hits, misses
+    with _lock:
+        rows = _entries.get(reference)
+        if rows is not None:
+            _entries.move_to_end(reference)
+            hits += 1
+            return rows
+        misses += 1
+    import qrcode
+    code = qrcode.QRCode(box_size=BOX_SIZE, border=BORDER)
+    code.add_data(url_for(reference))
+    code.make(fit=True)
+    rows = tuple(tuple(row) for row in code.get_matrix())
+    with _lock:
+        _entries[reference] = rows
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+    return rows
+
+
+def pixel_size(reference):
+    # Edge length of the PNG rendering, in pixels.
+    return len(matrix(reference)) * BOX_SIZE
+
+
+def draw(canvas, reference, x, y, size):
+    """Draws the code as a size x size square with its lower-left corner at
+    (x, y): one filled path, one rectangle per horizontal run of dark modules."""
+    rows = matrix(reference)
+    module = size / len(rows)
+    path = canvas.beginPath()
+    for r, row in enumerate(rows):
+        top = y + size - (r + 1) * module
+        start = None
+        for c, dark in enumerate(row + (False,)):
+            if dark and start is None:
+                start = c
+            elif not dark and start is not None:
+                path.rect(x + start * module, top, (c - start) * module, module)
+                start = None
+    canvas.saveState()
+    canvas.setFillColorRGB(1, 1, 1)
+    canvas.rect(x, y, size, size, stroke=0, fill=1)
+    canvas.setFillColorRGB(0, 0, 0)
+    canvas.drawPath(path, stroke=0, fill=1)
+    canvas.restoreState()
+
+
+def png_path(reference):
+    """Renders the PNG on first request and returns its path."""
+    path = os.path.join(PNG_DIR, f"qr_{reference}.png")
+    if not os.path.exists(path):
+        from PIL import Image
+        rows = matrix(reference)
+        image = Image.new("1", (len(rows), len(rows)))
+        image.putdata([0 if dark else 1 for row in rows for dark in row])
+        image = image.resize((len(rows) * BOX_SIZE,) * 2, Image.NEAREST)
+        os.makedirs(PNG_DIR, exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        image.save(tmp, format="PNG")
+        os.replace(tmp, path)
+    return path
+
+
+def stats():
+    return {"entries": len(_entries), "hits": hits, "misses": misses}
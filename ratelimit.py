@@ -0,0 +1,152 @@
+# ratelimit.py
+# In-process admission control for the endpoints that send mail, geocode or
+# write files: token buckets per client IP, per client_id cookie and one global
+# bucket, plus a bounded concurrency gate for /submit.
+import os, math, time, threading, asyncio, ipaddress
+from collections import OrderedDict
+
+
+def _limit(name, default):
+    # "<requests>/<seconds>", e.g. "10/60" = 10 requests per minute (burst of 10)
+    value = os.getenv(name, default)
+    count, seconds = value.split("/")
+    return int(count), float(seconds)
+
+
+class TokenBucket:
+    __slots__ = ("capacity", "rate", "tokens", "updated")
+
+    def __init__(self, capacity, per_seconds):
+        self.capacity = capacity
+        self.rate = capacity / per_seconds
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def take(self, now):
+        """Spend one token; returns 0 on success or the seconds until one is available."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    # Buckets are kept in an LRU so a flood of distinct IPs cannot grow memory unbounded.
+    def __init__(self, per_ip, per_client, global_limit, max_keys=10000):
+        self.per_ip = per_ip
+        self.per_client = per_client
+        self.global_bucket = TokenBucket(*global_limit)
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+        self.rejected = 0
+
+    def _bucket(self, key, limit):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(*limit)
+            self.buckets[key] = bucket
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+        return bucket
+
+    def check(self, ip, client_id=None):
+        """Returns 0 if the request may proceed, else a Retry-After in seconds."""
+        now = time.monotonic()
+        with self.lock:
+            wait = self._bucket(("ip", ip), self.per_ip).take(now)
+            if not wait and client_id:
+                wait = self._bucket(("client", client_id), self.per_client).take(now)
+            if not wait:
+                wait = self.global_bucket.take(now)
+            if wait:
+                self.rejected += 1
+            return math.ceil(wait) if wait else 0
+
+    def stats(self):
+        return {"tracked_keys": len(self.buckets), "rejected": self.rejected}
+
+
+# Paths (POST) that trigger outbound mail/geocoding and disk writes.
+LIMITED_PATHS = {"/submit", "/submit/bulk", "/api/sendmail", "/embed/complaint", "/embed/rate"}
+
+limiter = RateLimiter(
+    per_ip=_limit("RATE_LIMIT_PER_IP", "10/60"),
+    per_client=_limit("RATE_LIMIT_PER_CLIENT", "30/60"),
+    global_limit=_limit("RATE_LIMIT_GLOBAL", "120/60"),
+)
+
+SUBMIT_CONCURRENCY = int(os.getenv("SUBMIT_CONCURRENCY") or "4")
+# How long a /submit may queue for a slot before being turned away.
+SUBMIT_QUEUE_SECONDS = float(os.getenv("SUBMIT_QUEUE_SECONDS") or "5")
+SUBMIT_RETRY_AFTER = 10
+
+_submit_slots = None
+submit_in_flight = 0
+
+
+def _slots():
+    # Created lazily so the semaphore binds to the running event loop.
+    global _submit_slots
+    if _submit_slots is None:
+        _submit_slots = asyncio.Semaphore(SUBMIT_CONCURRENCY)
+    return _submit_slots
+
+
+async def acquire_submit_slot():
+    global submit_in_flight
+    try:
+        await asyncio.wait_for(_slots().acquire(), timeout=SUBMIT_QUEUE_SECONDS)
+    except asyncio.TimeoutError:
+        return False
+    submit_in_flight += 1
+    return True
+
+
+def release_submit_slot():
+    global submit_in_flight
+    submit_in_flight -= 1
+    _slots().release()
+
+
+def _networks(value):
+    networks = []
+    for item in value.split(","):
+        item = item.strip()
+        if item:
+            networks.append(ipaddress.ip_network(item, strict=False))
+    return networks
+
+
+# Comma-separated addresses or CIDR ranges of the reverse proxies in front of
+# the app (e.g. "10.0.0.0/8" on Render). X-Forwarded-For is only believed when
+# it was handed over by one of them; with none configured it is ignored.
+TRUSTED_PROXIES = _networks(os.getenv("TRUSTED_PROXIES") or "")
+
+
+def _trusted(address):
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXIES)
+
+
+def client_ip(request):
+    # Walk X-Forwarded-For from the right while the hop that added the entry
+    # is a trusted proxy; the first address appended by an untrusted one is
+    # the caller. Anything further left was sent by the client and can be
+    # made up to get a fresh bucket per request.
+    address = request.client.host if request.client else "unknown"
+    forwarded = request.headers.get("x-forwarded-for")
+    if not forwarded or not _trusted(address):
+        return address
+    for hop in reversed([hop.strip() for hop in forwarded.split(",") if hop.strip()]):
+        address = hop
+        if not _trusted(hop):
+            break
+    return address
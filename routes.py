@@ -0,0 +1,172 @@
+# routes.py
+# Orders a driver's collection stops for each pickup day: nearest-neighbour from
+# the driver's start point, then 2-opt over a haversine distance matrix. The
+# order is cached per (driver, day, start cell); assignment and status events
+# drop the entries they affect, and each entry also remembers which stops it was
+# built from, so a change that arrives some other way is still noticed on read.
+import math, sqlite3, threading, time
+from collections import OrderedDict
+import events, geo, dispatch, locations
+
+DB_PATH = "hazmat.db"
+MAX_ENTRIES = 512
+# Stops that are no longer on the road for this driver.
+DONE_STATUSES = ("Collected", "Delivered")
+# 2-opt stops once a full pass shortens the route by less than this.
+MIN_GAIN_KM = 0.01
+MAX_PASSES = 50
+# Today's route starts from the live position; once the driver has moved into
+# another cell of this size the cached order is replanned from there.
+START_CELL_KM = 2.0
+
+_entries = OrderedDict()
+_lock = threading.Lock()
+hits = 0
+misses = 0
+invalidations = 0
+
+
+def optimise(start, points):
+    """Visiting order for points [(lat, lng)] as (indices, leg_km). The route
+    is open: it starts at start (lat, lng), or at whichever stop suits 2-opt
+    when start is None, and does not return. leg_km[i] is the distance into
+    the i-th stop of the order (0 for a free first stop)."""
+    nodes = ([start] if start else []) + list(points)
+    n = len(nodes)
+    dist = [[geo.haversine_km(a[0], a[1], b[0], b[1]) for b in nodes] for a in nodes]
+    # Nearest neighbour from node 0.
+    path, left = [0], set(range(1, n))
+    while left:
+        here = path[-1]
+        nearest = min(left, key=lambda j: (dist[here][j], j))
+        path.append(nearest)
+        left.remove(nearest)
+    # 2-opt: reverse path[i..j] when that shortens it. With a fixed start the
+    # first node never moves; the last edge has no successor on an open route.
+    first = 1 if start else 0
+    for _ in range(MAX_PASSES):
+        gain = 0.0
+        for i in range(first, n - 1):
+            for j in range(i + 1, n):
+                a, b = path[i - 1] if i else None, path[i]
+                c, d = path[j], path[j + 1] if j + 1 < n else None
+                before = (dist[a][b] if a is not None else 0) + (dist[c][d] if d is not None else 0)
+                after = (dist[a][c] if a is not None else 0) + (dist[b][d] if d is not None else 0)
+                if before - after > 1e-9:
+                    path[i:j + 1] = reversed(path[i:j + 1])
+                    gain += before - after
+        if gain < MIN_GAIN_KM:
+            break
+    legs = [dist[path[k - 1]][path[k]] if k else 0.0 for k in range(n)]
+    if start:
+        path, legs = path[1:], legs[1:]
+        offset = 1
+    else:
+        offset = 0
+    return [p - offset for p in path], legs
+
+
+def start_point(code, day, now=None):
+    """Where the driver's day begins: their live position for today's route,
+    else their depot; None for drivers with neither."""
+    now = now or time.time()
+    if day == time.strftime("%Y-%m-%d", time.localtime(now)):
+        position = locations.latest(code)
+        if position and now - position[2] <= dispatch.POSITION_MAX_AGE:
+            return position[0], position[1]
+    depot = dispatch.ROSTER.get(code)
+    return (depot["lat"], depot["lng"]) if depot else None
+
+
+def start_cell(start):
+    if start is None:
+        return None
+    size = START_CELL_KM / geo.KM_PER_DEGREE_LAT
+    return (math.floor(start[0] / size), math.floor(start[1] / size))
+
+
+def _route(code, day, stops):
+    """Cached (start, [(ref, leg_km)]) for one driver-day's stops."""
+    global hits, misses
+    start = start_point(code, day)
+    key = (code, day, start_cell(start))
+    refs = frozenset(stop["ref"] for stop in stops)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and entry[0] == refs:
+            _entries.move_to_end(key)
+            hits += 1
+            return entry[1], entry[2]
+        misses += 1
+    order, legs = optimise(start, [(stop["lat"], stop["lng"]) for stop in stops])
+    route = [(stops[i]["ref"], round(leg, 2)) for i, leg in zip(order, legs)]
+    with _lock:
+        # The same driver-day planned from an earlier cell is stale now.
+        for stale in [k for k in _entries if k[:2] == key[:2] and k != key]:
+            del _entries[stale]
+        _entries[key] = (refs, start, route)
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+    return start, route
+
+
+def driver_days(code):
+    """{day: {"start", "total_km", "jobs"}} for every pickup day on the driver's
+    list. Open stops with coordinates come first, in route order, each with
+    stop (1-based) and leg_km; the rest follow in table order with both None."""
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT reference_number, collection_company, collection_address, pickup_date,
+                   status, collection_lat, collection_lng
+            FROM requests WHERE assigned_driver = ?
+        """, (code,))
+        rows = cursor.fetchall()
+    finally:
+        conn.close()
+    by_day = {}
+    for ref, company, address, pickup, status, lat, lng in rows:
+        by_day.setdefault(pickup, []).append({"hazjnb_ref": ref, "company": company, "address": address,
+                                              "pickup_date": pickup, "status": status, "lat": lat, "lng": lng})
+    days = {}
+    for day in sorted(by_day, key=lambda d: d or "9999-12-31"):
+        jobs = by_day[day]
+        routable = [job for job in jobs if job["lat"] is not None and job["lng"] is not None
+                    and job["status"] not in DONE_STATUSES]
+        start, route = _route(code, day, [{"ref": j["hazjnb_ref"], "lat": j["lat"], "lng": j["lng"]}
+                                          for j in routable]) if routable else (None, [])
+        by_ref = {job["hazjnb_ref"]: job for job in routable}
+        ordered = [{**by_ref[ref], "stop": n, "leg_km": leg} for n, (ref, leg) in enumerate(route, 1)]
+        ordered += [{**job, "stop": None, "leg_km": None} for job in jobs if job["hazjnb_ref"] not in by_ref]
+        days[day] = {"start": start, "total_km": round(sum(leg for _, leg in route), 2), "jobs": ordered}
+    return days
+
+
+def invalidate(drivers=(), refs=()):
+    """Drops cached routes for these drivers, and any route through these refs."""
+    global invalidations
+    drivers, refs = set(drivers), set(refs)
+    with _lock:
+        stale = [key for key, entry in _entries.items() if key[0] in drivers or entry[0] & refs]
+        for key in stale:
+            del _entries[key]
+        invalidations += len(stale)
+
+
+@events.subscribe("assignments")
+def _on_assignments(event):
+    changes = event.get("changes", ())
+    invalidate(drivers=[d for change in changes for d in (change.get("driver"), change.get("previous_driver")) if d],
+               refs=[change["ref"] for change in changes])
+
+
+@events.subscribe("status")
+def _on_status(event):
+    changes = event.get("changes", ())
+    invalidate(drivers=[change["driver"] for change in changes if change.get("driver")],
+               refs=[change["ref"] for change in changes])
+
+
+def stats():
+    return {"entries": len(_entries), "hits": hits, "misses": misses, "invalidations": invalidations}
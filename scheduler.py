@@ -0,0 +1,81 @@
+# scheduler.py
+# Periodic maintenance jobs run inside the app's event loop (started from the
+# lifespan hook): page pre-rendering, cache priming, WAL checkpoints and backup
+# flushes. Blocking jobs run in a worker thread so requests are not stalled.
+import asyncio, time, traceback
+
+
+class Job:
+    def __init__(self, name, interval, func, run_at_start=True):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.run_at_start = run_at_start
+        self.runs = 0
+        self.failures = 0
+        self.last_run = None
+        self.last_duration_ms = None
+        self.last_result = None
+        self.last_error = None
+
+    async def run_once(self):
+        started = time.perf_counter()
+        try:
+            if asyncio.iscoroutinefunction(self.func):
+                self.last_result = await self.func()
+            else:
+                self.last_result = await asyncio.to_thread(self.func)
+            self.last_error = None
+        except Exception as e:
+            self.failures += 1
+            self.last_error = f"{type(e).__name__}: {e}"
+            traceback.print_exc()
+        self.runs += 1
+        self.last_run = time.time()
+        self.last_duration_ms = round((time.perf_counter() - started) * 1000, 1)
+
+    async def loop(self):
+        if not self.run_at_start:
+            await asyncio.sleep(self.interval)
+        while True:
+            await self.run_once()
+            await asyncio.sleep(self.interval)
+
+    def stats(self):
+        return {
+            "interval_s": self.interval,
+            "runs": self.runs,
+            "failures": self.failures,
+            "last_run_age_s": round(time.time() - self.last_run, 1) if self.last_run else None,
+            "last_duration_ms": self.last_duration_ms,
+            "last_result": self.last_result,
+            "last_error": self.last_error,
+        }
+
+
+class Scheduler:
+    def __init__(self):
+        self.jobs = {}
+        self.tasks = []
+
+    def every(self, seconds, name=None, run_at_start=True):
+        # Decorator: @scheduler.every(300) registers func as a periodic job.
+        def decorator(func):
+            self.jobs[name or func.__name__] = Job(name or func.__name__, seconds, func, run_at_start)
+            return func
+        return decorator
+
+    def start(self):
+        self.tasks = [asyncio.create_task(job.loop(), name=f"job:{job.name}") for job in self.jobs.values()]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def stats(self):
+        return {name: job.stats() for name, job in self.jobs.items()}
+
+
+scheduler = Scheduler()
@@ -0,0 +1,107 @@
+# sessions.py
+# Signed session cookie and an in-process cache of client records. The cookie
+# carries the client id and display name under an HMAC, so /api/me and the
+# /client/* endpoints identify the caller without opening SQLite; the LRU
+# answers the remaining by-id lookups and is invalidated on signup.
+import os, time, json, hmac, base64, hashlib, secrets, sqlite3, threading
+from collections import OrderedDict
+
+COOKIE_NAME = "session"
+MAX_AGE = 30 * 24 * 3600
+# Set SESSION_SECRET in production; without it sessions do not survive a restart.
+SECRET = (os.getenv("SESSION_SECRET") or secrets.token_hex(32)).encode()
+DB_PATH = "hazmat.db"
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _unb64(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(payload):
+    return _b64(hmac.new(SECRET, payload.encode(), hashlib.sha256).digest())
+
+
+def make_token(client_id, name):
+    payload = _b64(json.dumps({"id": int(client_id), "name": name, "iat": int(time.time())},
+                              separators=(",", ":")).encode())
+    return f"{payload}.{_sign(payload)}"
+
+
+def read_token(token):
+    """Returns {"id", "name", "iat"} for a valid, unexpired token, else None."""
+    if not token or "." not in token:
+        return None
+    payload, signature = token.rsplit(".", 1)
+    if not hmac.compare_digest(signature, _sign(payload)):
+        return None
+    try:
+        claims = json.loads(_unb64(payload))
+    except ValueError:
+        return None
+    if time.time() - claims.get("iat", 0) > MAX_AGE:
+        return None
+    return claims
+
+
+def current(request):
+    return read_token(request.cookies.get(COOKIE_NAME))
+
+
+def current_client_id(request):
+    claims = current(request)
+    return claims["id"] if claims else None
+
+
+def set_session(response, client_id, name):
+    response.set_cookie(key=COOKIE_NAME, value=make_token(client_id, name),
+                        max_age=MAX_AGE, httponly=True, samesite="lax")
+    return response
+
+
+class ClientCache:
+    # id -> {"id", "name", "email"}, or None for ids known not to exist.
+    def __init__(self, max_entries=2048):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, client_id):
+        client_id = int(client_id)
+        with self.lock:
+            if client_id in self.entries:
+                self.entries.move_to_end(client_id)
+                self.hits += 1
+                return self.entries[client_id]
+            self.misses += 1
+        conn = sqlite3.connect(DB_PATH)
+        row = conn.execute("SELECT id, name, email FROM clients WHERE id = ?", (client_id,)).fetchone()
+        conn.close()
+        record = {"id": row[0], "name": row[1], "email": row[2]} if row else None
+        self.put(client_id, record)
+        return record
+
+    def put(self, client_id, record):
+        with self.lock:
+            self.entries[int(client_id)] = record
+            self.entries.move_to_end(int(client_id))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, client_id=None):
+        with self.lock:
+            if client_id is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(int(client_id), None)
+
+    def stats(self):
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+clients = ClientCache()
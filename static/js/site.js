@@ -0,0 +1,15 @@
+// Shows the logged-in client's name in the nav, or a login link.
+document.addEventListener("DOMContentLoaded", function() {
+  fetch("/api/me")
+    .then(res => res.json())
+    .then(data => {
+      const navSpan = document.getElementById("client-nav");
+      if (!navSpan) return;
+      if (data.name) {
+        navSpan.innerText = data.name;
+      } else {
+        navSpan.innerHTML = '<a href="/embed/login">Login / Sign Up</a>';
+      }
+    })
+    .catch(err => console.error("⚠️ Failed to fetch client info", err));
+});